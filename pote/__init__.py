@@ -5,10 +5,16 @@ Python Online Test Executor core library.
 import logging
 import os.path
 
+from .agent import PoteAgent, PoteAgentServer
 from .archive import PoteArchive
-from .rest import PoteApiServer
+from .cache import PoteResultCache, fingerprint
+from .limits import PoteCgroups
+from .rest import PoteApiServer, PotePooledApiServer
+from .retention import PoteRetention
 from .tests import PoteTests
 from .scheduler import PoteScheduler
+from .supervisor import PoteSupervisor
+from .warden import LAUNCHER_EXEC
 
 
 LOGGER = logging.getLogger(__name__)
@@ -27,12 +33,76 @@ DEF_ARCHIVE_PATH = '/var/lib/pote/archive'
 
 def start_server(bindaddr=None, bindport=None, envos_count=None,
                  envos_path=None, tests_path=None, queue_path=None,
-                 archive_path=None):
+                 archive_path=None, envo_groups=None, group_policy=None,
+                 compress_threshold=None, retention=None, launcher=None,
+                 preload=None, cgroup_path=None, http_workers=None,
+                 dispatch_policy=None, fair_share=None, cache_ttl=None,
+                 cache_size=None, agent_bindaddr=None, agent_port=None,
+                 warden_processes=None, agent_token=None):
     """
     Start Pote server.
 
     :param envos: how many environments to use.
     :type envos: integer
+
+    :param envo_groups: labeled groups of envos.
+    :type envo_groups: NoneType or dict of lists of integers
+
+    :param group_policy: how group jobs are assigned to envos.
+    :type group_policy: NoneType or string
+
+    :param compress_threshold: min size of test output (in bytes)
+        to archive it compressed. None disables compression.
+    :type compress_threshold: NoneType or integer
+
+    :param retention: archive retention policies. Keyword arguments
+        for the pote.retention.PoteRetention constructor.
+    :type retention: NoneType or dict
+
+    :param launcher: how to start tests.
+    :type launcher: NoneType or string
+
+    :param preload: names of modules to preload in zygotes.
+    :type preload: NoneType or list of strings
+
+    :param cgroup_path: path to a delegated cgroup v2 subtree
+        to run tests in.
+    :type cgroup_path: NoneType or string
+
+    :param http_workers: serve HTTP/1.1 with persistent connections
+        by a pool of this many threads. None means a thread per
+        connection.
+    :type http_workers: NoneType or integer
+
+    :param dispatch_policy: how the next job of an envo is picked.
+    :type dispatch_policy: NoneType or string
+
+    :param fair_share: weights of users to share envos by.
+        None disables fair-share.
+    :type fair_share: NoneType or dict of numbers
+
+    :param cache_ttl: how long results of successful jobs are reused
+        by new equal jobs, in seconds. None disables the result cache.
+    :type cache_ttl: NoneType or number
+
+    :param cache_size: max number of results kept in the result cache.
+    :type cache_size: NoneType or integer
+
+    :param agent_bindaddr: IP address to listen to for remote agents.
+        Default is the bindaddr.
+    :type agent_bindaddr: NoneType or string
+
+    :param agent_port: TCP port number to listen to for remote agents.
+        None disables remote agents.
+    :type agent_port: NoneType or integer
+
+    :param agent_token: secret remote agents must present.
+        None accepts any peer of the agent port.
+    :type agent_token: NoneType or string
+
+    :param warden_processes: run wardens in a pool of this many
+        processes. None means wardens are threads of the daemon.
+    :type warden_processes: NoneType or integer
     """
     # Apply defaults
     if bindaddr is None:
@@ -51,14 +121,87 @@ def start_server(bindaddr=None, bindport=None, envos_count=None,
         archive_path = DEF_ARCHIVE_PATH
     LOGGER.info('starting...')
     # initialize archive storage
-    archive = PoteArchive(archive_path)
+    archive = PoteArchive(archive_path, compress_threshold)
+    if retention:
+        PoteRetention.running(archive, **retention)
     # create interface to the tests storage
     tests = PoteTests(tests_path)
+    tests.watch()
+    # spawn test process supervisor
+    supervisor = PoteSupervisor()
+    supervisor.start()
+    cgroups = None
+    if cgroup_path is not None:
+        cgroups = PoteCgroups(cgroup_path)
+    result_cache = None
+    if cache_ttl is not None:
+        # preloaded modules can change the behaviour of tests
+        result_cache = PoteResultCache(
+            archive, cache_ttl, cache_size,
+            fingerprint(launcher or LAUNCHER_EXEC, preload))
     # spawn Scheduler thread
     scheduler = PoteScheduler(envos_count, envos_path,
-                              queue_path, tests, archive)
+                              queue_path, tests, archive, supervisor,
+                              envo_groups, group_policy,
+                              launcher, preload, cgroups, dispatch_policy,
+                              fair_share, result_cache, warden_processes)
     scheduler.start()
+    if agent_port is not None:
+        PoteAgentServer.running(
+            scheduler, agent_bindaddr or bindaddr, agent_port, agent_token)
     # start RESTful httpd
-    rest_server = PoteApiServer(bindaddr, bindport, scheduler,
-                                tests, archive)
+    if http_workers:
+        rest_server = PotePooledApiServer(bindaddr, bindport, scheduler,
+                                          tests, archive, http_workers)
+    else:
+        rest_server = PoteApiServer(bindaddr, bindport, scheduler,
+                                    tests, archive)
     rest_server.serve_forever()
+
+
+def start_agent(server, name, envos_count=None, envos_path=None,
+                tests_path=None, launcher=None, preload=None,
+                cgroup_path=None, token=None):
+    """
+    Start remote warden agent.
+
+    :param server: address of the daemon agent port
+    :type server: tuple of (string, integer)
+
+    :param name: agent name, unique among agents of the daemon
+    :type name: string
+
+    :param envos_count: how many environments to use.
+    :type envos_count: NoneType or integer
+
+    :param launcher: how to start tests.
+    :type launcher: NoneType or string
+
+    :param preload: names of modules to preload in zygotes.
+    :type preload: NoneType or list of strings
+
+    :param cgroup_path: path to a delegated cgroup v2 subtree
+        to run tests in.
+    :type cgroup_path: NoneType or string
+
+    :param token: secret to present to the daemon
+    :type token: NoneType or string
+    """
+    # Apply defaults
+    if envos_count is None:
+        envos_count = DEF_ENVOS_COUNT
+    if envos_path is None:
+        envos_path = DEF_ENVOS_PATH
+    if tests_path is None:
+        tests_path = DEF_TESTS_PATH
+    LOGGER.info('starting agent %r...', name)
+    tests = PoteTests(tests_path)
+    tests.watch()
+    supervisor = PoteSupervisor()
+    supervisor.start()
+    cgroups = None
+    if cgroup_path is not None:
+        cgroups = PoteCgroups(cgroup_path)
+    agent = PoteAgent(server, name, envos_count, envos_path, tests,
+                      supervisor, launcher, preload, cgroups, token=token)
+    agent.serve_forever()
@@ -0,0 +1,902 @@
+"""
+Remote warden agents.
+
+An agent is a process running wardens for its own envos, on another
+host or locally. It connects to the agent port of the daemon and
+talks to the scheduler over the connection, one JSON object per line:
+
+  agent -> daemon:
+    {"hello": "<agent name>", "envos": <count>, "token": "<token>"},
+      first; the token is checked when the daemon is given one;
+    {"started": "<job id>"}
+    {"stopped": "<job id>", "timing": {...}, "usage": {...}}
+    {"done": "<job id>"}
+    {"failed": "<job id>", "reason": "<reason>"}
+    {"result": "<job id>", "size": <bytes>}, followed by the
+      test output of the given size (size is null without output),
+      or {"result": "<job id>", "path": "<path>"} from warden
+      processes of the daemon host (see PoteWardenPool);
+  daemon -> agent:
+    {"envos": [<envo id>, ...]}, IDs of the agent envos in the daemon,
+      reply to "hello";
+    {"job": {...}}, a job for an envo with the ID in job['envo'].
+  both ways:
+    {"heartbeat": null}
+
+A side which does not hear from the peer for HEARTBEAT_TIMEOUT seconds
+closes the connection. The scheduler re-queues the jobs of envos of
+a lost agent. An agent reconnecting with the same name gets the same
+envo IDs.
+
+The same protocol is used by warden processes started by the daemon
+for its own envos, over socket pairs.
+
+Anyone who can connect to the agent port can run jobs as an agent and
+see their data, unless the daemon and its agents share a token.
+"""
+
+import errno
+import hmac
+import json
+import logging
+import os
+import os.path
+import Queue
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from .cleaner import TRASH_DIR, PoteCleaner
+from .limits import PoteCgroups
+from .supervisor import PoteSupervisor
+from .tests import PoteTests
+from .warden import PoteWarden
+
+
+# default TCP port number the daemon listens to for agents
+DEF_AGENT_PORT = 8902
+
+# how often to send heartbeats, in seconds
+HEARTBEAT_PERIOD = 5
+
+# how long the peer can be silent before the connection is dropped
+HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_PERIOD
+
+# how long an agent waits before reconnecting, in seconds
+RECONNECT_PERIOD = 5
+
+# max size of data read from the connection at once
+CHUNK_SIZE = 64 * 1024
+
+# how long to wait for a lost warden process to exit, in seconds
+EXIT_TIMEOUT = 5
+
+# how long to wait before restarting a warden process, in seconds
+RESPAWN_PERIOD = 1
+
+
+def read_token(path):
+    """
+    Read the agent token from the file.
+
+    :param path: path to a file with the token
+    :type path: string
+
+    :rtype: string
+
+    :raise ValueError: when the file cannot be read or holds
+        no token.
+    """
+    try:
+        with open(path) as fdescr:
+            token = fdescr.read().strip()
+    except IOError as exc:
+        raise ValueError(str(exc))
+    if not token:
+        raise ValueError('no token in %r' % path)
+    return token
+
+
+class PoteChannel(object):
+    """
+    Connection between an agent and the daemon. Messages can be sent
+    by any thread, but received by one thread only.
+    """
+
+    def __init__(self, sock):
+        """
+        Constructor.
+
+        :param sock: connected socket
+        :type sock: socket.socket
+        """
+        self.sock = sock
+        self.sock.settimeout(HEARTBEAT_PERIOD)
+        self.buf = ''
+        self.lock = threading.Lock()
+        self.last_sent = self.last_received = time.time()
+
+    def send(self, message, path=None):
+        """
+        Send the message, followed by contents of the file.
+
+        :param message: message to send
+        :type message: dict
+
+        :param path: path to a file to send
+        :type path: NoneType or string
+
+        :raise socket.error: when the connection is lost.
+        """
+        with self.lock:
+            self.sock.sendall(json.dumps(message) + '\n')
+            if path is not None:
+                with open(path, 'rb') as fdescr:
+                    for chunk in iter(lambda: fdescr.read(CHUNK_SIZE), ''):
+                        self.sock.sendall(chunk)
+            self.last_sent = time.time()
+
+    def receive(self):
+        """
+        Return the next message, skipping heartbeats. Heartbeats
+        are sent while waiting.
+
+        :rtype: dict
+
+        :raise socket.error: when the connection is lost.
+        """
+        while True:
+            while '\n' not in self.buf:
+                self.buf += self._recv()
+            (line, self.buf) = self.buf.split('\n', 1)
+            message = json.loads(line)
+            if 'heartbeat' not in message:
+                return message
+
+    def receive_file(self, path, size):
+        """
+        Receive the file contents sent after a message.
+
+        :param path: path to a file to write
+        :type path: string
+
+        :param size: file size, in bytes
+        :type size: integer
+
+        :raise socket.error: when the connection is lost.
+        """
+        with open(path, 'wb') as fdescr:
+            while size > 0:
+                if not self.buf:
+                    self.buf = self._recv()
+                chunk = self.buf[:size]
+                self.buf = self.buf[size:]
+                fdescr.write(chunk)
+                size -= len(chunk)
+
+    def close(self):
+        """
+        Close the connection.
+        """
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+    def _recv(self):
+        """
+        Return the next portion of data from the connection.
+        Heartbeats are sent while waiting.
+
+        :rtype: string
+
+        :raise socket.error: when the connection is lost.
+        """
+        while True:
+            if time.time() - self.last_sent >= HEARTBEAT_PERIOD:
+                self.send({'heartbeat': None})
+            try:
+                data = self.sock.recv(CHUNK_SIZE)
+            except socket.timeout:
+                if time.time() - self.last_received > HEARTBEAT_TIMEOUT:
+                    raise socket.error(errno.ETIMEDOUT, 'peer is silent')
+                continue
+            if not data:
+                raise socket.error(errno.ECONNRESET, 'connection closed')
+            self.last_received = time.time()
+            return data
+
+
+# ----------------------------------------------------------------------
+# Daemon side
+
+
+class PoteAgentServer(threading.Thread):
+    """
+    Thread accepting connections of agents.
+    """
+
+    def __init__(self, scheduler, bindaddr, bindport, token=None):
+        """
+        Constructor.
+
+        :param scheduler: interface to the Scheduler thread.
+        :type scheduler: pote.PoteScheduler
+
+        :param bindaddr: IP address to listen to
+        :type bindaddr: string
+
+        :param bindport: TCP port number to listen to
+        :type bindport: integer
+
+        :param token: secret agents must present. None accepts
+            any agent.
+        :type token: NoneType or string
+        """
+        threading.Thread.__init__(self)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.daemon = True
+        self.scheduler = scheduler
+        self.token = token
+        if token is None:
+            self.logger.warning(
+                'no agent token: any peer of %s:%r can join as an agent',
+                bindaddr, bindport)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((bindaddr, bindport))
+        self.sock.listen(16)
+
+    @classmethod
+    def running(cls, *args, **kwargs):
+        """
+        Create and start a new agent server thread instance.
+        Return a link to the object created.
+        See constructor description for further details
+        about arguments.
+
+        :rtype: pote.agent.PoteAgentServer
+        """
+        instance = cls(*args, **kwargs)
+        instance.start()
+        return instance
+
+    def run(self):
+        """
+        Main thread activity.
+        """
+        while True:
+            (sock, address) = self.sock.accept()
+            self.logger.info('agent connected from %r', address)
+            PoteAgentLink.running(
+                self.scheduler, sock, address, token=self.token)
+
+
+class PoteAgentLink(threading.Thread):
+    """
+    Thread serving the connection of an agent: passes jobs to the
+    agent and its reports to the scheduler.
+
+    Messages to the agent are queued by the scheduler and sent by
+    a sender thread of the link, so a slow or hung agent does not
+    hold the scheduler. A failed send drops the connection and the
+    agent is reported lost.
+    """
+
+    def __init__(self, scheduler, sock, address, envos=None, token=None):
+        """
+        Constructor.
+
+        :param scheduler: interface to the Scheduler thread.
+        :type scheduler: pote.PoteScheduler
+
+        :param sock: connected socket
+        :type sock: socket.socket
+
+        :param address: address of the agent
+        :type address: tuple or string
+
+        :param envos: envo IDs of a warden process of the daemon.
+            The process shares the filesystem with the daemon.
+            None for remote agents.
+        :type envos: NoneType or list of integers
+
+        :param token: secret the agent must present in its hello.
+            None accepts any agent.
+        :type token: NoneType or string
+        """
+        threading.Thread.__init__(self)
+        self.logger = logging.getLogger(
+            '%s%r' % (self.__class__.__name__, address))
+        self.daemon = True
+        self.scheduler = scheduler
+        self.channel = PoteChannel(sock)
+        self.name = None
+        self.fixed_envos = envos
+        self.token = token
+        # envo IDs assigned to the agent by the scheduler
+        self.envos = []
+        # jobs given to the agent: job ID -> path for the test output
+        self.jobs = {}
+        self.lock = threading.Lock()
+        # messages to send to the agent; None stops the sender
+        self.outbox = Queue.Queue()
+        # True when the connection is lost
+        self.closed = False
+
+    @classmethod
+    def running(cls, *args, **kwargs):
+        """
+        Create and start a new agent link thread instance.
+        Return a link to the object created.
+        See constructor description for further details
+        about arguments.
+
+        :rtype: pote.agent.PoteAgentLink
+        """
+        instance = cls(*args, **kwargs)
+        instance.start()
+        return instance
+
+    def registered(self, envos):
+        """
+        Tell the agent the IDs of its envos.
+        Called by the scheduler.
+
+        :param envos: envo IDs
+        :type envos: list of integers
+        """
+        self.envos = envos
+        self.outbox.put({'envos': envos})
+
+    def execute(self, job, output_path):
+        """
+        Queue the job to be sent to the agent. Return False
+        when the agent is lost.
+
+        :param job: job data object
+        :type job: dict
+
+        :param output_path: where to put the test output
+        :type output_path: string
+
+        :rtype: boolean
+        """
+        with self.lock:
+            if self.closed:
+                return False
+            self.jobs[job['id']] = output_path
+        self.outbox.put({'job': job})
+        return True
+
+    def run(self):
+        """
+        Main thread activity.
+        """
+        sender = threading.Thread(target=self._sender)
+        sender.daemon = True
+        sender.start()
+        try:
+            hello = self.channel.receive()
+            if self.token is not None and not hmac.compare_digest(
+                    str(hello.get('token')), self.token):
+                self.logger.warning('agent %r rejected: bad token',
+                                    hello.get('hello'))
+                return
+            (name, count) = (hello['hello'], hello['envos'])
+            if not isinstance(name, basestring) or \
+                    not isinstance(count, int) or count < 1:
+                raise ValueError('bad hello: %r' % hello)
+            self.name = name
+            self.logger.info('agent %r with %r envos', self.name, count)
+            self.scheduler.notify_agent_joined(self.name, count, self)
+            while True:
+                self._handle(self.channel.receive())
+        except socket.error as exc:
+            self.logger.warning('agent %r is lost: %s', self.name, exc)
+        except Exception:
+            self.logger.error('agent %r link crashed', self.name,
+                              exc_info=True)
+        finally:
+            with self.lock:
+                self.closed = True
+            self.outbox.put(None)
+            self.channel.close()
+            if self.name is not None:
+                self.scheduler.notify_agent_lost(self)
+
+    def _sender(self):
+        """
+        Sender thread activity.
+        """
+        while True:
+            message = self.outbox.get()
+            if message is None:
+                return
+            try:
+                self.channel.send(message)
+            except socket.error as exc:
+                self.logger.warning(
+                    'failed to send to agent %r: %s', self.name, exc)
+                # the main thread of the link reports the agent lost
+                self.channel.close()
+                return
+
+    def _handle(self, message):
+        """
+        Pass the report of the agent to the scheduler.
+        Reports on jobs not given to this connection are ignored.
+
+        :param message: report
+        :type message: dict
+        """
+        for kind in ('started', 'stopped', 'done', 'failed', 'result'):
+            if kind in message:
+                job_id = message[kind]
+                break
+        else:
+            self.logger.warning('unknown message: %r', message)
+            return
+        with self.lock:
+            output_path = self.jobs.get(job_id)
+        if output_path is None:
+            self.logger.warning('report on unknown job: %r', message)
+            if message.get('size'):
+                self.channel.receive_file(os.devnull, message['size'])
+            return
+        if kind == 'started':
+            self.scheduler.notify_job_started(job_id)
+        elif kind == 'stopped':
+            self.scheduler.notify_job_stopped(
+                job_id, message.get('timing'), message.get('usage'))
+        elif kind == 'done':
+            self.scheduler.notify_job_done(job_id)
+        elif kind == 'failed':
+            self.scheduler.notify_job_failed(job_id, message.get('reason'))
+        else:
+            if self.fixed_envos is not None and 'path' in message:
+                # the output is left in place by a warden process
+                output_path = message['path']
+            elif message.get('size') is None:
+                output_path = None
+            else:
+                directory = os.path.dirname(output_path)
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                self.channel.receive_file(output_path, message['size'])
+            with self.lock:
+                del self.jobs[job_id]
+            self.scheduler.notify_job_result(job_id, output_path)
+
+
+class PoteRemoteWarden(object):
+    """
+    Proxy of a warden of an agent envo, with the part of the
+    pote.PoteWarden interface used by the scheduler.
+    """
+
+    def __init__(self, link, output_path):
+        """
+        Constructor.
+
+        :param link: connection of the agent or None when the agent
+            is not connected.
+        :type link: NoneType or pote.agent.PoteAgentLink
+
+        :param output_path: where to put the test output
+        :type output_path: string
+        """
+        self.link = link
+        self.output_path = output_path
+
+    def execute(self, job):
+        """
+        Give a job to the agent.
+
+        :param job: job data object
+        :type job: dict
+
+        :rtype: boolean
+        """
+        if self.link is None:
+            return False
+        return self.link.execute(job, self.output_path)
+
+
+# ----------------------------------------------------------------------
+# Agent side
+
+
+class PoteAgent(object):
+    """
+    Agent running wardens for its envos on behalf of a remote
+    scheduler. Implements the part of the scheduler interface
+    used by wardens.
+    """
+
+    def __init__(self, server, name, envos_count, envos_path, tests,
+                 supervisor, launcher=None, preload=None, cgroups=None,
+                 first_envo=0, local=False, token=None):
+        """
+        Constructor.
+
+        :param server: address of the daemon agent port
+        :type server: tuple of (string, integer)
+
+        :param name: agent name, unique among agents of the daemon
+        :type name: string
+
+        :param envos_count: how many environments to use.
+        :type envos_count: integer
+
+        :param envos_path: base path for work directories of environments
+        :type envos_path: string
+
+        :param tests: interface to the available tests storage.
+        :type tests: pote.PoteTests
+
+        :param supervisor: interface to the test process supervisor.
+        :type supervisor: pote.supervisor.PoteSupervisor
+
+        :param launcher: how wardens start tests. Default is exec.
+        :type launcher: NoneType or string,
+            one of pote.warden.KNOWN_LAUNCHERS
+
+        :param preload: names of modules to preload in zygotes.
+        :type preload: NoneType or list of strings
+
+        :param cgroups: cgroup subtree to run tests in.
+        :type cgroups: NoneType or pote.limits.PoteCgroups
+
+        :param first_envo: number of the first envo, used to name
+            the work directories of the environments
+        :type first_envo: integer
+
+        :param local: the agent is a warden process of the daemon,
+            sharing the filesystem with it. Test outputs are left
+            in place instead of being sent over the connection.
+        :type local: boolean
+
+        :param token: secret to present to the daemon
+        :type token: NoneType or string
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.server = server
+        self.local = local
+        self.name = name
+        self.token = token
+        cleaner = PoteCleaner.running(os.path.join(envos_path, TRASH_DIR))
+        self.wardens = [
+            PoteWarden.running(
+                self, supervisor, cleaner, tests,
+                os.path.join(envos_path, str(envo)),
+                envo, launcher, preload, cgroups)
+            for envo in range(first_envo, first_envo + envos_count)]
+        self.channel = None
+        # daemon envo ID -> local warden
+        self.envos = {}
+
+    def serve_forever(self):
+        """
+        Run jobs of the daemon, reconnecting when the connection
+        is lost.
+        """
+        while True:
+            try:
+                self.serve(socket.create_connection(self.server))
+            except socket.error as exc:
+                self.logger.warning(
+                    'connection to %r lost: %s', self.server, exc)
+            except Exception:
+                self.logger.error('agent crashed', exc_info=True)
+            self.channel = None
+            time.sleep(RECONNECT_PERIOD)
+
+    def notify_job_started(self, job_id):
+        """
+        Tell the scheduler the job just started for execution.
+
+        :param job_id: job identifier.
+        :type job_id: string
+        """
+        self._send({'started': job_id})
+
+    def notify_job_stopped(self, job_id, timing=None, usage=None):
+        """
+        Tell the scheduler the job is finished.
+
+        :param job_id: job identifier.
+        :type job_id: string
+
+        :param timing: durations (in seconds) of job execution stages
+        :type timing: NoneType or dict
+
+        :param usage: resources used by the test process
+        :type usage: NoneType or dict
+        """
+        self._send({'stopped': job_id, 'timing': timing, 'usage': usage})
+
+    def notify_job_done(self, job_id):
+        """
+        Tell the scheduler the job is succeeded.
+
+        :param job_id: job identifier.
+        :type job_id: string
+        """
+        self._send({'done': job_id})
+
+    def notify_job_failed(self, job_id, reason=None):
+        """
+        Tell the scheduler the job execution is failed.
+
+        :param job_id: job identifier.
+        :type job_id: string
+
+        :param reason: failure reason.
+        :type reason: string
+        """
+        self._send({'failed': job_id, 'reason': reason})
+
+    def notify_job_result(self, job_id, data=None):
+        """
+        Send the test output to the scheduler.
+
+        :param job_id: job identifier.
+        :type job_id: string
+
+        :param data: path to a file with the test output
+        :type data: NoneType or string
+        """
+        if self.local:
+            self._send({'result': job_id, 'path': data})
+            return
+        size = None
+        if data is not None and os.path.isfile(data):
+            size = os.path.getsize(data)
+        self._send({'result': job_id, 'size': size},
+                   None if size is None else data)
+
+    def serve(self, sock):
+        """
+        Run jobs of the daemon until the connection is lost.
+
+        :param sock: socket connected to the daemon
+        :type sock: socket.socket
+
+        :raise socket.error: when the connection is lost.
+        """
+        # reports on jobs of the lost connection are dropped, so
+        # the wardens must finish them before envos are offered again
+        for warden in self.wardens:
+            warden.busy.acquire()
+            warden.busy.release()
+        channel = PoteChannel(sock)
+        try:
+            channel.send({'hello': self.name, 'envos': len(self.wardens),
+                          'token': self.token})
+            envos = channel.receive()['envos']
+            self.envos = dict(zip(envos, self.wardens))
+            self.channel = channel
+            self.logger.info('connected as envos %r', envos)
+            while True:
+                job = channel.receive()['job']
+                warden = self.envos[job['envo']]
+                if not warden.execute(job):
+                    self.logger.error('envo #%r is busy', job['envo'])
+                    self.notify_job_failed(job['id'], 'envo is busy')
+                    self.notify_job_result(job['id'])
+        finally:
+            self.channel = None
+            channel.close()
+
+    def _send(self, message, path=None):
+        """
+        Send the message to the daemon. The message is dropped
+        when the daemon is not connected.
+
+        :param message: message to send
+        :type message: dict
+
+        :param path: path to a file to send after the message
+        :type path: NoneType or string
+        """
+        channel = self.channel
+        if channel is None:
+            self.logger.debug('not connected. Dropped %r', message)
+            return
+        try:
+            channel.send(message, path)
+        except socket.error:
+            self.logger.debug('failed to send %r', message, exc_info=True)
+
+
+# ----------------------------------------------------------------------
+# Warden processes
+
+
+class PoteWardenPool(threading.Thread):
+    """
+    Thread running the wardens of the daemon envos in a pool of
+    processes, so the execution load does not contend with the
+    scheduler and the RESTful server for the GIL of the daemon.
+    Envos are split between the processes evenly. A process which
+    exits is restarted; the scheduler re-queues its jobs as for
+    a lost agent.
+
+    Every process runs in its own process group and cgroup subtree,
+    so the tests it has left running are killed before the restart
+    and do not run in envos reused by the new process.
+    """
+
+    def __init__(self, scheduler, supervisor, processes, envos_count,
+                 envos_path, tests_path, launcher=None, preload=None,
+                 cgroup_path=None):
+        """
+        Constructor.
+
+        :param scheduler: interface to the Scheduler thread.
+        :type scheduler: pote.PoteScheduler
+
+        :param supervisor: interface to the test process supervisor.
+        :type supervisor: pote.supervisor.PoteSupervisor
+
+        :param processes: how many processes to start
+        :type processes: integer
+
+        :param envos_count: how many environments to run.
+        :type envos_count: integer
+
+        :param envos_path: base path for work directories of environments
+        :type envos_path: string
+
+        :param tests_path: path to a directory with tests.
+        :type tests_path: string
+
+        :param launcher: how wardens start tests. Default is exec.
+        :type launcher: NoneType or string,
+            one of pote.warden.KNOWN_LAUNCHERS
+
+        :param preload: names of modules to preload in zygotes.
+        :type preload: NoneType or list of strings
+
+        :param cgroup_path: path to a delegated cgroup v2 subtree
+            to run tests in.
+        :type cgroup_path: NoneType or string
+        """
+        threading.Thread.__init__(self)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.daemon = True
+        self.scheduler = scheduler
+        self.supervisor = supervisor
+        processes = max(min(processes, envos_count), 1)
+        # contiguous ranges of envos of the processes
+        bounds = [envos_count * index // processes
+                  for index in range(processes + 1)]
+        self.chunks = [range(bounds[index], bounds[index + 1])
+                       for index in range(processes)]
+        # cgroup subtrees of the processes
+        self.cgroups = None
+        if cgroup_path is not None:
+            self.cgroups = [
+                PoteCgroups(os.path.join(cgroup_path, 'worker%d' % index))
+                for index in range(processes)]
+        self.config = {'envos_path': envos_path,
+                       'tests_path': tests_path,
+                       'launcher': launcher,
+                       'preload': preload,
+                       'cgroup_path': cgroup_path,
+                       'loglevel': logging.getLogger().getEffectiveLevel()}
+
+    @classmethod
+    def running(cls, *args, **kwargs):
+        """
+        Create and start a new warden pool thread instance.
+        Return a link to the object created.
+        See constructor description for further details
+        about arguments.
+
+        :rtype: pote.agent.PoteWardenPool
+        """
+        instance = cls(*args, **kwargs)
+        instance.start()
+        return instance
+
+    def run(self):
+        """
+        Main thread activity.
+        """
+        threads = [threading.Thread(target=self._keep, args=(index,))
+                   for index in range(len(self.chunks))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _keep(self, index):
+        """
+        Run the warden process and restart it when it exits.
+
+        :param index: process number
+        :type index: integer
+        """
+        name = 'worker#%d' % index
+        envos = self.chunks[index]
+        config = dict(self.config, name=name, first_envo=envos[0],
+                      envos_count=len(envos))
+        cgroups = None
+        if self.cgroups is not None:
+            cgroups = self.cgroups[index]
+            config['cgroup_path'] = cgroups.path
+        # the daemon is not necessary started from the package parent
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__)))
+        while True:
+            (parent, child) = socket.socketpair()
+            try:
+                proc = self.supervisor.popen(
+                    ['python', '-m', __name__, json.dumps(config)],
+                    stdin=child.fileno(), env=env, close_fds=True,
+                    preexec_fn=os.setsid)
+            except OSError:
+                self.logger.error('failed to start %s', name, exc_info=True)
+                parent.close()
+                child.close()
+                time.sleep(RESPAWN_PERIOD)
+                continue
+            child.close()
+            self.logger.debug('%s started with pid %r', name, proc.pid)
+            link = PoteAgentLink.running(
+                self.scheduler, parent, name, envos)
+            link.join()
+            # the process group includes the tests started by the process
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self.supervisor.watch(proc, time.time() + EXIT_TIMEOUT)
+            self.logger.error('%s exited with %r', name, proc.returncode)
+            if cgroups is not None:
+                # tests which have left the process group
+                cgroups.clear()
+            time.sleep(RESPAWN_PERIOD)
+
+
+def main():
+    """
+    Warden process main function. The process is connected
+    to the daemon with its stdin.
+    """
+    config = json.loads(sys.argv[1])
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s ' + config['name'] +
+        ' %(name)s %(message)s', level=config['loglevel'])
+    sock = socket.fromfd(0, socket.AF_UNIX, socket.SOCK_STREAM)
+    os.close(0)
+    tests = PoteTests(config['tests_path'])
+    tests.watch()
+    supervisor = PoteSupervisor()
+    supervisor.start()
+    cgroups = None
+    if config['cgroup_path'] is not None:
+        cgroups = PoteCgroups(config['cgroup_path'])
+    agent = PoteAgent(
+        None, config['name'], config['envos_count'], config['envos_path'],
+        tests, supervisor, config['launcher'], config['preload'], cgroups,
+        config['first_envo'], local=True)
+    try:
+        agent.serve(sock)
+    except socket.error as exc:
+        # the daemon is gone
+        agent.logger.info('connection lost: %s', exc)
+    # wardens are not daemon threads
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,27 +2,132 @@
 Interface to the persistent storage of finished tasks.
 """
 
+import errno
+import fcntl
+import gzip
 import json
 import logging
 import os
 import os.path
+import Queue
 import shutil
+import sqlite3
+import StringIO
+import tarfile
+import threading
+import time
+
+from .metrics import METRICS
+from .status import STATUS_DONE
+
+
+# name of the index database file, kept in the archive root
+INDEX_NAME = 'index.sqlite'
+
+# name of the file with test output in a job directory
+LOG_NAME = 'stdout.log'
+
+# suffix of compressed test outputs
+GZIP_SUFFIX = '.gz'
+
+# logs are compressed by a background thread, so the ratio is
+# preferred to speed
+GZIP_LEVEL = 6
+
+# suffix of a compressed test output being written
+PARTIAL_SUFFIX = '.part'
+
+# directory inside the archive root with packed segments
+SEGMENTS_DIR = 'segments'
+
+# suffix of packed segment files
+SEGMENT_SUFFIX = '.tar'
+
+# ioctl() request to clone file extents (Linux)
+FICLONE = 0x40049409
+
+# columns of the index table which can be used as dump() filters
+FILTERS = ('user', 'test', 'envo', 'status')
+
+METRICS.histogram(
+    'pote_archive_write_seconds',
+    'Time to move the job and its output to the archive')
+
+INDEX_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS jobs ('
+    ' id TEXT PRIMARY KEY,'
+    ' time REAL NOT NULL,'
+    ' user TEXT,'
+    ' test TEXT,'
+    ' envo INTEGER,'
+    ' status TEXT,'
+    ' meta TEXT NOT NULL,'
+    ' size INTEGER NOT NULL DEFAULT 0,'
+    ' segment TEXT,'
+    ' log_offset INTEGER,'
+    ' log_length INTEGER,'
+    ' duration REAL,'
+    ' cache_key TEXT,'
+    ' cached TEXT)',
+    'CREATE INDEX IF NOT EXISTS jobs_time ON jobs (time, id)',
+    'CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user, time, id)',
+    'CREATE INDEX IF NOT EXISTS jobs_test ON jobs (test, time, id)',
+    'CREATE INDEX IF NOT EXISTS jobs_envo ON jobs (envo, time, id)',
+    'CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, time, id)',
+    'CREATE INDEX IF NOT EXISTS jobs_segment ON jobs (segment)',
+    'CREATE INDEX IF NOT EXISTS jobs_cache ON jobs (cache_key, time)']
+
+# columns added to the jobs table after the first version of the index
+INDEX_UPGRADE = [
+    ('size', 'size INTEGER NOT NULL DEFAULT 0'),
+    ('segment', 'segment TEXT'),
+    ('log_offset', 'log_offset INTEGER'),
+    ('log_length', 'log_length INTEGER'),
+    ('duration', 'duration REAL'),
+    ('cache_key', 'cache_key TEXT'),
+    ('cached', 'cached TEXT')]
 
 
 class PoteArchive(object):
     """
     Interface to the persistent storage of finished tasks.
+
+    Each job is stored in its own directory (meta data and test
+    output). Test outputs not less than the threshold are gzipped
+    by a background thread after the job is archived and are
+    decompressed on the fly when read. Old jobs can be
+    packed into per-day segments (tar files) to save inodes and
+    directory lookups. Besides the directories, all the meta data
+    is indexed in a SQLite database kept in the archive root, so
+    listing the archive does not need to read every job directory.
     """
 
-    def __init__(self, path):
+    def __init__(self, path, compress_threshold=None):
         """
         Constructor.
 
         :param path: path to an archive directory.
         :type path: string
+
+        :param compress_threshold: min size of test output (in bytes)
+            to store it compressed. None disables compression.
+        :type compress_threshold: NoneType or integer
         """
         self.logger = logging.getLogger(self.__class__.__name__)
         self.path = os.path.abspath(path)
+        self.compress_threshold = compress_threshold
+        self.lock = threading.Lock()
+        # held while files of an unpacked job are rewritten
+        self.files_lock = threading.Lock()
+        self.db = None
+        # incremented on every change of the archived jobs
+        self.version = 0
+        # IDs of jobs whose output is to be compressed
+        self.compress_queue = Queue.Queue()
+        if compress_threshold is not None:
+            compressor = threading.Thread(target=self._compressor)
+            compressor.daemon = True
+            compressor.start()
         self.logger.debug('started in %r', self.path)
 
     def archive(self, job, output_path=None):
@@ -32,37 +137,636 @@ class PoteArchive(object):
         :param job: job details
         :type job: dict
 
-        :param output_path: path to a file with test stdout and stderr
+        :param output_path: path to a file with test stdout and stderr.
+            The file is moved to the archive. A big one is compressed
+            later by the background thread.
         :type output_path: NoneType or string
         """
         assert isinstance(job, dict)
+        started = time.time()
         job_id = job['id']
         job_dir = self._job_dir(job_id)
         if not os.path.isdir(job_dir):
             os.makedirs(job_dir)
         if output_path is not None:
-            job['log'] = 'stdout.log'
-            shutil.copyfile(output_path, os.path.join(job_dir, job['log']))
+            job['log_size'] = os.path.getsize(output_path)
+            job['log'] = LOG_NAME
+            self._move(output_path, os.path.join(job_dir, job['log']))
         with open(os.path.join(job_dir, 'meta'), 'w') as fdescr:
             json.dump(job, fdescr)
+        size = self._dir_size(job_dir)
+        with self.lock:
+            db = self._open_index()
+            self._index_job(db, job, size)
+            db.commit()
+            self.version += 1
+        METRICS.observe('pote_archive_write_seconds', time.time() - started)
         self.logger.debug('job %r archived to %r', job['id'], self.path)
+        if output_path is not None and \
+                self.compress_threshold is not None and \
+                job['log_size'] >= self.compress_threshold:
+            self.compress_queue.put(job_id)
+
+    def flush(self):
+        """
+        Block until all the outputs queued for compression
+        are compressed.
+        """
+        self.compress_queue.join()
 
-    def dump(self):
+    def get(self, job_id):
         """
-        Return a list of objects containing job data.
+        Return archived job data or None if there is no such job.
+
+        :param job_id: job unique identifier
+        :type job_id: string
+
+        :rtype: NoneType or dict
+        """
+        if not os.path.isdir(self.path):
+            return None
+        with self.lock:
+            row = self._open_index().execute(
+                'SELECT meta FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def open_log(self, job_id):
+        """
+        Open the output of the archived job for reading. Return
+        a file object and the output size. Compressed output is
+        decompressed while read. Return (None, None) if there is
+        no such job or the job has no output.
+
+        :param job_id: job unique identifier
+        :type job_id: string
+
+        :rtype: tuple of (file or gzip.GzipFile, integer) or
+            (NoneType, NoneType)
+        """
+        if not os.path.isdir(self.path):
+            return None, None
+        with self.lock:
+            row = self._open_index().execute(
+                'SELECT meta, segment, log_offset, log_length'
+                ' FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None, None
+            (job, segment, log_offset, log_length) = \
+                (json.loads(row[0]),) + tuple(row[1:])
+            if job.get('cached'):
+                fdescr = None
+            elif not job.get('log'):
+                return None, None
+            else:
+                # opened with the lock held as the compressor
+                # replaces the output of an unpacked job under it
+                try:
+                    fdescr = self._open_file(
+                        job_id, job['log'], segment, log_offset, log_length)
+                except IOError:
+                    # the job could be packed or removed in the meantime
+                    return None, None
+        if job.get('cached'):
+            # the output is kept by the job the result is taken from
+            return self.open_log(job['cached'])
+        if job['log'].endswith(GZIP_SUFFIX):
+            gzip_fdescr = gzip.GzipFile(fileobj=fdescr, mode='rb')
+            # close the underlying file along with the gzip reader
+            gzip_fdescr.myfileobj = fdescr
+            return gzip_fdescr, job['log_size']
+        if segment is None:
+            return fdescr, os.fstat(fdescr.fileno()).st_size
+        return fdescr, log_length
+
+    def entries(self):
+        """
+        Return brief details of all the archived jobs, sorted by
+        creation time: ID, creation time, user, test, status, size
+        in bytes, the segment name (None for unpacked jobs) and ID
+        of the job the result is taken from (None for real runs).
 
         :rtype: list of dicts
         """
         if not os.path.isdir(self.path):
             return []
-        result = []
+        with self.lock:
+            rows = self._open_index().execute(
+                'SELECT id, time, user, test, status, size, segment,'
+                ' cached FROM jobs ORDER BY time, id').fetchall()
+        names = ('id', 'time', 'user', 'test', 'status', 'size', 'segment',
+                 'cached')
+        return [dict(zip(names, row)) for row in rows]
+
+    def durations(self, test, limit, status):
+        """
+        Return how long the last jobs of the test ran, in seconds,
+        newest first.
+
+        :param test: test name
+        :type test: string
+
+        :param limit: max number of jobs to take
+        :type limit: integer
+
+        :param status: take only jobs with this status
+        :type status: string
+
+        :rtype: list of numbers
+        """
+        if not os.path.isdir(self.path):
+            return []
+        with self.lock:
+            rows = self._open_index().execute(
+                'SELECT duration FROM jobs'
+                ' WHERE test = ? AND status = ? AND duration IS NOT NULL'
+                ' ORDER BY time DESC LIMIT ?',
+                (test, status, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def cached(self, since, limit):
+        """
+        Return the newest successful jobs which can be reused by
+        the result cache, newest first: tuples of the cache key,
+        the envo, the job ID and the job creation time.
+
+        :param since: take only jobs created after this time
+            (seconds till Unix Epoch)
+        :type since: number
+
+        :param limit: max number of jobs to take
+        :type limit: integer
+
+        :rtype: list of tuples
+        """
+        if not os.path.isdir(self.path):
+            return []
+        with self.lock:
+            return self._open_index().execute(
+                'SELECT cache_key, envo, id, time FROM jobs'
+                ' WHERE cache_key IS NOT NULL AND time > ?'
+                ' ORDER BY time DESC LIMIT ?', (since, limit)).fetchall()
+
+    def remove(self, job_ids, callback=None):
+        """
+        Remove the jobs from the archive. A segment file is removed
+        along with the last job packed into it.
+
+        :param job_ids: job unique identifiers
+        :type job_ids: list of strings
+
+        :param callback: called after each job removal with the
+            number of bytes freed.
+        :type callback: NoneType or callable
+        """
+        for job_id in job_ids:
+            with self.lock:
+                db = self._open_index()
+                row = db.execute(
+                    'SELECT segment, size FROM jobs WHERE id = ?',
+                    (job_id,)).fetchone()
+                if row is None:
+                    continue
+                (segment, size) = row
+                db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+                is_last = segment is not None and db.execute(
+                    'SELECT 1 FROM jobs WHERE segment = ? LIMIT 1',
+                    (segment,)).fetchone() is None
+                db.commit()
+                self.version += 1
+            if segment is None:
+                shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+            elif is_last:
+                os.unlink(self._segment_path(segment))
+                self.logger.debug('segment %r removed', segment)
+            self.logger.debug('job %r removed', job_id)
+            if callback is not None:
+                callback(size)
+
+    def pack(self, segment, job_ids, callback=None):
+        """
+        Move the jobs from their directories to the segment file.
+        Packed jobs stay readable with dump() and open_log().
+
+        :param segment: segment name
+        :type segment: string
+
+        :param job_ids: job unique identifiers
+        :type job_ids: list of strings
+
+        :param callback: called after each job packing with the
+            number of bytes moved.
+        :type callback: NoneType or callable
+        """
+        segments_path = os.path.join(self.path, SEGMENTS_DIR)
+        if not os.path.isdir(segments_path):
+            os.makedirs(segments_path)
+        with tarfile.open(self._segment_path(segment), 'a') as tar:
+            for job_id in job_ids:
+                # the compressor must not replace the files meanwhile
+                with self.files_lock:
+                    job_dir = self._job_dir(job_id)
+                    meta_path = os.path.join(job_dir, 'meta')
+                    if not os.path.isfile(meta_path):
+                        continue
+                    with open(meta_path) as fdescr:
+                        job = json.load(fdescr)
+                    job['segment'] = segment
+                    (log_offset, log_length) = (None, None)
+                    if job.get('log'):
+                        log_path = os.path.join(job_dir, job['log'])
+                        info = tar.gettarinfo(
+                            log_path, '%s/%s' % (job_id, job['log']))
+                        with open(log_path, 'rb') as fdescr:
+                            tar.addfile(info, fdescr)
+                        blocks = -(-info.size // tarfile.BLOCKSIZE)
+                        log_offset = tar.offset - blocks * tarfile.BLOCKSIZE
+                        log_length = info.size
+                    meta = json.dumps(job)
+                    info = tarfile.TarInfo('%s/meta' % job_id)
+                    info.size = len(meta)
+                    info.mtime = time.time()
+                    tar.addfile(info, StringIO.StringIO(meta))
+                    tar.fileobj.flush()
+                    os.fsync(tar.fileobj.fileno())
+                    size = self._dir_size(job_dir)
+                    with self.lock:
+                        db = self._open_index()
+                        self._index_job(
+                            db, job, size, segment, log_offset, log_length)
+                        db.commit()
+                        self.version += 1
+                    shutil.rmtree(job_dir, ignore_errors=True)
+                    self.logger.debug(
+                        'job %r packed to segment %r', job_id, segment)
+                if callback is not None:
+                    callback(size)
+
+    def dump(self, limit=None, before=None, after=None, **filters):
+        """
+        Return a list of objects containing job data, sorted by
+        creation time.
+
+        The list can be narrowed with keyset pagination: 'before'
+        and 'after' are IDs of archived jobs which bound the page
+        (exclusively). When 'limit' is set without 'after', the
+        newest jobs of the range are returned.
+
+        Keyword arguments with names from FILTERS select jobs
+        with exactly matching field values.
+
+        :param limit: max number of jobs to return
+        :type limit: NoneType or integer
+
+        :param before: ID of a job to return only older jobs
+        :type before: NoneType or string
+
+        :param after: ID of a job to return only newer jobs
+        :type after: NoneType or string
+
+        :rtype: list of dicts
+
+        :raise KeyError: when a pagination cursor does not exist
+            in the archive.
+        """
+        for name in filters:
+            if name not in FILTERS:
+                raise TypeError('unknown filter: %r' % name)
+        if not os.path.isdir(self.path):
+            if before is not None or after is not None:
+                raise KeyError(before if before is not None else after)
+            return []
+        where = []
+        args = []
+        for name in FILTERS:
+            if filters.get(name) is not None:
+                where.append('%s = ?' % name)
+                args.append(filters[name])
+        with self.lock:
+            db = self._open_index()
+            for cursor, operator in ((before, '<'), (after, '>')):
+                if cursor is None:
+                    continue
+                row = db.execute(
+                    'SELECT time, id FROM jobs WHERE id = ?',
+                    (cursor,)).fetchone()
+                if row is None:
+                    raise KeyError(cursor)
+                where.append('(time %s ? OR (time = ? AND id %s ?))' %
+                              (operator, operator))
+                args.extend([row[0], row[0], row[1]])
+            query = 'SELECT meta FROM jobs'
+            if where:
+                query += ' WHERE ' + ' AND '.join(where)
+            descending = limit is not None and after is None
+            if descending:
+                query += ' ORDER BY time DESC, id DESC'
+            else:
+                query += ' ORDER BY time, id'
+            if limit is not None:
+                query += ' LIMIT ?'
+                args.append(limit)
+            rows = db.execute(query, args).fetchall()
+        if descending:
+            rows.reverse()
+        return [json.loads(row[0]) for row in rows]
+
+    def reindex(self):
+        """
+        Rebuild the index from scratch, reading meta data of
+        all the archived jobs.
+        """
+        with self.lock:
+            db = self._open_index()
+            db.execute('DELETE FROM jobs')
+            self._scan(db)
+            db.commit()
+            self.version += 1
+
+    def _open_index(self):
+        """
+        Open (and create when needed) the index database.
+        Must be called with the lock held.
+
+        :rtype: sqlite3.Connection
+        """
+        if self.db is not None:
+            return self.db
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        index_path = os.path.join(self.path, INDEX_NAME)
+        is_new = not os.path.isfile(index_path)
+        db = sqlite3.connect(index_path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute(INDEX_SCHEMA[0])
+        columns = [row[1] for row in db.execute('PRAGMA table_info(jobs)')]
+        upgrade = [definition for name, definition in INDEX_UPGRADE
+                   if name not in columns]
+        for definition in upgrade:
+            db.execute('ALTER TABLE jobs ADD COLUMN ' + definition)
+        for statement in INDEX_SCHEMA[1:]:
+            db.execute(statement)
+        if is_new or upgrade:
+            # the archive could be populated by an older version
+            # which did not maintain the index (or job sizes)
+            self._scan(db)
+        db.commit()
+        self.db = db
+        return db
+
+    def _scan(self, db):
+        """
+        Add all jobs found in the archive directory to the index.
+
+        :param db: index database connection
+        :type db: sqlite3.Connection
+        """
+        self.logger.info('indexing %r...', self.path)
+        count = 0
         for job_id in os.listdir(self.path):
-            meta_path = os.path.join(self._job_dir(job_id), 'meta')
+            job_dir = self._job_dir(job_id)
+            meta_path = os.path.join(job_dir, 'meta')
+            if not os.path.isfile(meta_path):
+                continue
             with open(meta_path) as fdescr:
-                result.append(json.load(fdescr))
-        # sort them by creation time
-        result.sort(key=lambda x: x['time'])
-        return result
+                self._index_job(
+                    db, json.load(fdescr), self._dir_size(job_dir))
+            count += 1
+        segments_path = os.path.join(self.path, SEGMENTS_DIR)
+        if os.path.isdir(segments_path):
+            for name in sorted(os.listdir(segments_path)):
+                if name.endswith(SEGMENT_SUFFIX):
+                    count += self._scan_segment(
+                        db, name[:-len(SEGMENT_SUFFIX)])
+        self.logger.info('%r jobs indexed', count)
+
+    def _scan_segment(self, db, segment):
+        """
+        Add all jobs found in the segment file to the index.
+        Return the number of jobs found.
+
+        :param db: index database connection
+        :type db: sqlite3.Connection
+
+        :param segment: segment name
+        :type segment: string
+
+        :rtype: integer
+        """
+        count = 0
+        # a job is packed again when the packing was interrupted
+        # after writing to the segment, so the last copy wins
+        logs = {}
+        sizes = {}
+        with tarfile.open(self._segment_path(segment)) as tar:
+            for info in tar:
+                (job_id, _sep, name) = info.name.partition('/')
+                sizes[job_id] = sizes.get(job_id, 0) + info.size
+                if name != 'meta':
+                    logs[job_id] = (info.offset_data, info.size)
+                    continue
+                job = json.load(tar.extractfile(info))
+                (log_offset, log_length) = logs.pop(job_id, (None, None))
+                self._index_job(db, job, sizes.pop(job_id), segment,
+                                log_offset, log_length)
+                count += 1
+        return count
+
+    @staticmethod
+    def _index_job(db, job, size=0, segment=None, log_offset=None,
+                   log_length=None):
+        """
+        Insert job into the index.
+
+        :param db: index database connection
+        :type db: sqlite3.Connection
+
+        :param job: job details
+        :type job: dict
+
+        :param size: disk space used by the job, in bytes
+        :type size: integer
+
+        :param segment: name of the segment the job is packed to
+        :type segment: NoneType or string
+
+        :param log_offset: offset of the test output in the segment
+        :type log_offset: NoneType or integer
+
+        :param log_length: size of the test output in the segment
+        :type log_length: NoneType or integer
+        """
+        duration = None
+        if job.get('timing'):
+            duration = job['timing'].get('run')
+        # only real successful runs can be reused by the result cache
+        cache_key = None
+        if job.get('status') == STATUS_DONE and not job.get('cached'):
+            cache_key = job.get('cache_key')
+        db.execute(
+            'INSERT OR REPLACE INTO jobs'
+            ' (id, time, user, test, envo, status, meta,'
+            ' size, segment, log_offset, log_length, duration, cache_key,'
+            ' cached)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job['id'], job['time'], job.get('user'), job.get('test'),
+             job.get('envo'), job.get('status'), json.dumps(job),
+             size, segment, log_offset, log_length, duration, cache_key,
+             job.get('cached')))
+
+    @staticmethod
+    def _dir_size(path):
+        """
+        Return total size of files in the directory, in bytes.
+
+        :param path: path to a directory
+        :type path: string
+
+        :rtype: integer
+        """
+        size = 0
+        for name in os.listdir(path):
+            size += os.path.getsize(os.path.join(path, name))
+        return size
+
+    def _open_file(self, job_id, name, segment, log_offset, log_length):
+        """
+        Open the output file of the archived job for reading.
+
+        :param job_id: job unique identifier
+        :type job_id: string
+
+        :param name: name of the output file
+        :type name: string
+
+        :param segment: name of the segment the job is packed to
+        :type segment: NoneType or string
+
+        :param log_offset: offset of the output in the segment
+        :type log_offset: NoneType or integer
+
+        :param log_length: size of the output in the segment
+        :type log_length: NoneType or integer
+
+        :rtype: file or pote.archive.PoteSegmentMember
+
+        :raise IOError: when the file cannot be opened.
+        """
+        if segment is None:
+            return open(os.path.join(self._job_dir(job_id), name), 'rb')
+        return PoteSegmentMember(
+            open(self._segment_path(segment), 'rb'), log_offset, log_length)
+
+    def _compressor(self):
+        """
+        Compression thread activity.
+        """
+        while True:
+            job_id = self.compress_queue.get()
+            try:
+                self._compress_log(job_id)
+            except Exception:
+                self.logger.error(
+                    'failed to compress output of %r', job_id, exc_info=True)
+            self.compress_queue.task_done()
+
+    def _compress_log(self, job_id):
+        """
+        Compress output of the archived job and publish the
+        compressed file in place of the plain one.
+
+        :param job_id: job unique identifier
+        :type job_id: string
+        """
+        job_dir = self._job_dir(job_id)
+        src = os.path.join(job_dir, LOG_NAME)
+        dst = src + GZIP_SUFFIX
+        try:
+            self._compress(src, dst + PARTIAL_SUFFIX)
+        except (IOError, OSError):
+            # the job could be packed or removed in the meantime
+            self._unlink(dst + PARTIAL_SUFFIX)
+            return
+        with self.files_lock, self.lock:
+            db = self._open_index()
+            row = db.execute(
+                'SELECT meta, segment FROM jobs WHERE id = ?',
+                (job_id,)).fetchone()
+            if row is None or row[1] is not None:
+                # removed or packed while compressed
+                self._unlink(dst + PARTIAL_SUFFIX)
+                if row is None:
+                    shutil.rmtree(job_dir, ignore_errors=True)
+                return
+            job = json.loads(row[0])
+            job['log'] = LOG_NAME + GZIP_SUFFIX
+            os.rename(dst + PARTIAL_SUFFIX, dst)
+            meta_path = os.path.join(job_dir, 'meta')
+            with open(meta_path + PARTIAL_SUFFIX, 'w') as fdescr:
+                json.dump(job, fdescr)
+            os.rename(meta_path + PARTIAL_SUFFIX, meta_path)
+            os.unlink(src)
+            self._index_job(db, job, self._dir_size(job_dir))
+            db.commit()
+            self.version += 1
+        self.logger.debug('output of %r compressed', job_id)
+
+    @staticmethod
+    def _compress(src, dst):
+        """
+        Compress the file to the destination path.
+
+        :param src: path of the file to compress
+        :type src: string
+
+        :param dst: destination path
+        :type dst: string
+        """
+        with open(src, 'rb') as src_fdescr, \
+                gzip.open(dst, 'wb', GZIP_LEVEL) as dst_fdescr:
+            shutil.copyfileobj(src_fdescr, dst_fdescr)
+
+    @staticmethod
+    def _unlink(path):
+        """
+        Remove the file if it exists.
+
+        :param path: path to a file
+        :type path: string
+        """
+        try:
+            os.unlink(path)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    @staticmethod
+    def _move(src, dst):
+        """
+        Move the file. When the paths are on different filesystems
+        (or mount points), try to clone the file extents, which is
+        cheap on CoW filesystems, and fall back to a plain copy.
+
+        :param src: path of the file to move
+        :type src: string
+
+        :param dst: destination path
+        :type dst: string
+        """
+        try:
+            os.rename(src, dst)
+            return
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise
+        with open(src, 'rb') as src_fdescr, open(dst, 'wb') as dst_fdescr:
+            try:
+                fcntl.ioctl(dst_fdescr.fileno(), FICLONE, src_fdescr.fileno())
+            except (IOError, OSError):
+                shutil.copyfileobj(src_fdescr, dst_fdescr)
+        os.unlink(src)
 
     def _job_dir(self, job_id):
         """
@@ -74,3 +778,92 @@ class PoteArchive(object):
         :rtype: string
         """
         return os.path.join(self.path, job_id)
+
+    def _segment_path(self, segment):
+        """
+        Return path to a segment file.
+
+        :param segment: segment name
+        :type segment: string
+
+        :rtype: string
+        """
+        return os.path.join(
+            self.path, SEGMENTS_DIR, segment + SEGMENT_SUFFIX)
+
+
+class PoteSegmentMember(object):
+    """
+    Read-only file object for a part of a segment file.
+    """
+
+    def __init__(self, fdescr, offset, length):
+        """
+        Constructor.
+
+        :param fdescr: opened segment file. Closed along with
+            the member object.
+        :type fdescr: file
+
+        :param offset: offset of the member data in the segment
+        :type offset: integer
+
+        :param length: size of the member data
+        :type length: integer
+        """
+        self.fdescr = fdescr
+        self.offset = offset
+        self.length = length
+        self.position = 0
+
+    def read(self, size=-1):
+        """
+        Read at most size bytes (all the rest when size is negative).
+
+        :param size: max bytes count to read
+        :type size: integer
+
+        :rtype: string
+        """
+        left = self.length - self.position
+        if size < 0 or size > left:
+            size = left
+        self.fdescr.seek(self.offset + self.position)
+        data = self.fdescr.read(size)
+        self.position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """
+        Set the current position.
+
+        :param offset: new position, relative to whence
+        :type offset: integer
+
+        :param whence: os.SEEK_SET, os.SEEK_CUR or os.SEEK_END
+        :type whence: integer
+        """
+        base = {os.SEEK_SET: 0,
+                os.SEEK_CUR: self.position,
+                os.SEEK_END: self.length}[whence]
+        self.position = max(0, min(base + offset, self.length))
+
+    def tell(self):
+        """
+        Return the current position.
+
+        :rtype: integer
+        """
+        return self.position
+
+    def close(self):
+        """
+        Close the segment file.
+        """
+        self.fdescr.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
@@ -0,0 +1,171 @@
+"""
+Cache of results of successful jobs.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import platform
+import sys
+import time
+
+from .metrics import METRICS
+
+
+# default max number of results kept in the cache
+DEF_CACHE_SIZE = 1000
+
+# directive of tests which results must not be reused
+OPTION_NONDETERMINISTIC = 'nondeterministic'
+
+METRICS.counter(
+    'pote_result_cache_lookups_total',
+    'Lookups of results of new jobs in the result cache, by result')
+
+
+def fingerprint(*args):
+    """
+    Return a fingerprint of the environment tests run in: the
+    platform, the interpreter and the given details of the launch
+    (like the launcher and modules preloaded).
+
+    :param args: details of the launch, encodable to JSON
+    :type args: any
+
+    :rtype: string
+    """
+    return hashlib.sha1(json.dumps(
+        [platform.platform(), sys.version] + list(args))).hexdigest()
+
+
+class PoteResultCache(object):
+    """
+    Cache of results of successful jobs.
+
+    A result is looked up by a key made of the test name, the hash
+    of the test sources, resource limits of the job and the
+    fingerprint of the environment, along with the envo the job
+    ran in. Results are kept for 'ttl' seconds. When there are
+    more than 'size' results, the least recently used ones are
+    evicted. The cache is warmed up from the archive on load().
+
+    The cache is used by the scheduler thread only.
+    """
+
+    def __init__(self, archive, ttl, size=None, env_fingerprint=None):
+        """
+        Constructor.
+
+        :param archive: interface to the Archive Storage
+        :type archive: pote.PoteArchive
+
+        :param ttl: how long a result can be reused, in seconds
+        :type ttl: number
+
+        :param size: max number of results to keep.
+            Default is DEF_CACHE_SIZE.
+        :type size: NoneType or integer
+
+        :param env_fingerprint: fingerprint of the environment tests
+            run in. Default is fingerprint() with no launch details.
+        :type env_fingerprint: NoneType or string
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.archive = archive
+        self.ttl = ttl
+        self.size = DEF_CACHE_SIZE if size is None else size
+        self.fingerprint = env_fingerprint or fingerprint()
+        # (cache key, envo) -> (job ID, job creation time),
+        # the most recently used last
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """
+        Fill the cache with the last successful jobs from the archive.
+        """
+        self.entries.clear()
+        rows = self.archive.cached(time.time() - self.ttl, self.size)
+        for cache_key, envo, job_id, job_time in reversed(rows):
+            self.entries[(cache_key, envo)] = (job_id, job_time)
+        self.logger.debug('%r results loaded', len(self.entries))
+
+    def key(self, test, meta, limits):
+        """
+        Return the cache key of a job or None if results
+        of the test must not be reused.
+
+        :param test: test name
+        :type test: string
+
+        :param meta: metadata of the test,
+            as returned by pote.tests.PoteTests.get()
+        :type meta: dict
+
+        :param limits: resource limits of the job
+        :type limits: dict
+
+        :rtype: NoneType or string
+        """
+        if meta.get('options', {}).get(OPTION_NONDETERMINISTIC):
+            return None
+        return hashlib.sha1(json.dumps(
+            [test, meta['hash'], limits, self.fingerprint],
+            sort_keys=True)).hexdigest()
+
+    def lookup(self, cache_key, envos, max_duration):
+        """
+        Return the archived job which result can be reused
+        or None if there is no such job.
+
+        :param cache_key: cache key of the job
+        :type cache_key: string
+
+        :param envos: envos the job can run in
+        :type envos: list of integers
+
+        :param max_duration: max duration of the job, in seconds.
+            Results of jobs which ran longer are not reused.
+        :type max_duration: number
+
+        :rtype: NoneType or dict
+        """
+        since = time.time() - self.ttl
+        for envo in envos:
+            entry = self.entries.get((cache_key, envo))
+            if entry is None:
+                continue
+            (job_id, job_time) = entry
+            job = None
+            if job_time > since:
+                job = self.archive.get(job_id)
+            if job is None:
+                # expired or removed from the archive
+                del self.entries[(cache_key, envo)]
+                continue
+            if job.get('timing', {}).get('run', 0) > max_duration:
+                continue
+            # the most recently used go last
+            del self.entries[(cache_key, envo)]
+            self.entries[(cache_key, envo)] = entry
+            self.hits += 1
+            METRICS.inc('pote_result_cache_lookups_total', result='hit')
+            return job
+        self.misses += 1
+        METRICS.inc('pote_result_cache_lookups_total', result='miss')
+        return None
+
+    def store(self, job):
+        """
+        Remember the result of the successful job.
+
+        :param job: job details, with the 'cache_key'
+        :type job: dict
+        """
+        key = (job['cache_key'], job['envo'])
+        self.entries.pop(key, None)
+        self.entries[key] = (job['id'], job['time'])
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
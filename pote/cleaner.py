@@ -0,0 +1,86 @@
+"""
+Thread which removes directories in the background.
+"""
+
+import logging
+import os
+import os.path
+import Queue
+import shutil
+import threading
+import uuid
+
+# directory inside the envos path for working directories to remove
+TRASH_DIR = '.trash'
+
+
+class PoteCleaner(threading.Thread):
+    """
+    Background directory remover.
+
+    A directory is renamed into the trash directory at once and
+    removed later by the cleaner thread, so the caller does not
+    wait for the whole tree to be deleted. Anything left in the
+    trash after a restart is removed when the thread starts.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor.
+
+        :param path: path to the trash directory. Must be on the
+            same filesystem as directories to remove.
+        :type path: string
+        """
+        threading.Thread.__init__(self)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.daemon = True
+        self.path = os.path.abspath(path)
+        self.queue = Queue.Queue()
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        # leftovers of the previous run
+        for name in os.listdir(self.path):
+            self.queue.put(os.path.join(self.path, name))
+        self.logger.debug('started in %r', self.path)
+
+    @classmethod
+    def running(cls, *args, **kwargs):
+        """
+        Create and start a new cleaner instance.
+        Return a link to the object created.
+        See constructor description for further details
+        about arguments.
+
+        :rtype: pote.cleaner.PoteCleaner
+        """
+        instance = cls(*args, **kwargs)
+        instance.start()
+        return instance
+
+    def discard(self, path):
+        """
+        Move the directory to the trash and schedule its removal.
+        The path is free for reuse when the method returns.
+
+        :param path: path to a directory
+        :type path: string
+
+        :raise OSError: when the directory cannot be moved.
+        """
+        trash_path = os.path.join(self.path, uuid.uuid4().hex)
+        os.rename(path, trash_path)
+        self.queue.put(trash_path)
+
+    def run(self):
+        """
+        Main thread activity.
+        """
+        while True:
+            path = self.queue.get()
+            try:
+                shutil.rmtree(path)
+            except OSError:
+                self.logger.error(
+                    'failed to remove %r', path, exc_info=True)
+            self.queue.task_done()
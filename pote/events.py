@@ -0,0 +1,139 @@
+"""
+Bounded log of job state changes, streamed to the clients.
+"""
+
+import collections
+import errno
+import fcntl
+import itertools
+import os
+import select
+import threading
+import time
+
+
+LOG_SIZE = 10000  # how many recent changes to keep
+
+# delta types
+DELTA_JOB = 'job'  # job was enqueued or its state was changed
+DELTA_ARCHIVE = 'archive'  # job was finished and moved to the archive
+
+
+class PoteEventLog(object):
+    """
+    Bounded log of job state changes.
+
+    Each change gets a sequence number. Clients resume reading from
+    a cursor ("<epoch>-<seq>") returned with the previous read. When
+    the cursor is too old (or was issued before the daemon restart)
+    the client must refetch the full job lists.
+    """
+
+    def __init__(self, size=LOG_SIZE):
+        """
+        Constructor.
+
+        :param size: how many recent changes to keep.
+        :type size: integer
+        """
+        self.lock = threading.Lock()
+        self.deltas = collections.deque(maxlen=size)
+        self.epoch = '%x' % int(time.time() * 1000)
+        self.seq = 0
+        self.waiters = set()
+
+    def publish(self, delta_type, job):
+        """
+        Append a change to the log and wake up all waiting readers.
+
+        :param delta_type: change type
+        :type delta_type: string, DELTA_JOB or DELTA_ARCHIVE
+
+        :param job: actual job data
+        :type job: dict
+        """
+        with self.lock:
+            self.seq += 1
+            self.deltas.append(
+                {'seq': self.seq, 'type': delta_type, 'job': dict(job)})
+            # under the lock: readers close their pipes
+            # right after they leave the waiters set
+            for wfd in self.waiters:
+                try:
+                    os.write(wfd, '\0')
+                except OSError as exc:
+                    if exc.errno != errno.EAGAIN:
+                        raise
+
+    def cursor(self):
+        """
+        Return the cursor pointing to the end of the log.
+
+        :rtype: string
+        """
+        with self.lock:
+            return '%s-%d' % (self.epoch, self.seq)
+
+    def read(self, cursor, timeout=0):
+        """
+        Return changes made since the cursor, waiting up to timeout
+        seconds for them. Return a tuple of the new cursor and a list
+        of changes. Changes are None when the cursor is not valid
+        anymore and the client must start over.
+
+        :param cursor: cursor returned by the previous read
+        :type cursor: string
+
+        :param timeout: max time to wait for changes, in seconds
+        :type timeout: number
+
+        :rtype: tuple of (string, NoneType or list of dicts)
+        """
+        seq = self._parse(cursor)
+        deadline = time.time() + timeout
+        (rfd, wfd) = os.pipe()
+        fcntl.fcntl(wfd, fcntl.F_SETFL,
+                    fcntl.fcntl(wfd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        try:
+            with self.lock:
+                self.waiters.add(wfd)
+            while True:
+                with self.lock:
+                    new_cursor = '%s-%d' % (self.epoch, self.seq)
+                    first = self.seq - len(self.deltas) + 1
+                    if seq is None or not first - 1 <= seq <= self.seq:
+                        return new_cursor, None
+                    if seq < self.seq:
+                        return new_cursor, list(itertools.islice(
+                            self.deltas, seq + 1 - first, None))
+                left = deadline - time.time()
+                if left <= 0:
+                    return new_cursor, []
+                try:
+                    select.select([rfd], [], [], left)
+                except select.error as exc:
+                    if exc.args[0] != errno.EINTR:
+                        raise
+        finally:
+            with self.lock:
+                self.waiters.discard(wfd)
+            os.close(rfd)
+            os.close(wfd)
+
+    def _parse(self, cursor):
+        """
+        Return sequence number from the cursor or None, if the
+        cursor is malformed or issued by another daemon run.
+
+        :param cursor: cursor returned by a read
+        :type cursor: string
+
+        :rtype: NoneType or integer
+        """
+        try:
+            (epoch, seq) = cursor.split('-', 1)
+            if epoch == self.epoch:
+                return int(seq)
+        except (AttributeError, ValueError):
+            pass
+        return None
@@ -0,0 +1,132 @@
+"""
+Minimal binding to the Linux inotify(7) API.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+
+
+# events (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# flags of inotify_init1()
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event without the name
+EVENT_HEADER = struct.Struct('iIII')
+
+# max size of events read at once
+READ_SIZE = 64 * 1024
+
+
+class PoteInotify(object):
+    """
+    Inotify instance.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+
+        :raise OSError: when inotify is not supported.
+        """
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        try:
+            self._init1 = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not supported')
+        self.fd = self._check(self._init1(IN_CLOEXEC))
+
+    def fileno(self):
+        """
+        Return the file descriptor to select() on.
+
+        :rtype: integer
+        """
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """
+        Start watching the path. Return the watch descriptor.
+
+        :param path: path to a file or a directory
+        :type path: string
+
+        :param mask: events to watch for
+        :type mask: integer
+
+        :rtype: integer
+
+        :raise OSError: on failure.
+        """
+        return self._check(self._add_watch(self.fd, path, mask))
+
+    def rm_watch(self, wd):
+        """
+        Stop watching.
+
+        :param wd: watch descriptor
+        :type wd: integer
+        """
+        self._rm_watch(self.fd, wd)
+
+    def read(self):
+        """
+        Read pending events. Blocks until there are some.
+        Return a list of (watch descriptor, mask, cookie, name) tuples.
+
+        :rtype: list of tuples
+        """
+        data = os.read(self.fd, READ_SIZE)
+        events = []
+        offset = 0
+        while offset < len(data):
+            (wd, mask, cookie, length) = \
+                EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        """
+        Release the inotify instance.
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    @staticmethod
+    def _check(result):
+        """
+        Return the result of a libc call or raise OSError
+        when the call failed.
+
+        :param result: value returned by the call
+        :type result: integer
+
+        :rtype: integer
+        """
+        if result < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        return result
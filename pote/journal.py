@@ -0,0 +1,161 @@
+"""
+Write-ahead journal of the job queue state.
+"""
+
+import json
+import logging
+import os
+import os.path
+
+
+JOURNAL_NAME = 'journal'
+
+# compact the journal when it holds at least COMPACT_MIN records
+# and COMPACT_FACTOR times more records than there are live jobs
+COMPACT_MIN = 1000
+COMPACT_FACTOR = 4
+
+
+class PoteJournal(object):
+    """
+    Append-only log of job state changes.
+
+    Each line of the journal file is a JSON object: either
+    {"job": {...}} with the whole job state or {"remove": "<id>"}.
+    The latest record for a job wins. Records are buffered and
+    written to the disk only by sync(), so the caller decides
+    how to batch them.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor.
+
+        :param path: path to a directory with the journal file.
+        :type path: string
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = os.path.abspath(path)
+        self.journal_path = os.path.join(self.path, JOURNAL_NAME)
+        self.fdescr = None
+        self.records = 0
+        self.dirty = False
+        self.logger.debug('started in %r', self.path)
+
+    def exists(self):
+        """
+        Return True if the journal file exists.
+
+        :rtype: boolean
+        """
+        return os.path.isfile(self.journal_path)
+
+    def load(self):
+        """
+        Replay the journal. Return a dict with jobs, keyed by ID.
+
+        :rtype: dict
+        """
+        jobs = {}
+        self.records = 0
+        if self.exists():
+            with open(self.journal_path) as fdescr:
+                for line in fdescr:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the record can be torn by a crash
+                        self.logger.warning('bad record: %r', line)
+                        continue
+                    if 'job' in record:
+                        jobs[record['job']['id']] = record['job']
+                    elif 'remove' in record:
+                        jobs.pop(record['remove'], None)
+                    self.records += 1
+        self.logger.debug(
+            '%r records replayed, %r jobs loaded', self.records, len(jobs))
+        return jobs
+
+    def save(self, job):
+        """
+        Append job state to the journal.
+
+        :param job: job data
+        :type job: dict
+        """
+        assert isinstance(job, dict)
+        assert 'time' in job
+        self._append({'job': job})
+
+    def remove(self, job_id):
+        """
+        Append job removal record to the journal.
+
+        :param job_id: job unique identifier
+        :type job_id: string
+        """
+        self._append({'remove': job_id})
+
+    def sync(self):
+        """
+        Flush all appended records to the disk.
+        """
+        if self.dirty:
+            self.fdescr.flush()
+            os.fsync(self.fdescr.fileno())
+            self.dirty = False
+
+    def compact(self, jobs, force=False):
+        """
+        Rewrite the journal leaving only the actual state
+        of live jobs, when there are too many stale records.
+        Return True if the journal was compacted.
+
+        :param jobs: live jobs
+        :type jobs: list of dicts
+
+        :param force: compact regardless of the journal size
+        :type force: boolean
+
+        :rtype: boolean
+        """
+        if not force and (self.records < COMPACT_MIN or
+                          self.records < COMPACT_FACTOR * len(jobs)):
+            return False
+        self._makedirs()
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w') as fdescr:
+            for job in jobs:
+                fdescr.write(json.dumps({'job': job}) + '\n')
+            fdescr.flush()
+            os.fsync(fdescr.fileno())
+        if self.fdescr is not None:
+            self.fdescr.close()
+            self.fdescr = None
+            self.dirty = False
+        os.rename(tmp_path, self.journal_path)
+        self.logger.debug(
+            'compacted from %r to %r records', self.records, len(jobs))
+        self.records = len(jobs)
+        return True
+
+    def _append(self, record):
+        """
+        Write a record to the end of the journal.
+
+        :param record: journal record
+        :type record: dict
+        """
+        if self.fdescr is None:
+            self._makedirs()
+            self.fdescr = open(self.journal_path, 'a')
+        self.fdescr.write(json.dumps(record) + '\n')
+        self.records += 1
+        self.dirty = True
+
+    def _makedirs(self):
+        """
+        Create the journal directory if not exists.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
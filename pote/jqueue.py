@@ -1,5 +1,8 @@
 """
-Persistent storage for the job queue.
+Persistent storage for the job queue, one file per job.
+
+Superseded by the journal (see pote.journal). Used only to import
+queues saved by older versions.
 """
 
 import json
@@ -0,0 +1,383 @@
+"""
+Resource limits of test processes and accounting
+of the resources used.
+"""
+
+import errno
+import logging
+import os
+import os.path
+import resource
+import signal
+import threading
+import time
+import uuid
+
+
+# limits known (all are optional):
+#  cpu: CPU time, in seconds;
+#  cpu_share: share of a CPU, like 0.5 for a half (cgroup only);
+#  memory: memory size, in bytes (address space limit without cgroup);
+#  fsize: max size of a file written, in bytes;
+#  nofile: max number of open files;
+#  pids: max number of processes and threads (cgroup only).
+KNOWN_LIMITS = ('cpu', 'cpu_share', 'memory', 'fsize', 'nofile', 'pids')
+
+# limits applied with setrlimit()
+RLIMITS = {'cpu': resource.RLIMIT_CPU,
+           'fsize': resource.RLIMIT_FSIZE,
+           'nofile': resource.RLIMIT_NOFILE}
+
+# fields of struct rusage to report
+RUSAGE_FIELDS = ('ru_utime', 'ru_stime', 'ru_maxrss', 'ru_minflt',
+                 'ru_majflt', 'ru_inblock', 'ru_oublock', 'ru_nvcsw',
+                 'ru_nivcsw')
+
+# cgroup v2 controllers used
+CGROUP_CONTROLLERS = ('cpu', 'memory', 'pids', 'io')
+
+# period of the cgroup CPU bandwidth control, in microseconds
+CPU_PERIOD = 100000
+
+# how long to wait for killed processes of a cgroup to exit, in seconds
+KILL_TIMEOUT = 5
+
+# how often to check if killed processes of a cgroup exited, in seconds
+KILL_POLL_PERIOD = 0.05
+
+
+def check(limits):
+    """
+    Raise ValueError if limits are malformed.
+
+    :param limits: resource limits
+    :type limits: any
+    """
+    if not isinstance(limits, dict):
+        raise ValueError('limits must be an object')
+    for name, value in limits.items():
+        if name not in KNOWN_LIMITS:
+            raise ValueError('unknown limit: %r' % name)
+        if isinstance(value, bool) or \
+                not isinstance(value, (int, long, float)) or value <= 0:
+            raise ValueError('bad %r limit: %r' % (name, value))
+
+
+def merge(limits, override):
+    """
+    Return limits tightened with the overriding limits:
+    the least value of each limit wins.
+
+    :param limits: base limits
+    :type limits: dict
+
+    :param override: overriding limits
+    :type override: NoneType or dict
+
+    :rtype: dict
+    """
+    result = dict(limits)
+    for name, value in (override or {}).items():
+        result[name] = min(value, result.get(name, value))
+    return result
+
+
+def rlimits(limits, cgroup=False):
+    """
+    Return setrlimit() arguments for the limits.
+
+    :param limits: resource limits
+    :type limits: dict
+
+    :param cgroup: True if the process is run in a cgroup, where
+        the memory is limited by the cgroup, not setrlimit().
+    :type cgroup: boolean
+
+    :rtype: list of tuples (resource, soft, hard)
+    """
+    result = []
+    names = dict(RLIMITS)
+    if not cgroup:
+        names['memory'] = resource.RLIMIT_AS
+    for name, res in sorted(names.items()):
+        if name in limits:
+            value = int(limits[name])
+            hard = resource.getrlimit(res)[1]
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            result.append((res, value, value))
+    return result
+
+
+def enter(rlimits_args, cgroup_procs=None):
+    """
+    Apply limits to the current process. Called in a child
+    process before the test is started.
+
+    :param rlimits_args: setrlimit() arguments
+    :type rlimits_args: list of tuples (resource, soft, hard)
+
+    :param cgroup_procs: path to the cgroup.procs file of a cgroup
+        to move the process to.
+    :type cgroup_procs: NoneType or string
+    """
+    if cgroup_procs is not None:
+        with open(cgroup_procs, 'w') as fdescr:
+            fdescr.write('%d\n' % os.getpid())
+    for res, soft, hard in rlimits_args:
+        resource.setrlimit(res, (soft, hard))
+
+
+def usage(rusage):
+    """
+    Return resource usage of a test process, suitable to be saved
+    to the job meta data.
+
+    :param rusage: struct rusage fields, by name
+    :type rusage: dict
+
+    :rtype: dict
+    """
+    return {'utime': rusage['ru_utime'],
+            'stime': rusage['ru_stime'],
+            # kilobytes on Linux
+            'maxrss': rusage['ru_maxrss'] * 1024,
+            # 512-byte blocks
+            'read_bytes': rusage['ru_inblock'] * 512,
+            'write_bytes': rusage['ru_oublock'] * 512}
+
+
+class PoteCgroups(object):
+    """
+    Delegated cgroup v2 subtree where a cgroup is created
+    for every test process.
+
+    The subtree root must not have processes of its own,
+    so the daemon must run in another cgroup.
+
+    A cgroup which cannot be removed (its processes did not exit
+    in time) is kept and removal is retried when the next cgroup
+    is created.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor.
+
+        :param path: path to the subtree root
+        :type path: string
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = os.path.abspath(path)
+        # cgroups to remove yet
+        self.leaked = []
+        self.lock = threading.Lock()
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        with open(os.path.join(self.path, 'cgroup.controllers')) as fdescr:
+            available = fdescr.read().split()
+        controllers = [name for name in CGROUP_CONTROLLERS
+                       if name in available]
+        try:
+            with open(os.path.join(self.path, 'cgroup.subtree_control'),
+                      'w') as fdescr:
+                fdescr.write(' '.join('+' + name for name in controllers))
+        except IOError:
+            self.logger.error('failed to enable controllers %r in %r',
+                              controllers, self.path, exc_info=True)
+        self.logger.debug('started in %r', self.path)
+
+    def create(self, limits):
+        """
+        Create a cgroup for a test process.
+
+        :param limits: resource limits
+        :type limits: dict
+
+        :rtype: pote.limits.PoteCgroup
+        """
+        with self.lock:
+            (leaked, self.leaked) = (self.leaked, [])
+        leaked = [cgroup for cgroup in leaked if not cgroup.remove(0)]
+        with self.lock:
+            self.leaked.extend(leaked)
+        cgroup = PoteCgroup(os.path.join(self.path, uuid.uuid4().hex))
+        try:
+            cgroup.set_limits(limits)
+        except Exception:
+            # the cgroup is not used without its limits
+            self.remove(cgroup)
+            raise
+        return cgroup
+
+    def clear(self):
+        """
+        Kill processes of all the cgroups of the subtree and remove
+        the cgroups. Used when the process which created the cgroups
+        has died.
+        """
+        with self.lock:
+            self.leaked = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if os.path.isdir(path):
+                self.remove(PoteCgroup(path, create=False))
+
+    def remove(self, cgroup):
+        """
+        Kill processes left in the cgroup and remove it.
+
+        :param cgroup: cgroup of a test process
+        :type cgroup: pote.limits.PoteCgroup
+        """
+        if not cgroup.remove():
+            self.logger.warning(
+                'cgroup %r is busy, removal postponed', cgroup.path)
+            with self.lock:
+                self.leaked.append(cgroup)
+
+
+class PoteCgroup(object):
+    """
+    Cgroup of a test process.
+    """
+
+    def __init__(self, path, create=True):
+        """
+        Constructor. Creates the cgroup.
+
+        :param path: path to the cgroup
+        :type path: string
+
+        :param create: whether to create the cgroup or to use
+            an existing one
+        :type create: boolean
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.procs_path = os.path.join(path, 'cgroup.procs')
+        if create:
+            os.mkdir(path)
+
+    def set_limits(self, limits):
+        """
+        Write the resource limits to the cgroup files.
+
+        :param limits: resource limits
+        :type limits: dict
+        """
+        if 'memory' in limits:
+            self._write('memory.max', '%d' % limits['memory'])
+            try:
+                # do not let the test survive in the swap
+                self._write('memory.swap.max', '0')
+            except IOError:
+                # no swap accounting
+                pass
+        if 'pids' in limits:
+            self._write('pids.max', '%d' % limits['pids'])
+        if 'cpu_share' in limits:
+            self._write('cpu.max', '%d %d' % (
+                int(limits['cpu_share'] * CPU_PERIOD), CPU_PERIOD))
+
+    def usage(self):
+        """
+        Return resource usage of all the processes of the cgroup.
+
+        :rtype: dict
+        """
+        result = {}
+        peak = self._read('memory.peak')
+        if peak is not None:
+            result['memory_peak'] = int(peak)
+        stat = self._read('io.stat')
+        if stat is not None:
+            totals = {'rbytes': 0, 'wbytes': 0}
+            for field in stat.split():
+                (name, _sep, value) = field.partition('=')
+                if name in totals:
+                    totals[name] += int(value)
+            result['read_bytes'] = totals['rbytes']
+            result['write_bytes'] = totals['wbytes']
+        return result
+
+    def remove(self, timeout=KILL_TIMEOUT):
+        """
+        Kill processes left in the cgroup, wait until they exit
+        and remove the cgroup. Return False when the cgroup is
+        still busy after the timeout.
+
+        :param timeout: how long to wait for the processes to exit,
+            in seconds
+        :type timeout: number
+
+        :rtype: boolean
+        """
+        try:
+            self._write('cgroup.kill', '1')
+        except IOError:
+            # not supported by older kernels
+            for pid in (self._read('cgroup.procs') or '').split():
+                try:
+                    os.kill(int(pid), signal.SIGKILL)
+                except OSError:
+                    pass
+        deadline = time.time() + timeout
+        while True:
+            try:
+                if not self._is_populated():
+                    os.rmdir(self.path)
+                    return True
+            except OSError as exc:
+                if exc.errno == errno.ENOENT:
+                    return True
+                if exc.errno != errno.EBUSY:
+                    self.logger.debug(
+                        'failed to remove %r: %s', self.path, exc)
+                    return False
+                # killed processes can be still exiting
+            if time.time() >= deadline:
+                self.logger.debug('%r is still busy', self.path)
+                return False
+            time.sleep(KILL_POLL_PERIOD)
+
+    def _is_populated(self):
+        """
+        Return True if there are processes in the cgroup.
+
+        :rtype: boolean
+        """
+        for line in (self._read('cgroup.events') or '').splitlines():
+            (name, _sep, value) = line.partition(' ')
+            if name == 'populated':
+                return value.strip() != '0'
+        return False
+
+    def _read(self, name):
+        """
+        Return contents of the cgroup file or None
+        if there is no such file.
+
+        :param name: file name
+        :type name: string
+
+        :rtype: NoneType or string
+        """
+        try:
+            with open(os.path.join(self.path, name)) as fdescr:
+                return fdescr.read()
+        except IOError:
+            return None
+
+    def _write(self, name, value):
+        """
+        Write a value to the cgroup file.
+
+        :param name: file name
+        :type name: string
+
+        :param value: value to write
+        :type value: string
+        """
+        with open(os.path.join(self.path, name), 'w') as fdescr:
+            fdescr.write(value)
@@ -0,0 +1,205 @@
+"""
+Counters and histograms of the daemon activity, exposed in the
+Prometheus text exposition format.
+"""
+
+import bisect
+import threading
+
+
+# content type of the text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# upper bounds of latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+# metric types
+TYPE_COUNTER = 'counter'
+TYPE_GAUGE = 'gauge'
+TYPE_HISTOGRAM = 'histogram'
+
+
+class PoteMetrics(object):
+    """
+    Registry of counters and histograms.
+
+    Metrics are declared once with counter() or histogram() and
+    then updated with inc() and observe() from any thread. Each
+    distinct set of labels makes a separate time series. Gauges
+    are not kept in the registry: their actual values are passed
+    to render() by the caller.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.lock = threading.Lock()
+        # metric name -> (type, help text, histogram buckets)
+        self.declared = {}
+        # (metric name, sorted label pairs) -> counter value or
+        # [per-bucket counts, sum, count] of a histogram
+        self.series = {}
+
+    def counter(self, name, text):
+        """
+        Declare a counter.
+
+        :param name: metric name, ending with '_total'
+        :type name: string
+
+        :param text: help text
+        :type text: string
+        """
+        self.declared[name] = (TYPE_COUNTER, text, None)
+
+    def histogram(self, name, text, buckets=LATENCY_BUCKETS):
+        """
+        Declare a histogram.
+
+        :param name: metric name
+        :type name: string
+
+        :param text: help text
+        :type text: string
+
+        :param buckets: upper bounds of the buckets, ascending.
+            Default is LATENCY_BUCKETS.
+        :type buckets: tuple of numbers
+        """
+        self.declared[name] = (TYPE_HISTOGRAM, text, tuple(buckets))
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increment the counter.
+
+        :param name: metric name
+        :type name: string
+
+        :param value: increment
+        :type value: number
+
+        :param labels: labels of the time series
+        :type labels: strings
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Add a sample to the histogram.
+
+        :param name: metric name
+        :type name: string
+
+        :param value: sample value
+        :type value: number
+
+        :param labels: labels of the time series
+        :type labels: strings
+        """
+        buckets = self.declared[name][2]
+        index = bisect.bisect_left(buckets, value)
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(buckets), 0, 0]
+            if index < len(buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self, gauges=None):
+        """
+        Return all the metrics in the text exposition format.
+
+        :param gauges: actual values of gauges, as tuples of
+            (name, help text, list of (labels, value) samples)
+        :type gauges: NoneType or list of tuples
+
+        :rtype: string
+        """
+        with self.lock:
+            series = [(key, value if not isinstance(value, list) else
+                       [list(value[0]), value[1], value[2]])
+                      for key, value in self.series.items()]
+        by_name = {}
+        for (name, labels), value in series:
+            by_name.setdefault(name, []).append((labels, value))
+        lines = []
+        for name in sorted(self.declared):
+            (metric_type, text, buckets) = self.declared[name]
+            lines.append('# HELP %s %s' % (name, _escape(text, False)))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            for labels, value in sorted(by_name.get(name, [])):
+                if metric_type == TYPE_COUNTER:
+                    lines.append(_sample(name, labels, value))
+                    continue
+                (counts, total, count) = value
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(_sample(
+                        name + '_bucket', labels + (('le', '%g' % bound),),
+                        cumulative))
+                lines.append(_sample(
+                    name + '_bucket', labels + (('le', '+Inf'),), count))
+                lines.append(_sample(name + '_sum', labels, total))
+                lines.append(_sample(name + '_count', labels, count))
+        for name, text, samples in gauges or []:
+            lines.append('# HELP %s %s' % (name, _escape(text, False)))
+            lines.append('# TYPE %s %s' % (name, TYPE_GAUGE))
+            for labels, value in samples:
+                lines.append(
+                    _sample(name, tuple(sorted(labels.items())), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _sample(name, labels, value):
+    """
+    Return a line of the text exposition format with a sample.
+
+    :param name: metric name
+    :type name: string
+
+    :param labels: label pairs
+    :type labels: tuple of (string, string) tuples
+
+    :param value: sample value
+    :type value: number
+
+    :rtype: string
+    """
+    if isinstance(value, float):
+        value = repr(value)
+    if not labels:
+        return '%s %s' % (name, value)
+    return '%s{%s} %s' % (
+        name, ','.join('%s="%s"' % (label, _escape(label_value))
+                       for label, label_value in labels),
+        value)
+
+
+def _escape(text, quoted=True):
+    """
+    Escape a label value or a help text.
+
+    :param text: text to escape
+    :type text: string
+
+    :param quoted: True for label values, which are quoted
+    :type quoted: boolean
+
+    :rtype: string
+    """
+    text = str(text).replace('\\', '\\\\').replace('\n', '\\n')
+    if quoted:
+        text = text.replace('"', '\\"')
+    return text
+
+
+# metrics of the daemon
+METRICS = PoteMetrics()
@@ -0,0 +1,181 @@
+"""
+Queue of jobs waiting for an envo.
+"""
+
+import collections
+import heapq
+import itertools
+
+
+# stale entries allowed in the queue, besides as many as there
+# are live ones, before the queue is compacted
+STALE_SLACK = 64
+
+
+class PotePendingQueue(object):
+    """
+    Jobs waiting for an envo.
+
+    Job IDs are kept in the arrival order and, to be picked by
+    priorities and the dispatch policy, in a heap per user, keyed
+    by the order key given on append. Removed jobs stay in the
+    order and the heaps as stale entries, which are skipped when
+    met and dropped when they outnumber the live ones. So taking
+    the first job is O(1), picking the best one is O(log n) per
+    user with pending jobs and removing a job is O(1) amortized.
+
+    Order keys can get out of date (say, when the expected
+    duration of a test changes). They are refreshed lazily: a
+    heap head is checked against the actual key when it comes
+    to the top.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        # job ID -> (entry token, user, priority) of live jobs
+        self.members = {}
+        # (token, job ID) in the arrival order
+        self.order = collections.deque()
+        # user -> heap of [order key, token, job ID]
+        self.heaps = {}
+        # number of heap entries, stale ones included
+        self.entries = 0
+        # number of live jobs with a non-default priority
+        self.prioritized = 0
+        self.tokens = itertools.count()
+
+    def __len__(self):
+        """
+        Return the number of jobs in the queue.
+
+        :rtype: integer
+        """
+        return len(self.members)
+
+    def __iter__(self):
+        """
+        Iterate over IDs of the jobs in the arrival order.
+        """
+        return (job_id for token, job_id in list(self.order)
+                if self._is_live(token, job_id))
+
+    def __reversed__(self):
+        """
+        Iterate over IDs of the jobs, the newest first.
+        """
+        return (job_id for token, job_id in reversed(self.order)
+                if self._is_live(token, job_id))
+
+    def append(self, job_id, user, key, left=False):
+        """
+        Add the job to the queue.
+
+        :param job_id: job unique identifier
+        :type job_id: string
+
+        :param user: name of the user the job is picked for
+        :type user: string
+
+        :param key: order key of the job. Its first item is the
+            negated job priority.
+        :type key: tuple
+
+        :param left: put the job to the head of the arrival order
+        :type left: boolean
+        """
+        assert job_id not in self.members
+        token = next(self.tokens)
+        self.members[job_id] = (token, user, key[0])
+        if key[0]:
+            self.prioritized += 1
+        if left:
+            self.order.appendleft((token, job_id))
+        else:
+            self.order.append((token, job_id))
+        heapq.heappush(self.heaps.setdefault(user, []),
+                       [key, token, job_id])
+        self.entries += 1
+
+    def remove(self, job_id):
+        """
+        Remove the job from the queue.
+
+        :param job_id: job unique identifier
+        :type job_id: string
+        """
+        (_token, _user, priority) = self.members.pop(job_id)
+        if priority:
+            self.prioritized -= 1
+        if len(self.order) > 2 * len(self.members) + STALE_SLACK:
+            self.order = collections.deque(
+                entry for entry in self.order if self._is_live(*entry))
+        if self.entries > 2 * len(self.members) + STALE_SLACK:
+            for user, heap in self.heaps.items():
+                heap[:] = [entry for entry in heap
+                           if self._is_live(*entry[1:])]
+                if heap:
+                    heapq.heapify(heap)
+                else:
+                    del self.heaps[user]
+            self.entries = sum(len(heap) for heap in self.heaps.values())
+
+    def first(self):
+        """
+        Return ID of the job at the head of the arrival order
+        or None if the queue is empty.
+
+        :rtype: NoneType or string
+        """
+        while self.order:
+            (token, job_id) = self.order[0]
+            if self._is_live(token, job_id):
+                return job_id
+            self.order.popleft()
+        return None
+
+    def heads(self, key_func):
+        """
+        Return the best job of every user: tuples of the user,
+        the order key and the job ID.
+
+        :param key_func: returns the actual order key of a job
+            by its ID
+        :type key_func: function
+
+        :rtype: list of tuples
+        """
+        heads = []
+        for user, heap in self.heaps.items():
+            while heap:
+                (key, token, job_id) = heap[0]
+                if not self._is_live(token, job_id):
+                    heapq.heappop(heap)
+                    self.entries -= 1
+                    continue
+                actual = key_func(job_id)
+                if actual == key:
+                    heads.append((user, key, job_id))
+                    break
+                # refresh the key and look at the new head
+                heap[0][0] = actual
+                heapq.heapreplace(heap, heap[0])
+            if not heap:
+                del self.heaps[user]
+        return heads
+
+    def _is_live(self, token, job_id):
+        """
+        Return True if the entry refers to a job in the queue.
+
+        :param token: entry token
+        :type token: integer
+
+        :param job_id: job unique identifier
+        :type job_id: string
+
+        :rtype: boolean
+        """
+        member = self.members.get(job_id)
+        return member is not None and member[0] == token
@@ -0,0 +1,206 @@
+"""
+Socket server mix-in serving connections with a fixed pool
+of worker threads.
+"""
+
+import errno
+import fcntl
+import os
+import Queue
+import select
+import threading
+import time
+
+
+# default number of worker threads
+DEF_WORKERS = 16
+
+# default max number of detached requests served at once
+DEF_MAX_DETACHED = 256
+
+# how long to keep an idle persistent connection open, in seconds
+KEEPALIVE_TIMEOUT = 15
+
+# how often to look for expired idle connections, in seconds
+SWEEP_PERIOD = 1
+
+
+class PotePoolMixIn(object):
+    """
+    Mix-in for SocketServer servers to serve connections with
+    a fixed number of worker threads instead of starting a thread
+    for every connection, like SocketServer.ThreadingMixIn does.
+
+    A worker serves requests of a connection while they arrive
+    back to back. An idle persistent connection is given back to
+    the main loop, which waits for the next request on it along
+    with new connections, so idle clients do not hold workers.
+    The request handler asks to keep the connection open by setting
+    its 'keep_alive' attribute to True.
+
+    A request which is going to take long (a long-poll or a stream)
+    calls detach(): another worker takes its place in the pool
+    at once and the detached one exits when the request is done.
+    No more than max_detached requests are detached at once; past
+    that detach() refuses and the request must be rejected, so slow
+    clients cannot make the server start threads without a bound.
+    """
+
+    workers = DEF_WORKERS
+    max_detached = DEF_MAX_DETACHED
+    keepalive_timeout = KEEPALIVE_TIMEOUT
+
+    _tasks = None
+    _local = None
+    _wakeup_wfd = None
+
+    def serve_forever(self, poll_interval=SWEEP_PERIOD):
+        """
+        Start the workers and serve connections until shutdown().
+
+        :param poll_interval: how often to look for expired idle
+            connections, in seconds
+        :type poll_interval: number
+        """
+        self._tasks = Queue.Queue()
+        self._local = threading.local()
+        # idle connections: socket -> (client address, expiration time)
+        self._idle = {}
+        self._idle_lock = threading.Lock()
+        # number of detached workers still running
+        self._detached = 0
+        self._detached_lock = threading.Lock()
+        (wakeup_rfd, self._wakeup_wfd) = os.pipe()
+        flags = fcntl.fcntl(self._wakeup_wfd, fcntl.F_GETFL)
+        fcntl.fcntl(self._wakeup_wfd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._stopped = False
+        for _ in range(self.workers):
+            self._start_worker()
+        try:
+            while not self._stopped:
+                with self._idle_lock:
+                    idle = dict(self._idle)
+                try:
+                    (readable, _w, _x) = select.select(
+                        [self, wakeup_rfd] + idle.keys(), [], [],
+                        poll_interval)
+                except select.error as exc:
+                    if exc.args[0] != errno.EINTR:
+                        raise
+                    continue
+                if wakeup_rfd in readable:
+                    os.read(wakeup_rfd, 4096)
+                if self in readable:
+                    self._handle_request_noblock()
+                now = time.time()
+                for request, (client_address, expires) in idle.items():
+                    if request in readable:
+                        with self._idle_lock:
+                            del self._idle[request]
+                        self._tasks.put((request, client_address))
+                    elif expires < now:
+                        with self._idle_lock:
+                            del self._idle[request]
+                        self.shutdown_request(request)
+        finally:
+            for _ in range(self.workers):
+                self._tasks.put(None)
+            with self._idle_lock:
+                for request in self._idle:
+                    self.shutdown_request(request)
+                self._idle.clear()
+            os.close(wakeup_rfd)
+            os.close(self._wakeup_wfd)
+
+    def shutdown(self):
+        """
+        Stop the serve_forever() loop.
+        """
+        self._stopped = True
+        self._wakeup()
+
+    def process_request(self, request, client_address):
+        """
+        Queue the connection to be served by a worker.
+        Overrides SocketServer.BaseServer.process_request().
+        """
+        self._tasks.put((request, client_address))
+
+    def finish_request(self, request, client_address):
+        """
+        Serve the connection. Return the request handler.
+        Overrides SocketServer.BaseServer.finish_request().
+
+        :rtype: SocketServer.BaseRequestHandler
+        """
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def detach(self):
+        """
+        Tell the server the current request is going to take long,
+        so its worker must be replaced in the pool. Return False
+        when too many requests are detached already: the request
+        must not wait then. Does nothing (and returns True) when
+        called not from a pooled worker or called again.
+
+        :rtype: boolean
+        """
+        if self._local is None or \
+                getattr(self._local, 'detached', True):
+            return True
+        with self._detached_lock:
+            if self._detached >= self.max_detached:
+                return False
+            self._detached += 1
+        self._local.detached = True
+        self._start_worker()
+        return True
+
+    def _start_worker(self):
+        """
+        Start a new worker thread.
+        """
+        worker = threading.Thread(target=self._worker)
+        worker.daemon = True
+        worker.start()
+
+    def _worker(self):
+        """
+        Worker thread activity.
+        """
+        self._local.detached = False
+        while not self._local.detached:
+            task = self._tasks.get()
+            if task is None:
+                return
+            (request, client_address) = task
+            handler = None
+            try:
+                handler = self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            if getattr(handler, 'keep_alive', False) and \
+                    not self._stopped:
+                with self._idle_lock:
+                    self._idle[request] = (
+                        client_address,
+                        time.time() + self.keepalive_timeout)
+                self._wakeup()
+            else:
+                self.shutdown_request(request)
+        with self._detached_lock:
+            self._detached -= 1
+
+    def _wakeup(self):
+        """
+        Interrupt select() of the serve_forever() loop.
+        """
+        try:
+            os.write(self._wakeup_wfd, '\0')
+        except OSError as exc:
+            # a full pipe wakes the loop up anyway
+            if exc.errno not in (errno.EAGAIN, errno.EBADF):
+                raise
+        except TypeError:
+            # the loop is not started yet
+            pass
@@ -4,11 +4,64 @@ RestFul API Server.
 
 import BaseHTTPServer
 import cgi
+import errno
+import gzip
 import json
 import logging
+import os
+import re
+import socket
 import SocketServer
+import time
 import urlparse
 import uuid
+import zlib
+
+from . import limits as pote_limits
+from .archive import FILTERS, GZIP_LEVEL
+from .metrics import CONTENT_TYPE, METRICS
+from .pool import PotePoolMixIn
+from .scheduler import MAX_PRIORITY, MIN_PRIORITY
+from .sendfile import sendfile
+
+
+# default and max time (in seconds) to hold a long-poll request
+POLL_TIMEOUT = 25
+MAX_POLL_TIMEOUT = 60
+
+# how often to send keep-alive comments to Server-Sent Events clients
+KEEPALIVE_PERIOD = 15
+
+# how often to check output of a running job for new data
+FOLLOW_PERIOD = 0.5
+
+# default and max time (in seconds) a job is allowed to run
+DEF_MAX_DURATION = 90
+MAX_MAX_DURATION = 24 * 60 * 60
+
+# max size of a chunk of a file sent without sendfile()
+CHUNK_SIZE = 64 * 1024
+
+# min size of a JSON reply to compress, in bytes
+GZIP_MIN_SIZE = 1024
+
+# max size of a request entity, in bytes
+MAX_ENTITY_SIZE = 16 * 1024 * 1024
+
+# max time to wait for the rest of a request being received,
+# in seconds (HTTP/1.1 server only)
+REQUEST_TIMEOUT = 60
+
+# URI paths requests are accounted by in metrics.
+# Requests to other paths are accounted as 'other'
+ROUTES = ('ping', 'envo', 'group', 'test', 'job', 'jobs', 'usage',
+          'archive', 'events', 'metrics', 'job/log')
+
+METRICS.histogram(
+    'pote_http_request_seconds',
+    'Time to process an HTTP request, by method and route')
+METRICS.counter(
+    'pote_http_responses_total', 'HTTP responses sent, by status code')
 
 
 class RepliedException(Exception):
@@ -48,16 +101,33 @@ class PoteApiServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
         self.scheduler = scheduler
         self.tests = tests
         self.archive = archive
+        # makes entity tags of collections unique across restarts
+        self.epoch = uuid.uuid4().hex[:8]
+        # the last shared reply compressed and its gzipped form
+        self.gzipped = (None, None)
         self.logger = logging.getLogger(self.__class__.__name__)
         BaseHTTPServer.HTTPServer.__init__(
             self, (bindaddr, bindport), PoteApiServerHandler)
 
+    def detach(self):
+        """
+        Tell the server the current request is going to take long.
+        Every connection has a thread of its own here, so there
+        is nothing to do.
+
+        :rtype: boolean
+        """
+        return True
+
 
 class PoteApiServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     """
     HTTP Request Handler.
     """
 
+    # True when the reply is sent with chunked transfer encoding
+    chunked = False
+
     def __getattr__(self, attr):
         """
         Standard method override.
@@ -76,6 +146,7 @@ class PoteApiServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         BaseHTTPServer.BaseHTTPRequestHandler silently drops all
         exceptions raised during HTTP request processing.
         """
+        started = time.time()
         try:
             try:
                 self.process_unsafe()
@@ -90,6 +161,8 @@ class PoteApiServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         except RepliedException:
             # catch exceptions raised from overrided send_error()
             pass
+        METRICS.observe('pote_http_request_seconds', time.time() - started,
+                        method=self.command, route=self._route())
 
     def process_unsafe(self):
         """
@@ -114,75 +187,547 @@ class PoteApiServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                 raise RepliedException
             elif path == 'envo':
                 self.reply_with_json(self.server.scheduler.envos_count)
+            elif path == 'group':
+                self.reply_with_json(self.server.scheduler.groups)
             elif path == 'test':
-                self.reply_with_json(sorted(self.server.tests.available()))
+                tests = self.server.tests.available()
+                etag = self._check_etag(self.server.tests.version)
+                self.reply_with_json(sorted(tests), etag=etag)
             elif path == 'job':
-                self.reply_with_json(self.server.scheduler.queued())
+                self._check_etag(self.server.scheduler.version)
+                (version, encoded) = \
+                    self.server.scheduler.queued_snapshot()
+                self.reply_with_encoded(
+                    encoded, etag=self._etag(version), shared=True)
+            elif path == 'usage':
+                self.reply_with_json(self.server.scheduler.user_usage())
+            elif path == 'metrics':
+                self._send_metrics()
             elif path == 'archive':
-                self.reply_with_json(self.server.archive.dump())
+                etag = self._check_etag(self.server.archive.version)
+                self.reply_with_json(
+                    self._dump_archive(parsed.query), etag=etag)
+            elif path == 'events':
+                self._send_events(parsed.query)
+            elif path.startswith('job/') and path.endswith('/log'):
+                self._send_log(path[len('job/'):-len('/log')], parsed.query)
         if self.command == 'POST':
             if path == 'job':
                 request = self._read_and_decode_entity()
                 self.logger.debug('new job request: %r', request)
-                if not isinstance(request, dict):
-                    self.send_error(400, 'Bad request object')
-                # check incoming values
-                user = request.get('user')
-                if not (isinstance(user, basestring) and len(user)):
-                    self.send_error(400, 'Bad user name')
                 try:
-                    envo = int(request.get('envo'))
-                    if not (0 <= envo <= self.server.scheduler.envos_count):
-                        self.send_error(400, 'Bad environment ID')
-                except ValueError:
-                    self.send_error(400, 'Bad environment ID')
-                test = request.get('test')
-                if test not in self.server.tests:
-                    self.send_error(400, 'Bad test set name')
-                job_id = uuid.uuid4().hex
-                self.server.scheduler.notify_job_add(
-                    {'id': job_id,
-                     'user': user,
-                     'envo': envo,
-                     'test': test,
-                     'max_duration': 90})
-                self.reply_with_json(job_id, 201)
+                    job = self._make_job(request, self.server.tests.snapshot())
+                except ValueError as exc:
+                    self.send_error(400, str(exc))
+                self.server.scheduler.notify_job_add(job)
+                self.reply_with_json(job['id'], 201)
+            elif path == 'jobs':
+                request = self._read_and_decode_entity()
+                self.logger.debug('new jobs request: %r', request)
+                if not isinstance(request, list) or not request:
+                    self.send_error(400, 'Bad request array')
+                # take the tests once for the whole batch
+                tests = self.server.tests.snapshot()
+                jobs = []
+                for index, job_request in enumerate(request):
+                    try:
+                        jobs.append(self._make_job(job_request, tests))
+                    except ValueError as exc:
+                        self.send_error(400, 'Job #%d: %s' % (index, exc))
+                self.server.scheduler.notify_jobs_add(jobs)
+                self.reply_with_json([job['id'] for job in jobs], 201)
         self.send_error(404)
 
-    def reply_with_json(self, obj, status_code=200):
+    def reply_with_json(self, obj, status_code=200, etag=None):
         """
-        Reply to the client with JSON object.
+        Reply to the client with JSON object. Big replies are
+        compressed for clients accepting gzip encoding.
 
         :param obj: object to send
         :type obj: any
 
         :param status_code: HTTP status code to reply
         :type status_code: integer
+
+        :param etag: entity tag of the object
+        :type etag: NoneType or string
+        """
+        self.reply_with_encoded(json.dumps(obj), status_code, etag)
+
+    def reply_with_encoded(self, encoded, status_code=200, etag=None,
+                           shared=False):
+        """
+        Reply to the client with already JSON encoded object.
+
+        :param encoded: JSON encoded object
+        :type encoded: string
+
+        :param status_code: HTTP status code to reply
+        :type status_code: integer
+
+        :param etag: entity tag of the object
+        :type etag: NoneType or string
+
+        :param shared: True if the same string is sent to many clients,
+            so its gzipped form is worth keeping.
+        :type shared: boolean
         """
-        encoded = json.dumps(obj)
         self.send_response(status_code)
         self.send_header('Content-Type', 'application/json')
+        if etag is not None:
+            self.send_header('ETag', etag)
+            # make browsers revalidate the object on every poll
+            self.send_header('Cache-Control', 'no-cache')
+        if len(encoded) >= GZIP_MIN_SIZE:
+            self.send_header('Vary', 'Accept-Encoding')
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                encoded = self._gzip(encoded, shared)
+                self.send_header('Content-Encoding', 'gzip')
         self.send_header('Content-Length', len(encoded))
         self.end_headers()
         self.wfile.write(encoded)
         raise RepliedException
 
+    def _gzip(self, data, shared=False):
+        """
+        Return the data compressed in gzip format.
+
+        :param data: data to compress
+        :type data: string
+
+        :param shared: True if the same string is sent to many clients.
+            The last one compressed is kept to be reused.
+        :type shared: boolean
+
+        :rtype: string
+        """
+        (source, compressed) = self.server.gzipped
+        if shared and source is data:
+            return compressed
+        compressor = zlib.compressobj(
+            GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+        if shared:
+            self.server.gzipped = (data, compressed)
+        return compressed
+
+    def _etag(self, version):
+        """
+        Return the entity tag of the collection version.
+
+        :param version: collection version, as maintained
+            by its owner
+        :type version: integer
+
+        :rtype: string
+        """
+        # weak, as it is the same for plain and gzipped replies
+        return 'W/"%s-%d"' % (self.server.epoch, version)
+
+    def _check_etag(self, version):
+        """
+        Return the entity tag of the collection version. Reply
+        with '304 Not Modified' when the client already has
+        this version.
+
+        :param version: collection version, as maintained
+            by its owner
+        :type version: integer
+
+        :rtype: string
+        """
+        etag = self._etag(version)
+        tags = [tag.strip() for tag
+                in self.headers.get('If-None-Match', '').split(',')]
+        if etag in tags or etag[2:] in tags or '*' in tags:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            raise RepliedException
+        return etag
+
+    def _make_job(self, request, tests):
+        """
+        Check the job request and return a new job.
+
+        :param request: job request decoded from the client
+        :type request: any
+
+        :param tests: index of available tests,
+            as returned by pote.tests.PoteTests.snapshot()
+        :type tests: dict
+
+        :rtype: dict
+
+        :raise ValueError: when the request is malformed.
+        """
+        if not isinstance(request, dict):
+            raise ValueError('Bad request object')
+        user = request.get('user')
+        if not (isinstance(user, basestring) and len(user)):
+            raise ValueError('Bad user name')
+        envo = request.get('envo')
+        group = None
+        if isinstance(envo, basestring) and \
+                envo in self.server.scheduler.groups:
+            (envo, group) = (None, envo)
+            if not self.server.scheduler.groups[group]:
+                raise ValueError('No environments in the group')
+        else:
+            try:
+                envo = int(envo)
+            except (TypeError, ValueError):
+                raise ValueError('Bad environment ID')
+            if not 0 <= envo < self.server.scheduler.envos_count:
+                raise ValueError('Bad environment ID')
+        test = request.get('test')
+        if test not in tests:
+            raise ValueError('Bad test set name')
+        max_duration = request.get('max_duration')
+        if max_duration is None:
+            # declared by the test or learned from its last runs
+            meta = tests[test]
+            max_duration = min(meta['timeout'] or meta['learned_timeout'] or
+                               DEF_MAX_DURATION, MAX_MAX_DURATION)
+        if isinstance(max_duration, bool) or \
+                not isinstance(max_duration, (int, long, float)) or \
+                not 0 < max_duration <= MAX_MAX_DURATION:
+            raise ValueError('Bad max duration')
+        job = {'id': uuid.uuid4().hex,
+               'user': user,
+               'envo': envo,
+               'group': group,
+               'test': test,
+               'max_duration': max_duration}
+        deadline = request.get('deadline')
+        if deadline is not None:
+            if isinstance(deadline, bool) or \
+                    not isinstance(deadline, (int, long, float)) or \
+                    deadline <= 0:
+                raise ValueError('Bad deadline')
+            # relative to the submission, so clocks of clients
+            # do not matter
+            job['deadline'] = time.time() + deadline
+        priority = request.get('priority')
+        if priority is not None:
+            if isinstance(priority, bool) or \
+                    not isinstance(priority, (int, long)) or \
+                    not MIN_PRIORITY <= priority <= MAX_PRIORITY:
+                raise ValueError('Bad priority')
+            job['priority'] = priority
+        cache = request.get('cache')
+        if cache is not None:
+            if not isinstance(cache, bool):
+                raise ValueError('Bad cache flag')
+            if not cache:
+                job['cache'] = False
+        if request.get('limits') is not None:
+            try:
+                pote_limits.check(request['limits'])
+            except ValueError as exc:
+                raise ValueError('Bad limits: %s' % exc)
+            job['limits'] = request['limits']
+        return job
+
+    def _send_metrics(self):
+        """
+        Send metrics of the daemon in the Prometheus text
+        exposition format.
+        """
+        encoded = METRICS.render(self.server.scheduler.gauges())
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', len(encoded))
+        self.end_headers()
+        self.wfile.write(encoded)
+        raise RepliedException
+
+    def _route(self):
+        """
+        Return the route of the request to account it by in metrics.
+
+        :rtype: string
+        """
+        path = urlparse.urlparse(self.path).path.strip('/')
+        if path.startswith('job/') and path.endswith('/log'):
+            path = 'job/log'
+        if path in ROUTES:
+            return path
+        return 'other'
+
+    def _send_events(self, query):
+        """
+        Send job state changes to the client. With 'Accept:
+        text/event-stream' changes are streamed as Server-Sent Events
+        until the client disconnects. Otherwise the request is held
+        until some changes are made (long-poll) and a JSON object
+        with the changes and the cursor to resume from is returned.
+        The 'reset' flag in the reply means the client must refetch
+        the job lists because the changes since its cursor are lost.
+
+        :param query: URL query string
+        :type query: string
+        """
+        args = {name: values[-1] for name, values
+                in urlparse.parse_qs(query).items()}
+        events = self.server.scheduler.events
+        cursor = args.get('cursor', self.headers.get('Last-Event-ID'))
+        if 'text/event-stream' in self.headers.get('Accept', ''):
+            if not self.server.detach():
+                self.send_error(503, 'Too many waiting requests')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            # tell nginx to not buffer the stream
+            self.send_header('X-Accel-Buffering', 'no')
+            self._start_chunked()
+            self.end_headers()
+            if cursor is None:
+                cursor = events.cursor()
+            try:
+                while True:
+                    (cursor, deltas) = events.read(cursor, KEEPALIVE_PERIOD)
+                    if deltas is None:
+                        data = 'event: reset\nid: %s\ndata: {}\n\n' % cursor
+                    elif deltas:
+                        data = ''.join('data: %s\n\n' % json.dumps(delta)
+                                       for delta in deltas[:-1])
+                        data += 'id: %s\ndata: %s\n\n' % (
+                            cursor, json.dumps(deltas[-1]))
+                    else:
+                        data = ': keep-alive\n\n'
+                    self._write_chunk(data)
+                    self.wfile.flush()
+            except socket.error:
+                self.logger.debug('event stream closed')
+                self.close_connection = 1
+            raise RepliedException
+        try:
+            timeout = float(args.get('timeout', POLL_TIMEOUT))
+        except ValueError:
+            self.send_error(400, 'Bad timeout')
+        if cursor is None:
+            # the client is just starting: it needs the cursor first
+            self.reply_with_json(
+                {'cursor': events.cursor(), 'reset': True, 'events': []})
+        if timeout > 0 and not self.server.detach():
+            self.send_error(503, 'Too many waiting requests')
+        (cursor, deltas) = events.read(
+            cursor, max(0, min(timeout, MAX_POLL_TIMEOUT)))
+        self.reply_with_json(
+            {'cursor': cursor, 'reset': deltas is None,
+             'events': deltas or []})
+
+    def _send_log(self, job_id, query):
+        """
+        Send output of the job, starting from the byte offset given
+        with the 'offset' query argument or with the 'Range: bytes=N-'
+        header. Works both for running jobs (the output is still being
+        written) and for archived ones. Output of a job running on
+        a remote agent is available once the job is archived, as the
+        agent sends it only then. With 'follow=1' the request
+        waits up to 'timeout' seconds for new output of a running job.
+        Reply headers tell the offset to resume from (X-Pote-Offset)
+        and if the output is complete (X-Pote-Complete). Compressed
+        archived output is sent as is to clients accepting gzip
+        encoding and decompressed on the fly for the rest.
+
+        :param job_id: job unique identifier
+        :type job_id: string
+
+        :param query: URL query string
+        :type query: string
+        """
+        args = {name: values[-1] for name, values
+                in urlparse.parse_qs(query).items()}
+        ranged = False
+        try:
+            offset = int(args.get('offset', 0))
+            match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+            if match:
+                offset = int(match.group(1))
+                ranged = True
+            timeout = max(0, min(float(args.get('timeout', POLL_TIMEOUT)),
+                                 MAX_POLL_TIMEOUT))
+            if offset < 0:
+                raise ValueError
+        except ValueError:
+            self.send_error(400, 'Bad query arguments')
+        follow = args.get('follow') in ('1', 'true')
+        deadline = time.time() + timeout
+        while True:
+            (fdescr, size, complete) = self._open_log(job_id)
+            if fdescr is None:
+                self.send_error(404, 'No such job or job output')
+            if size > offset or complete or not follow or \
+                    time.time() >= deadline:
+                break
+            fdescr.close()
+            if not self.server.detach():
+                self.send_error(503, 'Too many waiting requests')
+            time.sleep(FOLLOW_PERIOD)
+        with fdescr:
+            if ranged and offset > size:
+                self.send_error(416)
+            count = max(0, size - offset)
+            encoded = isinstance(fdescr, gzip.GzipFile) and \
+                offset == 0 and not ranged and \
+                'gzip' in self.headers.get('Accept-Encoding', '')
+            body = (fdescr, offset, count)
+            if encoded:
+                raw_fdescr = fdescr.fileobj
+                raw_fdescr.seek(0, os.SEEK_END)
+                body = (raw_fdescr, 0, raw_fdescr.tell())
+                self.send_response(200)
+                self.send_header('Content-Encoding', 'gzip')
+            elif ranged and count:
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                                 (offset, offset + count - 1, size))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', body[2])
+            self.send_header('X-Pote-Offset', offset + count)
+            self.send_header('X-Pote-Complete', int(complete))
+            self.end_headers()
+            self._send_file(*body)
+        raise RepliedException
+
+    def _open_log(self, job_id):
+        """
+        Open the file with output of the job. Return the file object
+        (or None, if there is no such job or the job has no output),
+        the output size and a flag showing if the output is complete.
+
+        :param job_id: job unique identifier
+        :type job_id: string
+
+        :rtype: tuple of (NoneType or file or gzip.GzipFile,
+            NoneType or integer, boolean)
+        """
+        path = self.server.scheduler.live_log(job_id)
+        if path is not None:
+            try:
+                fdescr = open(path, 'rb')
+            except IOError:
+                # the job could be archived in the meantime
+                fdescr = None
+            if fdescr is not None:
+                info = os.fstat(fdescr.fileno())
+                if self._is_live_log(job_id, path, info):
+                    return fdescr, info.st_size, False
+                fdescr.close()
+        (fdescr, size) = self.server.archive.open_log(job_id)
+        return fdescr, size, True
+
+    def _is_live_log(self, job_id, path, info):
+        """
+        Return True if the file opened by the path is still
+        the output of the running job. The job could be archived
+        after the path was resolved and the envo could start its
+        next job, with a new output file at the same path.
+
+        :param job_id: job unique identifier
+        :type job_id: string
+
+        :param path: path to the output file of the job
+        :type path: string
+
+        :param info: status of the opened file
+        :type info: posix.stat_result
+
+        :rtype: boolean
+        """
+        if self.server.scheduler.live_log(job_id) != path:
+            return False
+        try:
+            current = os.stat(path)
+        except OSError:
+            return False
+        return (current.st_dev, current.st_ino) == \
+            (info.st_dev, info.st_ino)
+
+    def _send_file(self, fdescr, offset, count):
+        """
+        Send a part of the file to the client. A plain file is sent
+        with the zero-copy sendfile(2) when the system supports it.
+
+        :param fdescr: file object
+        :type fdescr: file or file-like object
+
+        :param offset: offset of the first byte to send
+        :type offset: integer
+
+        :param count: how many bytes to send
+        :type count: integer
+        """
+        if isinstance(fdescr, file):
+            try:
+                sendfile(self.connection, fdescr, offset, count)
+                return
+            except OSError as exc:
+                if exc.errno not in (errno.ENOSYS, errno.EINVAL):
+                    raise
+        fdescr.seek(offset)
+        while count > 0:
+            chunk = fdescr.read(min(count, CHUNK_SIZE))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            count -= len(chunk)
+
+    def _dump_archive(self, query):
+        """
+        Fetch a page of archived jobs according to the query string
+        arguments. Sends an error response to the client when
+        the arguments are not valid.
+
+        :param query: URL query string
+        :type query: string
+
+        :rtype: list of dicts
+        """
+        args = {name: values[-1] for name, values
+                in urlparse.parse_qs(query).items()}
+        kwargs = {}
+        for name in ('before', 'after') + FILTERS:
+            if args.get(name):
+                kwargs[name] = args[name]
+        try:
+            if 'limit' in args:
+                kwargs['limit'] = int(args['limit'])
+                if kwargs['limit'] <= 0:
+                    raise ValueError
+            if 'envo' in kwargs:
+                kwargs['envo'] = int(kwargs['envo'])
+        except ValueError:
+            self.send_error(400, 'Bad query arguments')
+        try:
+            return self.server.archive.dump(**kwargs)
+        except KeyError:
+            self.send_error(400, 'No such job')
+
     def _read_and_decode_entity(self):
         """
         Read and decode JSON object from the request. Return the decoded
         object itself on success or sends an error response to the
-        client in case of error.
-        FIXME: supports only HTTP/1.0: no Transfer-Encoding and
-           Transfer-Length will be processed.
+        client in case of error. The entity can be sent with chunked
+        transfer encoding.
 
         :rtype: any
         """
-        try:
-            content_length = int(self.headers.get('Content-Length', '0'))
-        except ValueError:
-            self.send_error(400, 'Bad Content-Length')
-        if content_length == 0:
-            return None
+        chunked = \
+            self.headers.get('Transfer-Encoding', '').lower() == 'chunked'
+        if not chunked:
+            try:
+                content_length = int(self.headers.get('Content-Length', '0'))
+            except ValueError:
+                self.send_error(400, 'Bad Content-Length')
+            if content_length == 0:
+                return None
+            if content_length > MAX_ENTITY_SIZE:
+                self.send_error(413)
         content_type = self.headers.get('Content-Type')
         if content_type is None:
             self.send_error(415, 'Content-Type not defined')
@@ -190,19 +735,78 @@ class PoteApiServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         if ct_main.lower() != 'application/json':
             self.send_error(
                 415, 'Unsupported Content-Type. Use application/json')
-        encoded_entity = self.rfile.read(content_length)
-        if len(encoded_entity) > content_length:
-            encoded_entity = encoded_entity[:content_length]
-            self.logger.warning('extra bytes found')
-        elif len(encoded_entity) < content_length:
-            msg = 'only %r bytes received but %r expected' % \
-                (len(encoded_entity), content_length)
-            self.send_error(400, msg)
+        if chunked:
+            encoded_entity = self._read_chunked()
+        else:
+            encoded_entity = self.rfile.read(content_length)
+            if len(encoded_entity) > content_length:
+                encoded_entity = encoded_entity[:content_length]
+                self.logger.warning('extra bytes found')
+            elif len(encoded_entity) < content_length:
+                msg = 'only %r bytes received but %r expected' % \
+                    (len(encoded_entity), content_length)
+                self.send_error(400, msg)
         try:
             return json.loads(encoded_entity)
         except ValueError:
             self.send_error(400, 'Bad JSON')
 
+    def _read_chunked(self):
+        """
+        Read the request entity sent with chunked transfer encoding.
+
+        :rtype: string
+        """
+        chunks = []
+        size = 0
+        while True:
+            line = self.rfile.readline(1024)
+            try:
+                chunk_size = int(line.split(';', 1)[0], 16)
+                if chunk_size < 0:
+                    raise ValueError
+            except ValueError:
+                self.send_error(400, 'Bad chunk size')
+            if chunk_size == 0:
+                break
+            size += chunk_size
+            if size > MAX_ENTITY_SIZE:
+                self.send_error(413)
+            chunk = self.rfile.read(chunk_size)
+            if len(chunk) < chunk_size or \
+                    self.rfile.readline(1024) != '\r\n':
+                self.send_error(400, 'Truncated chunk')
+            chunks.append(chunk)
+        # skip trailer fields
+        while self.rfile.readline(1024).strip():
+            pass
+        return ''.join(chunks)
+
+    def _start_chunked(self):
+        """
+        Send the header for a reply of unknown length. The reply
+        is sent in chunks when both the server and the client speak
+        HTTP/1.1 and ends with the connection closing otherwise.
+        Must be called before end_headers().
+        """
+        self.chunked = self.protocol_version == 'HTTP/1.1' and \
+            self.request_version == 'HTTP/1.1'
+        if self.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.close_connection = 1
+
+    def _write_chunk(self, data):
+        """
+        Send a part of the reply started with _start_chunked().
+
+        :param data: data to send
+        :type data: string
+        """
+        if self.chunked:
+            data = '%x\r\n%s\r\n' % (len(data), data)
+        self.wfile.write(data)
+
     @property
     def logger(self):
         """
@@ -234,9 +838,76 @@ class PoteApiServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         """
         return "Pote/0.1"
 
+    def send_response(self, code, message=None):
+        """
+        Override for BaseHTTPServer.BaseHTTPRequestHandler.send_response().
+        """
+        METRICS.inc('pote_http_responses_total', code=str(code))
+        BaseHTTPServer.BaseHTTPRequestHandler.send_response(
+            self, code, message)
+
     def send_error(self, *args, **kwargs):
         """
         Override for BaseHTTPServer.BaseHTTPRequestHandler.send_error().
         """
         BaseHTTPServer.BaseHTTPRequestHandler.send_error(self, *args, **kwargs)
         raise RepliedException
+
+
+class PotePooledApiServer(PotePoolMixIn, PoteApiServer):
+    """
+    RestFul API Server speaking HTTP/1.1 with persistent connections,
+    which are served by a fixed pool of worker threads.
+    """
+
+    def __init__(self, bindaddr, bindport, scheduler, tests, archive,
+                 workers=None):
+        """
+        Constructor.
+        See pote.rest.PoteApiServer constructor description
+        for further details about arguments.
+
+        :param workers: number of worker threads.
+        :type workers: NoneType or integer
+        """
+        PoteApiServer.__init__(
+            self, bindaddr, bindport, scheduler, tests, archive)
+        self.RequestHandlerClass = PotePooledApiServerHandler
+        if workers is not None:
+            self.workers = workers
+
+
+class PotePooledApiServerHandler(PoteApiServerHandler):
+    """
+    HTTP/1.1 Request Handler for pote.rest.PotePooledApiServer.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    timeout = REQUEST_TIMEOUT
+
+    # True when the connection must be kept open
+    keep_alive = False
+
+    def handle(self):
+        """
+        Serve requests of the connection while they are already
+        received, then leave the idle connection to the server.
+        Overrides BaseHTTPServer.BaseHTTPRequestHandler.handle().
+        """
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection and self._buffered():
+            self.handle_one_request()
+        self.keep_alive = not self.close_connection
+
+    def _buffered(self):
+        """
+        Return True if a part of the next request is already read
+        from the socket to the buffer of the rfile, so select() on
+        the socket would not tell it arrived.
+
+        :rtype: boolean
+        """
+        # socket._fileobject keeps the unread data in a StringIO
+        buf = getattr(self.rfile, '_rbuf', None)
+        return buf is not None and buf.tell() > 0
@@ -0,0 +1,193 @@
+"""
+Thread which removes and packs old jobs of the archive.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from .status import STATUS_FAILED
+
+
+# how often to apply the policies, in seconds
+DEF_PERIOD = 60 * 60
+
+# default disk I/O budget, in bytes per second
+DEF_IO_RATE = 4 * 1024 * 1024
+
+# I/O cost of a job besides its size (directory and index updates)
+JOB_COST = 64 * 1024
+
+# seconds in a day
+DAY = 24 * 60 * 60
+
+
+class PoteRetention(threading.Thread):
+    """
+    Archive retention thread.
+
+    Once a period it removes jobs matching any of the retention
+    policies (too old, too many for the user or for the test, over
+    the total size) except the last failed jobs and jobs whose output
+    is still read by cached jobs, and packs jobs older than pack_after
+    into per-day segments. The work is throttled to io_rate bytes per
+    second so it does not compete with running tests for the disk.
+    """
+
+    def __init__(self, archive, max_age=None, max_bytes=None,
+                 max_per_user=None, max_per_test=None, keep_failures=None,
+                 pack_after=None, io_rate=None, period=None):
+        """
+        Constructor.
+
+        :param archive: interface to the Archive Storage
+        :type archive: pote.PoteArchive
+
+        :param max_age: remove jobs older than this, in seconds
+        :type max_age: NoneType or number
+
+        :param max_bytes: remove the oldest jobs while the archive
+            is bigger than this, in bytes
+        :type max_bytes: NoneType or integer
+
+        :param max_per_user: keep only this many newest jobs per user
+        :type max_per_user: NoneType or integer
+
+        :param max_per_test: keep only this many newest jobs per test
+        :type max_per_test: NoneType or integer
+
+        :param keep_failures: never remove this many newest failed jobs
+        :type keep_failures: NoneType or integer
+
+        :param pack_after: pack jobs older than this into segments,
+            in seconds
+        :type pack_after: NoneType or number
+
+        :param io_rate: disk I/O budget, in bytes per second.
+            Zero disables throttling.
+        :type io_rate: NoneType or integer
+
+        :param period: how often to apply the policies, in seconds
+        :type period: NoneType or number
+        """
+        threading.Thread.__init__(self)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.daemon = True
+        self.archive = archive
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.max_per_user = max_per_user
+        self.max_per_test = max_per_test
+        self.keep_failures = keep_failures
+        self.pack_after = pack_after
+        self.io_rate = DEF_IO_RATE if io_rate is None else io_rate
+        self.period = DEF_PERIOD if period is None else period
+
+    @classmethod
+    def running(cls, *args, **kwargs):
+        """
+        Create and start a new retention thread instance.
+        Return a link to the object created.
+        See constructor description for further details
+        about arguments.
+
+        :rtype: pote.retention.PoteRetention
+        """
+        instance = cls(*args, **kwargs)
+        instance.start()
+        return instance
+
+    def run(self):
+        """
+        Main thread activity.
+        """
+        while True:
+            try:
+                self.apply(time.time())
+            except Exception:
+                self.logger.error('retention pass crashed', exc_info=True)
+            time.sleep(self.period)
+
+    def apply(self, now):
+        """
+        Remove and pack jobs according to the policies.
+
+        :param now: current time (seconds since Unix Epoch)
+        :type now: number
+        """
+        entries = self.archive.entries()
+        victims = self.select(entries, now)
+        if victims:
+            self.logger.info('removing %r jobs', len(victims))
+            self.archive.remove(victims, self._throttle)
+        if self.pack_after is None:
+            return
+        victims = set(victims)
+        days = collections.defaultdict(list)
+        for entry in entries:
+            if entry['time'] < now - self.pack_after and \
+                    entry['segment'] is None and entry['id'] not in victims:
+                day = time.strftime('%Y-%m-%d', time.gmtime(entry['time']))
+                days[day].append(entry['id'])
+        for day, job_ids in sorted(days.items()):
+            self.logger.info('packing %r jobs to %r', len(job_ids), day)
+            self.archive.pack(day, job_ids, self._throttle)
+
+    def select(self, entries, now):
+        """
+        Return IDs of jobs to remove, oldest first.
+
+        :param entries: brief details of archived jobs,
+            as returned by pote.PoteArchive.entries()
+        :type entries: list of dicts
+
+        :param now: current time (seconds since Unix Epoch)
+        :type now: number
+
+        :rtype: list of strings
+        """
+        protected = set()
+        if self.keep_failures:
+            failed = [entry['id'] for entry in entries
+                      if entry['status'] == STATUS_FAILED]
+            protected.update(failed[-self.keep_failures:])
+        victims = set()
+        if self.max_age is not None:
+            victims.update(entry['id'] for entry in entries
+                           if entry['time'] < now - self.max_age)
+        for field, limit in (('user', self.max_per_user),
+                             ('test', self.max_per_test)):
+            if limit is None:
+                continue
+            counts = collections.defaultdict(int)
+            for entry in reversed(entries):
+                counts[entry[field]] += 1
+                if counts[entry[field]] > limit:
+                    victims.add(entry['id'])
+        # a cache hit has no output of its own and reads the output
+        # of the job the result is taken from
+        protected.update(entry['cached'] for entry in entries
+                         if entry['cached'] and entry['id'] not in victims)
+        victims -= protected
+        if self.max_bytes is not None:
+            total = sum(entry['size'] for entry in entries
+                        if entry['id'] not in victims)
+            for entry in entries:
+                if total <= self.max_bytes:
+                    break
+                if entry['id'] in victims or entry['id'] in protected:
+                    continue
+                victims.add(entry['id'])
+                total -= entry['size']
+        return [entry['id'] for entry in entries if entry['id'] in victims]
+
+    def _throttle(self, size):
+        """
+        Sleep to keep the disk I/O rate under the budget.
+
+        :param size: bytes processed since the last call
+        :type size: integer
+        """
+        if self.io_rate:
+            time.sleep(float(size + JOB_COST) / self.io_rate)
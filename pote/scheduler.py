@@ -2,37 +2,174 @@
 Test tasks scheduler thread.
 """
 
+import collections
+import json
 import logging
 import os.path
 import Queue
+import shutil
 import threading
 import time
 
+from .agent import PoteRemoteWarden, PoteWardenPool
+from .cleaner import TRASH_DIR, PoteCleaner
+from .events import DELTA_ARCHIVE, DELTA_JOB, PoteEventLog
+from .journal import PoteJournal
 from .jqueue import PoteJobQueue
+from .metrics import METRICS
+from .pending import PotePendingQueue
+from .status import (STATUS_DONE, STATUS_ENQUEUED, STATUS_FAILED,
+                     STATUS_RUNNING, STATUS_STARTING)
+from .tests import STATS_WINDOW
 from .warden import PoteWarden
 
 
-# job statuses
-STATUS_ENQUEUED = 'enqueued'
-STATUS_STARTING = 'starting'
-STATUS_RUNNING = 'running'
-STATUS_DONE = 'done'
-STATUS_FAILED = 'failed'
-
 # event types
 EVENT_ADD = 'add'
+EVENT_ADD_BATCH = 'add-batch'
 EVENT_FAILED = 'failed'
 EVENT_STARTED = 'started'
 EVENT_STOPPED = 'stopped'
 EVENT_SUCCESS = 'success'
 EVENT_RESULT = 'result'
+EVENT_AGENT_JOINED = 'agent-joined'
+EVENT_AGENT_LOST = 'agent-lost'
 
 KNOWN_EVENTS = [EVENT_ADD,
+                EVENT_ADD_BATCH,
                 EVENT_FAILED,
                 EVENT_STARTED,
                 EVENT_STOPPED,
                 EVENT_SUCCESS,
-                EVENT_RESULT]
+                EVENT_RESULT,
+                EVENT_AGENT_JOINED,
+                EVENT_AGENT_LOST]
+
+# name of the file with envo IDs of remote agents, kept in the queue
+# directory. A JSON object mapping agent names to lists of envo IDs
+AGENTS_NAME = 'agents.json'
+
+# name of the envo group containing all envos
+GROUP_ANY = 'any'
+
+# policies of group job assignment:
+#  least-loaded: the job is placed to the pending queue of the envo
+#    with the least jobs at the moment of job arrival;
+#  work-stealing: the same placement, but an envo ran out of jobs
+#    takes the newest group job from the most loaded envo of the group.
+POLICY_LEAST_LOADED = 'least-loaded'
+POLICY_WORK_STEALING = 'work-stealing'
+
+KNOWN_POLICIES = [POLICY_LEAST_LOADED,
+                  POLICY_WORK_STEALING]
+
+# policies of picking the next job of an envo:
+#  fifo: the oldest job;
+#  sjf: the job of the test with the shortest average duration.
+#    Tests never run successfully go first, to learn their durations;
+#  deadline: the job with a deadline which must start the earliest to
+#    meet it (its deadline minus the expected duration), then the
+#    jobs without deadlines as with sjf.
+# Whatever the policy is, jobs of a higher priority go first and,
+# with fair-share, jobs of users who used envos less recently;
+# jobs waiting for longer than STARVATION_TIME are picked before
+# all others, the oldest first.
+DISPATCH_FIFO = 'fifo'
+DISPATCH_SJF = 'sjf'
+DISPATCH_DEADLINE = 'deadline'
+
+KNOWN_DISPATCH_POLICIES = [DISPATCH_FIFO,
+                           DISPATCH_SJF,
+                           DISPATCH_DEADLINE]
+
+# how long a job can be passed over by a dispatch policy,
+# priorities or fair-share
+STARVATION_TIME = 10 * 60
+
+# range of job priorities. Jobs of a higher priority are picked
+# first, whatever the dispatch policy is
+MIN_PRIORITY = -10
+MAX_PRIORITY = 10
+
+# half-life of the usage accounted to users, in seconds
+USAGE_HALF_LIFE = 60 * 60
+
+# min usage charged for a job when it is started, in seconds.
+# The charge is corrected by the real duration when the job ends
+MIN_CHARGE = 1
+
+# max number of events taken from the mailbox at once. All the
+# changes of a job made by the events of a batch are written
+# to the journal as one record, when the batch is processed
+MAX_BATCH = 512
+
+METRICS.histogram(
+    'pote_scheduler_event_seconds',
+    'Time the scheduler spent handling an event, by event type')
+METRICS.histogram(
+    'pote_scheduler_batch_events',
+    'Events taken from the scheduler mailbox at once',
+    [2 ** power for power in range(MAX_BATCH.bit_length())])
+METRICS.histogram(
+    'pote_job_dispatch_seconds',
+    'Time from the job arrival to the start of its test')
+METRICS.histogram(
+    'pote_job_spawn_seconds', 'Time to spawn the test process')
+METRICS.histogram(
+    'pote_job_run_seconds', 'Wall time of the test process')
+METRICS.counter(
+    'pote_jobs_archived_total', 'Jobs finished and archived, by status')
+
+
+def parse_envo_groups(spec):
+    """
+    Parse envo groups definition like 'name1=0-9,12;name2=10-19'.
+
+    :param spec: envo groups definition
+    :type spec: string
+
+    :rtype: dict of lists of integers
+
+    :raise ValueError: when the definition is malformed.
+    """
+    groups = {}
+    for group_spec in spec.split(';'):
+        if not group_spec.strip():
+            continue
+        (name, envos_spec) = group_spec.split('=', 1)
+        name = name.strip()
+        if not name or name == GROUP_ANY or name.isdigit():
+            raise ValueError('bad group name: %r' % name)
+        envos = set()
+        for range_spec in envos_spec.split(','):
+            bounds = [int(bound) for bound in range_spec.split('-', 1)]
+            envos.update(range(bounds[0], bounds[-1] + 1))
+        groups[name] = sorted(envos)
+    return groups
+
+
+def parse_user_weights(spec):
+    """
+    Parse fair-share weights of users like 'alice=2,ci=0.5'.
+
+    :param spec: user weights definition
+    :type spec: string
+
+    :rtype: dict of floats
+
+    :raise ValueError: when the definition is malformed.
+    """
+    weights = {}
+    for weight_spec in spec.split(','):
+        if not weight_spec.strip():
+            continue
+        (user, weight) = weight_spec.split('=', 1)
+        user = user.strip()
+        weight = float(weight)
+        if not user or not weight > 0:
+            raise ValueError('bad weight of %r: %r' % (user, weight))
+        weights[user] = weight
+    return weights
 
 
 class PoteScheduler(threading.Thread):
@@ -40,7 +177,11 @@ class PoteScheduler(threading.Thread):
     Test tasks scheduler.
     """
 
-    def __init__(self, envos_count, envos_path, queue_path, tests, archive):
+    def __init__(self, envos_count, envos_path, queue_path, tests, archive,
+                 supervisor, envo_groups=None, group_policy=None,
+                 launcher=None, preload=None, cgroups=None,
+                 dispatch_policy=None, fair_share=None, result_cache=None,
+                 warden_processes=None):
         """
         Constructor.
 
@@ -50,7 +191,7 @@ class PoteScheduler(threading.Thread):
         :param envos_path: base path for work directories of environments
         :type envos_path: string
 
-        :param queue_path: path of a directory for persistent job queues
+        :param queue_path: path of a directory for the job queue journal
         :type queue_path: string
 
         :param tests: interface to the available tests storage.
@@ -58,18 +199,113 @@ class PoteScheduler(threading.Thread):
 
         :param archive: interface to the Archive Storage
         :type archive: pote.PoteArchive
+
+        :param supervisor: interface to the test process supervisor.
+        :type supervisor: pote.supervisor.PoteSupervisor
+
+        :param envo_groups: labeled groups of envos. A job can be
+            enqueued to a group instead of a particular envo. The
+            'any' group with all the envos is always defined.
+        :type envo_groups: NoneType or dict of lists of integers
+
+        :param group_policy: how group jobs are assigned to envos.
+            Default is work-stealing.
+        :type group_policy: NoneType or string, one of KNOWN_POLICIES
+
+        :param launcher: how wardens start tests. Default is exec.
+        :type launcher: NoneType or string,
+            one of pote.warden.KNOWN_LAUNCHERS
+
+        :param preload: names of modules to preload in zygotes.
+        :type preload: NoneType or list of strings
+
+        :param cgroups: cgroup subtree to run tests in.
+        :type cgroups: NoneType or pote.limits.PoteCgroups
+
+        :param dispatch_policy: how the next job of an envo is picked.
+            Default is fifo.
+        :type dispatch_policy: NoneType or string,
+            one of KNOWN_DISPATCH_POLICIES
+
+        :param fair_share: weights of users to share envos by.
+            Jobs of the user with the least usage per weight unit
+            are picked first among the jobs of the same priority.
+            Users not mentioned have weight 1. None disables
+            fair-share.
+        :type fair_share: NoneType or dict of numbers
+
+        :param result_cache: cache of results of successful jobs.
+            A new job which result is found in the cache is archived
+            at once, referring to the job the result is taken from.
+            None disables the cache.
+        :type result_cache: NoneType or pote.cache.PoteResultCache
+
+        :param warden_processes: run wardens in a pool of this many
+            processes instead of threads of the daemon.
+        :type warden_processes: NoneType or integer
         """
         threading.Thread.__init__(self)
         self.logger = logging.getLogger(self.__class__.__name__)
         self.daemon = True
         self.jobs = None
-        self.queues = None
+        # per-envo FIFOs with IDs of jobs waiting for execution
+        self.pending = None
+        # per-envo IDs of jobs given to wardens (or None)
+        self.running = None
+        # per-envo counts of pending jobs enqueued to a group
+        self.stealable = None
+        # per-envo flags showing if jobs can be dispatched to the envo.
+        # Envos of remote agents are alive while agents are connected
+        self.alive = None
+        # envo IDs of remote agents by agent names
+        self.agents = {}
+        self.journal = None
+        # jobs changed by the events of the current batch, by IDs
+        self.changed = collections.OrderedDict()
+        self.events = PoteEventLog()
+        # incremented on every change of the queued jobs
+        self.version = 0
+        # the last JSON encoded list of queued jobs, with its version
+        self.snapshot = (None, None)
+        self.snapshot_lock = threading.Lock()
+        self.lock = threading.Lock()
         self.wardens = None
+        self.cleaner = None
         self.envos_count = envos_count
+        # envos run by the daemon (or its warden processes); the rest
+        # are envos of remote agents
+        self.local_envos = envos_count
         self.envos_path = envos_path
         self.tests = tests
         self.queue_path = queue_path
         self.archive = archive
+        self.supervisor = supervisor
+        self.groups = dict(envo_groups or {})
+        self.groups[GROUP_ANY] = range(envos_count)
+        for name, envos in self.groups.items():
+            # all envos can be provided by remote agents
+            if not (envos or name == GROUP_ANY) or \
+                    not all(0 <= envo < envos_count for envo in envos):
+                raise ValueError('bad envo group %r: %r' % (name, envos))
+        # groups each envo belongs to
+        self.envo_groups = [
+            [name for name, envos in self.groups.items() if envo in envos]
+            for envo in range(envos_count)]
+        self.group_policy = group_policy or POLICY_WORK_STEALING
+        assert self.group_policy in KNOWN_POLICIES
+        self.dispatch_policy = dispatch_policy or DISPATCH_FIFO
+        assert self.dispatch_policy in KNOWN_DISPATCH_POLICIES
+        self.fair_share = fair_share
+        # decayed run time of jobs of users, in seconds:
+        # user -> (usage, timestamp of the last update)
+        self.usage = {}
+        # usage charged for running jobs when they were started
+        self.charges = {}
+        self.launcher = launcher
+        self.preload = preload
+        self.cgroups = cgroups
+        self.result_cache = result_cache
+        self.warden_processes = warden_processes
         self.mailbox = Queue.Queue()
 
     def queued(self):
@@ -78,10 +314,102 @@ class PoteScheduler(threading.Thread):
 
         :rtype: list of dicts
         """
-        jobs = [job for queue in self.queues for job in queue.dump()]
+        if self.jobs is None:
+            # not recovered yet
+            return []
+        with self.lock:
+            jobs = [dict(job) for job in self.jobs.values()]
         jobs.sort(key=lambda x: x['time'])
         return jobs
 
+    def queued_snapshot(self):
+        """
+        Return the version and the JSON encoded list of all jobs
+        queued. The list is encoded once per version and shared by
+        all callers, so polling an unchanged queue costs nothing.
+
+        :rtype: tuple of (integer, string)
+        """
+        snapshot = self.snapshot
+        if snapshot[0] == self.version:
+            return snapshot
+        # one caller rebuilds the snapshot, others wait for it
+        with self.snapshot_lock:
+            snapshot = self.snapshot
+            if snapshot[0] == self.version:
+                return snapshot
+            with self.lock:
+                version = self.version
+                jobs = [dict(job) for job in (self.jobs or {}).values()]
+            jobs.sort(key=lambda x: x['time'])
+            self.snapshot = (version, json.dumps(jobs))
+            return self.snapshot
+
+    def user_usage(self):
+        """
+        Return the recent usage of envos by users, in seconds.
+        The usage decays with USAGE_HALF_LIFE.
+
+        :rtype: dict of floats
+        """
+        now = time.time()
+        with self.lock:
+            return {user: self._usage(user, now) for user in self.usage}
+
+    def gauges(self):
+        """
+        Return the actual state of the mailbox and the envos
+        as gauges for pote.metrics.PoteMetrics.render().
+
+        :rtype: list of tuples
+        """
+        if self.jobs is None:
+            # not recovered yet
+            return []
+        with self.lock:
+            pending = [len(queue) for queue in self.pending]
+            busy = [int(job_id is not None) for job_id in self.running]
+            alive = [int(flag) for flag in self.alive]
+        envos = [{'envo': str(envo)} for envo in range(len(pending))]
+        running = sum(flag for flag, envo_busy in zip(alive, busy)
+                      if envo_busy)
+        return [
+            ('pote_scheduler_mailbox_events',
+             'Events waiting in the scheduler mailbox',
+             [({}, self.mailbox.qsize())]),
+            ('pote_envo_pending_jobs', 'Jobs waiting for the envo',
+             zip(envos, pending)),
+            ('pote_envo_busy', '1 if the envo is running a job',
+             zip(envos, busy)),
+            ('pote_envo_alive', '1 if jobs can be dispatched to the envo',
+             zip(envos, alive)),
+            ('pote_envo_utilization',
+             'Fraction of the alive envos running jobs',
+             [({}, running / float(max(sum(alive), 1)))])]
+
+    def live_log(self, job_id):
+        """
+        Return path to the output file of the running job.
+        Return None when the job is not started yet or was
+        already moved to the Archive. Live output is available
+        only for jobs run by the daemon: a remote agent sends
+        the output when the job is done, so None is returned
+        for jobs running on envos of remote agents.
+
+        :param job_id: job identifier.
+        :type job_id: string
+
+        :rtype: NoneType or string
+        """
+        if self.jobs is None:
+            return None
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or 'started' not in job or \
+                    job['envo'] >= self.local_envos:
+                return None
+            return self.wardens[job['envo']].output_path
+
     def notify_job_add(self, job):
         """
         Tell the Scheduler to enqueue a new job.
@@ -91,6 +419,15 @@ class PoteScheduler(threading.Thread):
         """
         self._notify(EVENT_ADD, job)
 
+    def notify_jobs_add(self, jobs):
+        """
+        Tell the Scheduler to enqueue new jobs at once.
+
+        :param jobs: new jobs data.
+        :type jobs: list of dicts
+        """
+        self._notify(EVENT_ADD_BATCH, jobs)
+
     def notify_job_started(self, job_id):
         """
         Tell the Scheduler the job just started for execution.
@@ -100,14 +437,20 @@ class PoteScheduler(threading.Thread):
         """
         self._notify(EVENT_STARTED, job_id)
 
-    def notify_job_stopped(self, job_id):
+    def notify_job_stopped(self, job_id, timing=None, usage=None):
         """
         Tell the Scheduler the job is finished.
 
         :param job_id: job identifier.
         :type job_id: string
+
+        :param timing: durations (in seconds) of job execution stages
+        :type timing: NoneType or dict
+
+        :param usage: resources used by the test process
+        :type usage: NoneType or dict
         """
-        self._notify(EVENT_STOPPED, job_id)
+        self._notify(EVENT_STOPPED, (job_id, timing, usage))
 
     def notify_job_done(self, job_id):
         """
@@ -142,6 +485,31 @@ class PoteScheduler(threading.Thread):
         """
         self._notify(EVENT_RESULT, (job_id, data))
 
+    def notify_agent_joined(self, name, envos_count, link):
+        """
+        Tell the Scheduler a remote agent is connected. The Scheduler
+        tells the agent the IDs of its envos with link.registered().
+
+        :param name: agent name
+        :type name: string
+
+        :param envos_count: how many envos the agent has
+        :type envos_count: integer
+
+        :param link: connection of the agent
+        :type link: pote.agent.PoteAgentLink
+        """
+        self._notify(EVENT_AGENT_JOINED, (name, envos_count, link))
+
+    def notify_agent_lost(self, link):
+        """
+        Tell the Scheduler the connection of a remote agent is lost.
+
+        :param link: connection of the agent
+        :type link: pote.agent.PoteAgentLink
+        """
+        self._notify(EVENT_AGENT_LOST, link)
+
     # ----------------------------------------------------------------------
     # end of public API
 
@@ -149,36 +517,136 @@ class PoteScheduler(threading.Thread):
         """
         Thread main activity.
         """
-        # Initialize persistent job queues
-        self.queues = \
-            [PoteJobQueue(os.path.join(self.queue_path, str(envo_id)))
-             for envo_id in range(self.envos_count)]
         # Start wardens
-        self.wardens = \
-            [self._start_warden(envo_id)
-             for envo_id in range(self.envos_count)]
-        # Read persistent queue for old jobs
-        self.jobs = {job['id']: job for job in self.queued()}
-        for job_id in self.jobs:
-            if self.jobs[job_id]['status'] != STATUS_ENQUEUED:
-                # reset job state
-                self.jobs[job_id]['status'] = STATUS_ENQUEUED
-                self._update_job(self.jobs[job_id])
-            self._send_to_warden(self.jobs[job_id])
+        self.cleaner = PoteCleaner.running(
+            os.path.join(self.envos_path, TRASH_DIR))
+        local_envos = self.local_envos
+        if self.warden_processes:
+            # the envos are alive when their warden processes connect
+            self.wardens = [
+                PoteRemoteWarden(None, os.path.join(
+                    self.envos_path, str(envo_id), 'stdout.txt'))
+                for envo_id in range(local_envos)]
+        else:
+            self.wardens = \
+                [self._start_warden(envo_id)
+                 for envo_id in range(local_envos)]
+        # Replay the journal for old jobs
+        self.journal = PoteJournal(self.queue_path)
+        if self.journal.exists():
+            jobs = self.journal.load()
+        else:
+            jobs = self._import_legacy_queues()
+        for job in jobs.values():
+            # reset job state
+            job['status'] = STATUS_ENQUEUED
+        self.journal.compact(jobs.values(), force=True)
+        self._remove_legacy_queues()
+        self._load_durations()
+        if self.result_cache is not None:
+            self.result_cache.load()
+        self.pending = [PotePendingQueue() for _ in range(self.envos_count)]
+        self.running = [None] * self.envos_count
+        self.stealable = [0] * self.envos_count
+        self.alive = [not self.warden_processes] * self.envos_count
+        # envos of remote agents are not alive until the agents connect
+        self.agents = self._load_agents()
+        envos = sum(self.agents.values(), [self.envos_count - 1])
+        envos.extend(job['envo'] for job in jobs.values())
+        self._add_envos(max(envos) + 1 - self.envos_count)
+        for job in sorted(jobs.values(), key=lambda x: x['time']):
+            self._enqueue(job, job['envo'])
+        self.jobs = jobs
+        self.version += 1
+        for envo in range(self.envos_count):
+            self._dispatch(envo)
+        self._flush()
+        self.journal.sync()
+        if self.warden_processes:
+            PoteWardenPool.running(
+                self, self.supervisor, self.warden_processes, local_envos,
+                self.envos_path, self.tests.path, self.launcher,
+                self.preload,
+                None if self.cgroups is None else self.cgroups.path)
         # Main loop
         while True:
-            event = self.mailbox.get()
-            self.logger.debug('got new event: %r', event)
+            events = self._receive()
+            METRICS.observe('pote_scheduler_batch_events', len(events))
+            with self.lock:
+                for event in events:
+                    self.logger.debug('got new event: %r', event)
+                    try:
+                        assert isinstance(event, dict)
+                        assert event['type'] in KNOWN_EVENTS
+                        started = time.time()
+                        self._handle_event(
+                            event['type'], event['time'], event['data'])
+                        METRICS.observe(
+                            'pote_scheduler_event_seconds',
+                            time.time() - started, type=event['type'])
+                        self.logger.debug('event %r processed', event)
+                    except Exception:
+                        self.logger.error(
+                            'event processing crashed. Event was: %r',
+                            event, exc_info=True)
+                self._flush()
+            for _ in events:
+                self.mailbox.task_done()
+            # write all the state changes of the batch at once
+            self.journal.compact(self.jobs.values())
+            self.journal.sync()
+
+    def _receive(self):
+        """
+        Wait for events and return all the events available
+        in the mailbox, but no more than MAX_BATCH.
+
+        :rtype: list of dicts
+        """
+        events = [self.mailbox.get()]
+        while len(events) < MAX_BATCH:
             try:
-                assert isinstance(event, dict)
-                assert event['type'] in KNOWN_EVENTS
-                self._handle_event(event['type'], event['time'], event['data'])
-                self.logger.debug('event %r processed', event)
-            except Exception:
-                self.logger.error(
-                    'event processing crashed. Event was: %r', event,
-                    exc_info=True)
-            self.mailbox.task_done()
+                events.append(self.mailbox.get_nowait())
+            except Queue.Empty:
+                break
+        return events
+
+    def _load_durations(self):
+        """
+        Feed the durations of the last archived successful jobs
+        to the statistics of the tests.
+        """
+        for name in self.tests.available():
+            durations = self.archive.durations(
+                name, STATS_WINDOW, STATUS_DONE)
+            if durations:
+                self.tests.record_duration(name, *reversed(durations))
+
+    def _import_legacy_queues(self):
+        """
+        Read jobs from per-envo queue directories written by older
+        versions, which kept each job in a separate file.
+
+        :rtype: dict
+        """
+        jobs = {}
+        for envo_id in range(self.envos_count):
+            path = os.path.join(self.queue_path, str(envo_id))
+            for job in PoteJobQueue(path).dump():
+                jobs[job['id']] = job
+        if jobs:
+            self.logger.info('%r jobs imported from legacy queues', len(jobs))
+        return jobs
+
+    def _remove_legacy_queues(self):
+        """
+        Remove per-envo queue directories written by older versions.
+        Must be called only when all the jobs are in the journal.
+        """
+        for envo_id in range(self.envos_count):
+            path = os.path.join(self.queue_path, str(envo_id))
+            if os.path.isdir(path):
+                shutil.rmtree(path)
 
     def _start_warden(self, envo_id):
         """
@@ -190,9 +658,9 @@ class PoteScheduler(threading.Thread):
         :rtype: pote.PoteWarden
         """
         return PoteWarden.running(
-            self, self.tests,
+            self, self.supervisor, self.cleaner, self.tests,
             os.path.join(self.envos_path, str(envo_id)),
-            envo_id)
+            envo_id, self.launcher, self.preload, self.cgroups)
 
     def _notify(self, event_type, data=None):
         """
@@ -224,24 +692,31 @@ class PoteScheduler(threading.Thread):
         :type data: any
         """
         if event_type == EVENT_ADD:
-            job = data
-            job['time'] = event_time
-            job['status'] = STATUS_ENQUEUED
-            self._update_job(job)
-            self.jobs[job['id']] = data
-            self.logger.info('job enqueued: %r', job)
-            self._send_to_warden(job)
+            self._add_job(data, event_time)
+        elif event_type == EVENT_ADD_BATCH:
+            # jobs are ordered by their arrival time, so a microsecond
+            # is added for each job to keep the order of the batch
+            for index, job in enumerate(data):
+                self._add_job(job, event_time + index * 1e-6)
         elif event_type == EVENT_STARTED:
             job_id = data
             job = self.jobs[job_id]
             job['started'] = event_time
             job['status'] = STATUS_RUNNING
             self._update_job(job)
+            METRICS.observe(
+                'pote_job_dispatch_seconds', event_time - job['time'])
             self.logger.info('job started: %r', job_id)
         elif event_type == EVENT_STOPPED:
-            job_id = data
+            (job_id, timing, usage) = data
             job = self.jobs[job_id]
-            job['stopped'] = time.time()
+            job['stopped'] = event_time
+            if timing is not None:
+                job['timing'] = timing
+                METRICS.observe('pote_job_spawn_seconds', timing['spawn'])
+                METRICS.observe('pote_job_run_seconds', timing['run'])
+            if usage:
+                job['usage'] = usage
             self._update_job(job)
             self.logger.debug('job stopped: %r', job_id)
         elif event_type == EVENT_SUCCESS:
@@ -255,29 +730,393 @@ class PoteScheduler(threading.Thread):
             job = self.jobs[job_id]
             job['status'] = STATUS_FAILED
             job['reason'] = reason
+            self._update_job(job)
             self.logger.info('job %r failed: %r', job_id, reason)
         elif event_type == EVENT_RESULT:
             (job_id, output_path) = data
             job = self.jobs[job_id]
             self._archive_job(job, output_path)
-            # search pending job for this envo
-            envo = job['envo']
-            pending_job = None
-            for job in self.queues[envo].dump():
-                if job['status'] == STATUS_ENQUEUED:
-                    pending_job = job
-                    break
-            if pending_job is not None:
-                self._send_to_warden(pending_job)
+            # the envo is free now
+            self.running[job['envo']] = None
+            self._dispatch(job['envo'])
+        elif event_type == EVENT_AGENT_JOINED:
+            (name, envos_count, link) = data
+            self._agent_joined(name, envos_count, link)
+        elif event_type == EVENT_AGENT_LOST:
+            self._agent_lost(data)
+
+    def _load_agents(self):
+        """
+        Return envo IDs of remote agents known from the last runs.
+
+        :rtype: dict of lists of integers
+        """
+        path = os.path.join(self.queue_path, AGENTS_NAME)
+        if not os.path.isfile(path):
+            return {}
+        with open(path) as fdescr:
+            return json.load(fdescr)
+
+    def _save_agents(self):
+        """
+        Save envo IDs of remote agents.
+        """
+        path = os.path.join(self.queue_path, AGENTS_NAME)
+        with open(path + '.tmp', 'w') as fdescr:
+            json.dump(self.agents, fdescr)
+            fdescr.flush()
+            os.fsync(fdescr.fileno())
+        os.rename(path + '.tmp', path)
+
+    def _add_envos(self, count):
+        """
+        Add envos for remote agents. The envos are not alive.
+
+        :param count: how many envos to add
+        :type count: integer
+        """
+        for envo in range(self.envos_count, self.envos_count + count):
+            self.pending.append(PotePendingQueue())
+            self.running.append(None)
+            self.stealable.append(0)
+            self.alive.append(False)
+            self.wardens.append(PoteRemoteWarden(
+                None, os.path.join(self.envos_path, str(envo), 'stdout.txt')))
+            self.envo_groups.append([GROUP_ANY])
+        if count > 0:
+            self.envos_count += count
+            # the groups are read by other threads without the lock
+            groups = dict(self.groups)
+            groups[GROUP_ANY] = range(self.envos_count)
+            self.groups = groups
+
+    def _agent_joined(self, name, envos_count, link):
+        """
+        Give envos to the connected agent and start dispatching
+        jobs to them. Warden processes of the daemon get the envos
+        bound to their links.
+
+        :param name: agent name
+        :type name: string
+
+        :param envos_count: how many envos the agent has
+        :type envos_count: integer
+
+        :param link: connection of the agent
+        :type link: pote.agent.PoteAgentLink
+        """
+        envos = link.fixed_envos
+        if envos is None:
+            known = self.agents.get(name, [])
+            added = max(envos_count - len(known), 0)
+            self.agents[name] = known + range(
+                self.envos_count, self.envos_count + added)
+            self._add_envos(added)
+            self._save_agents()
+            envos = self.agents[name][:envos_count]
+        for envo in envos:
+            # a job given to the previous connection of the agent
+            # is lost along with it
+            self._reclaim(envo)
+            self.wardens[envo] = PoteRemoteWarden(
+                link, self.wardens[envo].output_path)
+            self.alive[envo] = True
+        link.registered(envos)
+        self.logger.info('agent %r joined with envos %r', name, envos)
+        for envo in envos:
+            self._dispatch(envo)
+
+    def _agent_lost(self, link):
+        """
+        Stop dispatching jobs to envos of the lost agent, re-queue
+        the jobs they were running and move the group jobs pending
+        on them to other envos.
+
+        :param link: connection of the agent
+        :type link: pote.agent.PoteAgentLink
+        """
+        for envo in link.envos:
+            if self.wardens[envo].link is not link:
+                # the agent has reconnected already
+                continue
+            self.alive[envo] = False
+            self.wardens[envo] = PoteRemoteWarden(
+                None, self.wardens[envo].output_path)
+            self._reclaim(envo)
+            for job_id in list(self.pending[envo]):
+                job = self.jobs[job_id]
+                if job.get('group') is None:
+                    continue
+                target = self._least_loaded(job['group'])
+                if not self.alive[target]:
+                    continue
+                self.pending[envo].remove(job_id)
+                self.stealable[envo] -= 1
+                job['envo'] = target
+                self._update_job(job)
+                self._enqueue(job, target)
+                self._dispatch(target)
+        self.logger.warning('agent %r lost with envos %r',
+                            link.name, link.envos)
+
+    def _reclaim(self, envo):
+        """
+        Put the job given to the envo back to the head of its
+        pending queue.
+
+        :param envo: environment unique identifier
+        :type envo: integer
+        """
+        job_id = self.running[envo]
+        if job_id is None:
+            return
+        self.running[envo] = None
+        job = self.jobs[job_id]
+        job['status'] = STATUS_ENQUEUED
+        for name in ('started', 'stopped', 'timing', 'usage'):
+            job.pop(name, None)
+        self._update_job(job)
+        self._enqueue(job, envo, left=True)
+        self._charge(job['user'], -self.charges.pop(job_id, 0))
+        self.logger.info('job %r re-queued', job_id)
+
+    def _add_job(self, job, event_time):
+        """
+        Enqueue a new job.
+
+        :param job: new job data
+        :type job: dict
+
+        :param event_time: job arrival timestamp (seconds till Unix Epoch)
+        :type event_time: number
+        """
+        job['time'] = event_time
+        if self._reuse_result(job):
+            return
+        job['status'] = STATUS_ENQUEUED
+        if job.get('group') is not None:
+            job['envo'] = self._least_loaded(job['group'])
+        self._update_job(job)
+        self.jobs[job['id']] = job
+        self._enqueue(job, job['envo'])
+        self.logger.info('job enqueued: %r', job)
+        self._dispatch(job['envo'])
+
+    def _reuse_result(self, job):
+        """
+        Archive the new job with the result of an equal job found
+        in the result cache. Return True if the result was reused.
+
+        :param job: new job data
+        :type job: dict
+
+        :rtype: boolean
+        """
+        if self.result_cache is None or job.get('cache') is False:
+            return False
+        cache_key = self._cache_key(job)
+        if cache_key is None:
+            return False
+        if job.get('group') is not None:
+            envos = self.groups[job['group']]
+        else:
+            envos = [job['envo']]
+        origin = self.result_cache.lookup(
+            cache_key, envos, job['max_duration'])
+        if origin is None:
+            return False
+        job.update({'envo': origin['envo'],
+                    'status': STATUS_DONE,
+                    'started': job['time'],
+                    'stopped': job['time'],
+                    'cached': origin['id']})
+        for name in ('log', 'log_size'):
+            if name in origin:
+                job[name] = origin[name]
+        self.archive.archive(job)
+        self.version += 1
+        self.events.publish(DELTA_ARCHIVE, job)
+        self.logger.info('job %r reused the result of job %r',
+                         job['id'], origin['id'])
+        return True
+
+    def _cache_key(self, job):
+        """
+        Return the result cache key of the job or None if its
+        result must not be cached.
+
+        :param job: job details
+        :type job: dict
+
+        :rtype: NoneType or string
+        """
+        meta = self.tests.get(job['test'])
+        if meta is None:
+            return None
+        return self.result_cache.key(
+            job['test'], meta,
+            self.tests.limits(job['test'], job.get('limits')))
 
     def _update_job(self, job):
         """
-        Save updated job to the persistent queue.
+        Tell the clients about the updated job. The job is saved
+        to the journal by _flush().
 
         :param job: job details
         :type job: dict
         """
-        self.queues[job['envo']].save(job)
+        self.changed[job['id']] = job
+        self.version += 1
+        self.events.publish(DELTA_JOB, job)
+
+    def _flush(self):
+        """
+        Save the jobs changed by the current batch of events
+        to the journal. Each job is saved once, in its latest state.
+        """
+        for job in self.changed.values():
+            self.journal.save(job)
+        self.changed.clear()
+
+    def _enqueue(self, job, envo, left=False):
+        """
+        Append the job to the pending queue of the envo.
+
+        :param job: job details
+        :type job: dict
+
+        :param envo: environment unique identifier
+        :type envo: integer
+
+        :param left: put the job to the head of the queue,
+            to be the first with the fifo policy
+        :type left: boolean
+        """
+        user = None
+        if self.fair_share is not None:
+            user = job['user']
+        self.pending[envo].append(
+            job['id'], user, self._order_key(job), left)
+        if job.get('group') is not None:
+            self.stealable[envo] += 1
+
+    def _order_key(self, job):
+        """
+        Return the key the pending job is picked by among the jobs
+        of the same user: the negated priority, then the order of
+        the dispatch policy.
+
+        :param job: job details
+        :type job: dict
+
+        :rtype: tuple
+        """
+        prefix = (-job.get('priority', 0),)
+        if self.dispatch_policy == DISPATCH_FIFO:
+            return prefix + (job['time'],)
+        meta = self.tests.get(job['test']) or {}
+        expected = meta.get('duration') or 0
+        if self.dispatch_policy == DISPATCH_DEADLINE and \
+                job.get('deadline') is not None:
+            return prefix + (0, job['deadline'] - expected)
+        return prefix + (1, expected, job['time'])
+
+    def _least_loaded(self, group):
+        """
+        Return the envo of the group with the least jobs
+        pending or running.
+
+        :param group: envo group name
+        :type group: string
+
+        :rtype: integer
+        """
+        return min(self.groups[group],
+                   key=lambda envo: (not self.alive[envo],
+                                     len(self.pending[envo]) +
+                                     (self.running[envo] is not None)))
+
+    def _steal(self, envo):
+        """
+        Move the newest group job from the most loaded envo sharing
+        a group with the envo to the envo pending queue.
+        Return True if a job was stolen.
+
+        :param envo: environment unique identifier
+        :type envo: integer
+
+        :rtype: boolean
+        """
+        victims = [victim for victim in range(self.envos_count)
+                   if self.stealable[victim] and victim != envo]
+        victims.sort(key=lambda victim: len(self.pending[victim]),
+                     reverse=True)
+        for victim in victims:
+            for job_id in reversed(self.pending[victim]):
+                job = self.jobs[job_id]
+                if job.get('group') in self.envo_groups[envo]:
+                    self.pending[victim].remove(job_id)
+                    self.stealable[victim] -= 1
+                    job['envo'] = envo
+                    self._update_job(job)
+                    self._enqueue(job, envo)
+                    self.logger.debug(
+                        'job %r stolen from envo #%r by envo #%r',
+                        job_id, victim, envo)
+                    return True
+        return False
+
+    def _dispatch(self, envo):
+        """
+        Send the next pending job to the warden of the envo,
+        if the envo is free.
+
+        :param envo: environment unique identifier
+        :type envo: integer
+        """
+        if self.running[envo] is not None or not self.alive[envo]:
+            return
+        if not self.pending[envo] and not (
+                self.group_policy == POLICY_WORK_STEALING and
+                self._steal(envo)):
+            return
+        job = self.jobs[self._pick(envo)]
+        self.pending[envo].remove(job['id'])
+        if job.get('group') is not None:
+            self.stealable[envo] -= 1
+        if not self._send_to_warden(job):
+            self._enqueue(job, envo, left=True)
+
+    def _pick(self, envo):
+        """
+        Return ID of the pending job of the envo to run next,
+        according to priorities, fair-share and the dispatch policy.
+
+        The job waiting the longest is taken at once if it starves
+        or if there is nothing to order the jobs by but the arrival.
+
+        :param envo: environment unique identifier
+        :type envo: integer
+
+        :rtype: string
+        """
+        pending = self.pending[envo]
+        first = pending.first()
+        now = time.time()
+        if self.jobs[first]['time'] < now - STARVATION_TIME or (
+                self.dispatch_policy == DISPATCH_FIFO and
+                self.fair_share is None and not pending.prioritized):
+            return first
+        best = None
+        for user, key, job_id in pending.heads(
+                lambda job_id: self._order_key(self.jobs[job_id])):
+            share = 0
+            if user is not None:
+                share = self._usage(user, now) / self.fair_share.get(user, 1)
+            candidate = (key[0], share) + key[1:]
+            if best is None or candidate < best[0]:
+                best = (candidate, job_id)
+        return best[1]
 
     def _send_to_warden(self, job):
         """
@@ -292,10 +1131,20 @@ class PoteScheduler(threading.Thread):
         is_sent = self.wardens[envo].execute(job)
         if is_sent:
             self.logger.info('job sent for execution: %r', job['id'])
+            self.running[envo] = job['id']
             job['status'] = STATUS_STARTING
+            if self.result_cache is not None:
+                # the sources the job runs are hashed right now
+                job['cache_key'] = self._cache_key(job)
             self._update_job(job)
+            # charge the user in advance, so the next picks see
+            # the job even before it ends
+            meta = self.tests.get(job['test']) or {}
+            charge = max(meta.get('duration') or 0, MIN_CHARGE)
+            self.charges[job['id']] = charge
+            self._charge(job['user'], charge)
         else:
-            self.logger.debug(
+            self.logger.error(
                 'execution queue for envo #%r is full.'
                 ' Job %r still pending', envo, job['id'])
         return is_sent
@@ -311,7 +1160,53 @@ class PoteScheduler(threading.Thread):
         :type output_path: string or NoneType
         """
         job_id = job['id']
+        if job['status'] == STATUS_DONE and job.get('timing'):
+            self.tests.record_duration(job['test'], job['timing']['run'])
+        if job.get('timing'):
+            used = job['timing']['run']
+        else:
+            used = job.get('stopped', 0) - job.get('started', 0)
+        self._charge(job['user'], max(used, 0) -
+                     self.charges.pop(job_id, 0))
         self.archive.archive(job, output_path)
-        self.queues[job['envo']].remove(job_id)
+        if self.result_cache is not None and \
+                job['status'] == STATUS_DONE and job.get('cache_key'):
+            self.result_cache.store(job)
+        # the last state of the job goes to the archive instead
+        self.changed.pop(job_id, None)
+        self.journal.remove(job_id)
         del self.jobs[job_id]
+        self.version += 1
+        self.events.publish(DELTA_ARCHIVE, job)
+        METRICS.inc('pote_jobs_archived_total', status=job['status'])
         self.logger.info('job archived: %r', job)
+
+    def _usage(self, user, now):
+        """
+        Return the usage of the user decayed to the moment.
+
+        :param user: user name
+        :type user: string
+
+        :param now: timestamp (seconds till Unix Epoch)
+        :type now: number
+
+        :rtype: float
+        """
+        (usage, stamp) = self.usage.get(user, (0, now))
+        return usage * 0.5 ** ((now - stamp) / float(USAGE_HALF_LIFE))
+
+    def _charge(self, user, seconds):
+        """
+        Add the run time to the usage of the user.
+
+        :param user: user name
+        :type user: string
+
+        :param seconds: run time to add. Negative to correct
+            a previous charge.
+        :type seconds: number
+        """
+        now = time.time()
+        self.usage[user] = \
+            (max(self._usage(user, now) + seconds, 0), now)
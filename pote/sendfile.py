@@ -0,0 +1,88 @@
+"""
+Minimal binding to the Linux sendfile(2) system call,
+which os.sendfile() does not provide on Python 2.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import socket
+
+
+def _bind():
+    """
+    Return the sendfile(2) libc function or None when
+    it is not available.
+
+    :rtype: NoneType or ctypes function
+    """
+    try:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        # the 64-bit offset variant works for big files everywhere
+        function = libc.sendfile64
+    except (OSError, AttributeError):
+        return None
+    function.argtypes = [ctypes.c_int, ctypes.c_int,
+                         ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    function.restype = ctypes.c_ssize_t
+    return function
+
+
+_SENDFILE = _bind()
+
+
+def sendfile(sock, fdescr, offset, count):
+    """
+    Send a part of the file to the socket without copying it
+    to the user space. Return the number of bytes sent, which is
+    less than requested only when the file is shorter. A socket
+    with a timeout is waited for when its send buffer is full.
+
+    :param sock: socket to send to
+    :type sock: socket.socket
+
+    :param fdescr: plain file to send from
+    :type fdescr: file
+
+    :param offset: offset of the first byte to send
+    :type offset: integer
+
+    :param count: how many bytes to send
+    :type count: integer
+
+    :rtype: integer
+
+    :raise OSError: when sendfile(2) is not supported for the
+        file (errno.ENOSYS or errno.EINVAL) and nothing is sent yet.
+
+    :raise socket.error: when sending fails.
+    """
+    if _SENDFILE is None:
+        raise OSError(errno.ENOSYS, 'sendfile is not supported')
+    position = ctypes.c_int64(offset)
+    total = 0
+    while total < count:
+        sent = _SENDFILE(sock.fileno(), fdescr.fileno(),
+                         ctypes.byref(position), count - total)
+        if sent == 0:
+            break
+        if sent > 0:
+            total += sent
+            continue
+        code = ctypes.get_errno()
+        if code == errno.EINTR:
+            continue
+        if code == errno.EAGAIN:
+            # a socket with a timeout is non-blocking at the OS level
+            (_r, writable, _x) = select.select(
+                [], [sock], [], sock.gettimeout())
+            if not writable:
+                raise socket.timeout('timed out')
+            continue
+        if total == 0 and code in (errno.ENOSYS, errno.EINVAL):
+            raise OSError(code, os.strerror(code))
+        raise socket.error(code, os.strerror(code))
+    return total
@@ -0,0 +1,9 @@
+"""
+Job statuses.
+"""
+
+STATUS_ENQUEUED = 'enqueued'
+STATUS_STARTING = 'starting'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
@@ -0,0 +1,275 @@
+"""
+Supervisor of all running test processes: reaps them as soon
+as they exit and kills them when their deadlines pass.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import select
+import subprocess
+import threading
+import time
+
+from .limits import RUSAGE_FIELDS
+
+
+# how long to keep exit statuses of processes nobody watches
+ORPHAN_TTL = 60
+
+
+class PoteSupervisor(object):
+    """
+    Test process supervisor.
+
+    Consists of two threads which sleep until something happens:
+    the reaper is blocked in wait4() until any child process exits,
+    the timer is blocked in select() on a self-pipe until the
+    nearest deadline passes or the deadline set changes. So idle
+    wardens cost no wakeups at all.
+
+    Note the supervisor reaps all child processes of the daemon,
+    so there must be only one supervisor per process and every
+    child must be spawned with popen() and waited with watch().
+    Processes spawned otherwise can be watched too, when their
+    exits are reported with exited(). Such a process object must
+    provide 'pid', kill() and _handle_exitstatus() like
+    subprocess.Popen does.
+
+    Resource usage of a watched process is saved to its 'rusage'
+    attribute, as a dict of struct rusage fields.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.lock = threading.Lock()
+        self.watched = {}
+        # exit statuses of processes reaped before they were watched
+        self.orphans = {}
+        self.spawn_lock = threading.Lock()
+        self.spawns = 0
+        self.has_children = threading.Event()
+        (self.wakeup_rfd, self.wakeup_wfd) = os.pipe()
+        for fdescr in (self.wakeup_rfd, self.wakeup_wfd):
+            flags = fcntl.fcntl(fdescr, fcntl.F_GETFL)
+            fcntl.fcntl(fdescr, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.threads = [threading.Thread(target=self._reaper),
+                        threading.Thread(target=self._timer)]
+        for thread in self.threads:
+            thread.daemon = True
+
+    def start(self):
+        """
+        Start supervisor threads.
+        """
+        for thread in self.threads:
+            thread.start()
+
+    def isAlive(self):
+        """
+        Return True if supervisor threads are running.
+
+        :rtype: boolean
+        """
+        return all(thread.isAlive() for thread in self.threads)
+
+    def popen(self, *args, **kwargs):
+        """
+        Spawn a new child process. Accepts the same arguments
+        as the subprocess.Popen constructor.
+
+        :rtype: subprocess.Popen
+        """
+        with self.spawn_lock:
+            self.has_children.set()
+            proc = subprocess.Popen(*args, **kwargs)
+            # must be changed only when the child already exists
+            self.spawns += 1
+            return proc
+
+    def watch(self, proc, deadline):
+        """
+        Block until the process exits or the deadline passes.
+        The process is killed on deadline. Return the time when the
+        process termination was detected and a flag showing if the
+        process was killed.
+
+        :param proc: process to watch
+        :type proc: subprocess.Popen
+
+        :param deadline: time (seconds since Unix Epoch) when the
+            process must be killed.
+        :type deadline: number
+
+        :rtype: tuple of (number, boolean)
+        """
+        assert self.isAlive()
+        watcher = {'proc': proc,
+                   'deadline': deadline,
+                   'event': threading.Event(),
+                   'stopped': None,
+                   'killed': False}
+        with self.lock:
+            orphan = self.orphans.pop(proc.pid, None)
+            if orphan is None:
+                self.watched[proc.pid] = watcher
+        if orphan is not None:
+            # the process exited before it was registered
+            self._finish(watcher, *orphan)
+        else:
+            self._wakeup()
+        watcher['event'].wait()
+        return watcher['stopped'], watcher['killed']
+
+    def _reaper(self):
+        """
+        Reaper thread main activity.
+        """
+        while True:
+            self.has_children.wait()
+            spawns = self.spawns
+            try:
+                (pid, status, rusage) = os.wait4(-1, 0)
+            except OSError as exc:
+                if exc.errno == errno.ECHILD:
+                    with self.spawn_lock:
+                        if spawns == self.spawns:
+                            # nothing was spawned since wait4() call
+                            self.has_children.clear()
+                    continue
+                if exc.errno != errno.EINTR:
+                    self.logger.error('wait4 failed', exc_info=True)
+                continue
+            self.exited(pid, status, {name: getattr(rusage, name)
+                                      for name in RUSAGE_FIELDS})
+
+    def exited(self, pid, status, rusage=None):
+        """
+        Handle exit of a watched process. Called by the reaper and by
+        launchers reaping processes which are not daemon children
+        (like children of a zygote, see pote.zygote).
+
+        :param pid: process ID
+        :type pid: integer
+
+        :param status: exit status as returned by wait4()
+        :type status: integer
+
+        :param rusage: struct rusage fields, by name
+        :type rusage: NoneType or dict
+        """
+        stopped = time.time()
+        with self.lock:
+            watcher = self.watched.pop(pid, None)
+            if watcher is None:
+                self._add_orphan(pid, status, rusage, stopped)
+        if watcher is not None:
+            self._finish(watcher, status, rusage, stopped)
+            # the deadline is not actual anymore
+            self._wakeup()
+
+    def _timer(self):
+        """
+        Timer thread main activity.
+        """
+        while True:
+            try:
+                select.select([self.wakeup_rfd], [], [], self._timeout())
+            except select.error as exc:
+                if exc.args[0] != errno.EINTR:
+                    raise
+            self._drain()
+            now = time.time()
+            with self.lock:
+                expired = [watcher for watcher in self.watched.values()
+                           if watcher['deadline'] <= now and
+                           not watcher['killed']]
+                for watcher in expired:
+                    # still not reaped, so the pid was not reused
+                    watcher['killed'] = True
+                    watcher['proc'].kill()
+
+    def _add_orphan(self, pid, status, rusage, stopped):
+        """
+        Remember exit status of a process nobody watches yet.
+        Must be called with the lock held.
+
+        :param pid: process ID
+        :type pid: integer
+
+        :param status: exit status as returned by wait4()
+        :type status: integer
+
+        :param rusage: struct rusage fields, by name
+        :type rusage: NoneType or dict
+
+        :param stopped: time when the process exit was detected
+        :type stopped: number
+        """
+        # processes failed to exec are reaped but never watched
+        for orphan_pid, orphan in self.orphans.items():
+            if orphan[-1] < stopped - ORPHAN_TTL:
+                del self.orphans[orphan_pid]
+        self.orphans[pid] = (status, rusage, stopped)
+
+    def _finish(self, watcher, status, rusage, stopped):
+        """
+        Save results of a reaped process and wake up its warden.
+
+        :param watcher: process watch details
+        :type watcher: dict
+
+        :param status: exit status as returned by wait4()
+        :type status: integer
+
+        :param rusage: struct rusage fields, by name
+        :type rusage: NoneType or dict
+
+        :param stopped: time when the process exit was detected
+        :type stopped: number
+        """
+        # pylint: disable=protected-access
+        watcher['proc']._handle_exitstatus(status)
+        watcher['proc'].rusage = rusage
+        watcher['stopped'] = stopped
+        watcher['event'].set()
+
+    def _timeout(self):
+        """
+        Return how long to sleep until the nearest deadline.
+        None means to sleep until the deadline set changes.
+
+        :rtype: NoneType or number
+        """
+        with self.lock:
+            deadlines = [watcher['deadline']
+                         for watcher in self.watched.values()
+                         if not watcher['killed']]
+        if deadlines:
+            return max(0, min(deadlines) - time.time())
+        return None
+
+    def _wakeup(self):
+        """
+        Wake up the timer thread.
+        """
+        try:
+            os.write(self.wakeup_wfd, '\0')
+        except OSError as exc:
+            if exc.errno != errno.EAGAIN:
+                raise
+
+    def _drain(self):
+        """
+        Read all pending bytes from the self-pipe.
+        """
+        try:
+            while os.read(self.wakeup_rfd, 4096):
+                pass
+        except OSError as exc:
+            if exc.errno != errno.EAGAIN:
+                raise
@@ -2,18 +2,72 @@
 Interface to tests storage.
 """
 
+import collections
+import errno
+import hashlib
+import json
 import logging
+import math
 import os
 import os.path
+import re
+import threading
 import time
 
+from . import limits as pote_limits
+from .inotify import (IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_DELETE_SELF,
+                      IN_IGNORED, IN_ISDIR, IN_MOVE_SELF, IN_MOVED_FROM,
+                      IN_MOVED_TO, IN_ONLYDIR, IN_Q_OVERFLOW, PoteInotify)
+
 
 REFRESH_PERIOD = 60  # 1 minute
 
+# how often to rescan the tests when inotify is not available
+POLL_PERIOD = 5
+
+# name of the file with resource limits of tests, kept in the tests
+# directory. A JSON object mapping test names to limits, where the
+# "*" key holds default limits for all tests.
+LIMITS_NAME = 'limits.json'
+
+# directives are comment lines of the test module (or the __init__.py
+# of a test package) like "# pote: timeout=30, nondeterministic"
+DIRECTIVE_RE = re.compile(r'^#\s*pote:(.*)$')
+
+# how many last successful runs of a test its statistics are based on
+STATS_WINDOW = 50
+
+# a timeout is learned from at least this many runs of a test...
+TIMEOUT_MIN_RUNS = 5
+
+# ...as the 95th percentile of their durations times the factor,
+# but not less than TIMEOUT_MIN seconds
+TIMEOUT_FACTOR = 2
+TIMEOUT_MIN = 10
+
+# inotify events the tests directories are watched for
+WATCH_MASK = (IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
 
 class PoteTests(object):
     """
     Main interface to the Storage
+
+    Tests are kept in an index with their metadata:
+     mtime: time of the last modification of the test sources;
+     hash: SHA-1 of the test sources;
+     options: directives found in the test sources;
+     timeout: default max duration of the test, in seconds,
+       declared with "# pote: timeout=N" (or None);
+     duration: average duration of the last successful runs
+       of the test, in seconds (or None when it never succeeded);
+     learned_timeout: max duration of the test derived from
+       the durations of its last runs (or None when there are
+       too few runs).
+
+    The index is updated by the watcher thread (see watch()) as soon
+    as tests change, or rescanned once a REFRESH_PERIOD otherwise.
     """
 
     def __init__(self, path):
@@ -23,23 +77,112 @@ class PoteTests(object):
         :param path: path to a directory with tests.
         :type path: string
         """
-        self.tests = None
+        # test name -> metadata. Replaced, not updated, on changes,
+        # so readers can use it without the lock
+        self.index = {}
+        # sorted test names
+        self.tests = []
+        self.test_limits = {}
+        # test name -> (stat results of the sources, hash, options)
+        self.stamps = {}
+        # test name -> durations of the last runs
+        self.durations = {}
+        # incremented on every change of the available tests
+        self.version = 0
         self.last_updated = 0
+        self.watcher = None
+        self.lock = threading.Lock()
         self.logger = logging.getLogger(self.__class__.__name__)
         self.path = os.path.abspath(path)
         self.logger.debug('started at %r', self.path)
 
+    def watch(self, inotify=True):
+        """
+        Scan the tests and start the thread which keeps
+        the index up to date.
+
+        :param inotify: use inotify. The tests are polled
+            when False or when inotify is not available.
+        :type inotify: boolean
+        """
+        self.rescan()
+        self.watcher = PoteTestsWatcher.running(self, inotify)
+
     def available(self):
         """
         Return list of python module names of available tests.
 
         :rtype: list of string
         """
-        if time.time() > self.last_updated + REFRESH_PERIOD:
+        if self.watcher is None and \
+                time.time() > self.last_updated + REFRESH_PERIOD:
             self.logger.debug('outdated. rediscovering...')
-            self._update()
+            self.rescan()
         return self.tests
 
+    def snapshot(self):
+        """
+        Return the index of available tests: metadata of tests
+        by their names. The index returned is never changed.
+
+        :rtype: dict
+        """
+        self.available()
+        return self.index
+
+    def get(self, name):
+        """
+        Return metadata of the test or None if there is no such test.
+
+        :param name: python module name
+        :type name: string
+
+        :rtype: NoneType or dict
+        """
+        return self.snapshot().get(name)
+
+    def limits(self, name, override=None):
+        """
+        Return resource limits for the test.
+
+        :param name: python module name
+        :type name: string
+
+        :param override: limits requested for the job. They can only
+            tighten limits configured for the test (or the defaults).
+        :type override: NoneType or dict
+
+        :rtype: dict
+        """
+        self.available()
+        limits = dict(self.test_limits.get('*', {}))
+        limits.update(self.test_limits.get(name, {}))
+        return pote_limits.merge(limits, override)
+
+    def record_duration(self, name, *durations):
+        """
+        Account successful runs of the test in its statistics.
+
+        :param name: python module name
+        :type name: string
+
+        :param durations: how long the test ran, in seconds,
+            oldest first
+        :type durations: numbers
+        """
+        with self.lock:
+            window = self.durations.get(name)
+            if window is None:
+                window = collections.deque(maxlen=STATS_WINDOW)
+                self.durations[name] = window
+            window.extend(durations)
+            meta = self.index.get(name)
+            if meta is not None:
+                # indexes given by snapshot() are never changed
+                index = dict(self.index)
+                index[name] = dict(meta, **self._stats(name))
+                self._publish(index)
+
     def __contains__(self, name):
         """
         Return True if given name is a valid test module name.
@@ -49,28 +192,400 @@ class PoteTests(object):
 
         :rtype: boolean
         """
-        return name in self.available()
+        return name in self.snapshot()
 
-    def _update(self):
+    def rescan(self):
         """
-        Conditionally re-read tests from the tests directory.
+        Re-read the tests directory. Sources of the tests are read
+        again only when they are changed since the last scan.
         """
-        if not os.path.isdir(self.path):
-            self.logger.warning('no such directory: %r', self.path)
-            self.tests = []
+        with self.lock:
+            index = {}
+            if os.path.isdir(self.path):
+                for entry in os.listdir(self.path):
+                    name = self.test_name(entry)
+                    if name is None:
+                        continue
+                    meta = self._read_meta(name)
+                    if meta is not None:
+                        index[name] = meta
+            else:
+                self.logger.warning('no such directory: %r', self.path)
+            self.test_limits = self._read_limits()
             self.last_updated = time.time()
-            return
-        tests = []
-        for name in os.listdir(self.path):
-            abs_name = os.path.join(self.path, name)
-            if os.path.isfile(abs_name):
-                py_ext = '.py'
-                if (not name.startswith('.')) and name.endswith(py_ext):
-                    self.logger.debug('found normal module: %r', name)
-                    tests.append(name[:-len(py_ext)])
-            elif os.path.isdir(abs_name):
-                if os.path.isfile(os.path.join(abs_name, '__init__.py')):
-                    self.logger.debug('python package found: %r', name)
-                    tests.append(name)
-        self.last_updated = time.time()
+            self._publish(index)
+
+    def refresh(self, name):
+        """
+        Re-read the test after a change of its sources.
+
+        :param name: python module name
+        :type name: string
+        """
+        with self.lock:
+            index = dict(self.index)
+            meta = self._read_meta(name)
+            if meta is None:
+                index.pop(name, None)
+            else:
+                index[name] = meta
+            self._publish(index)
+
+    def reload_limits(self):
+        """
+        Re-read resource limits of tests after a change of the file.
+        """
+        with self.lock:
+            self.test_limits = self._read_limits()
+
+    def test_name(self, entry):
+        """
+        Return the name of the test the entry of the tests directory
+        can be (or None).
+
+        :param entry: file or directory name
+        :type entry: string
+
+        :rtype: NoneType or string
+        """
+        if entry.startswith('.'):
+            return None
+        if entry.endswith('.py'):
+            return entry[:-len('.py')] or None
+        if os.path.isfile(os.path.join(self.path, entry)):
+            return None
+        return entry
+
+    def _publish(self, index):
+        """
+        Replace the index. Must be called with the lock held.
+
+        :param index: new index
+        :type index: dict
+        """
+        for name in set(self.stamps) - set(index):
+            del self.stamps[name]
+        tests = sorted(index)
+        if tests != self.tests:
+            self.version += 1
+            self.logger.debug('tests changed: %r', tests)
+        self.index = index
         self.tests = tests
+
+    def _sources(self, name):
+        """
+        Return paths to source files of the test, the main one first.
+        Return an empty list if there is no such test.
+
+        :param name: python module name
+        :type name: string
+
+        :rtype: list of strings
+        """
+        path = os.path.join(self.path, name)
+        if os.path.isfile(path + '.py'):
+            return [path + '.py']
+        main_path = os.path.join(path, '__init__.py')
+        if not os.path.isfile(main_path):
+            return []
+        sources = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith('.py') and \
+                        os.path.join(dirpath, filename) != main_path:
+                    sources.append(os.path.join(dirpath, filename))
+        return [main_path] + sources
+
+    def _read_meta(self, name):
+        """
+        Return metadata of the test or None if there is no such test.
+        Must be called with the lock held.
+
+        :param name: python module name
+        :type name: string
+
+        :rtype: NoneType or dict
+        """
+        try:
+            sources = self._sources(name)
+            stats = [(path, os.stat(path)) for path in sources]
+        except OSError:
+            # removed in the meantime
+            return None
+        if not sources:
+            return None
+        stat = [(path, info.st_mtime, info.st_size) for path, info in stats]
+        stamp = self.stamps.get(name)
+        if stamp is None or stamp[0] != stat:
+            digest = hashlib.sha1()
+            options = {}
+            try:
+                for path in sources:
+                    with open(path, 'rb') as fdescr:
+                        data = fdescr.read()
+                    digest.update(os.path.relpath(path, self.path) + '\0')
+                    digest.update(data)
+                    if path == sources[0]:
+                        options = self._parse_directives(data)
+            except IOError:
+                return None
+            stamp = (stat, digest.hexdigest(), options)
+            self.stamps[name] = stamp
+            self.logger.debug('test %r read: %r', name, stamp[1:])
+        (_stat, digest, options) = stamp
+        timeout = options.get('timeout')
+        if isinstance(timeout, bool) or \
+                not isinstance(timeout, (int, float)) or timeout <= 0:
+            timeout = None
+        meta = {'mtime': max(info[1] for info in stat),
+                'hash': digest,
+                'options': options,
+                'timeout': timeout}
+        meta.update(self._stats(name))
+        return meta
+
+    def _stats(self, name):
+        """
+        Return the duration statistics of the test.
+        Must be called with the lock held.
+
+        :param name: python module name
+        :type name: string
+
+        :rtype: dict
+        """
+        window = sorted(self.durations.get(name, ()))
+        if not window:
+            return {'duration': None, 'learned_timeout': None}
+        learned_timeout = None
+        if len(window) >= TIMEOUT_MIN_RUNS:
+            percentile = window[int(math.ceil(0.95 * len(window))) - 1]
+            learned_timeout = max(
+                TIMEOUT_MIN, math.ceil(percentile * TIMEOUT_FACTOR))
+        return {'duration': float(sum(window)) / len(window),
+                'learned_timeout': learned_timeout}
+
+    @staticmethod
+    def _parse_directives(data):
+        """
+        Return directives found in the test source.
+        "key=value" gives a number (or a string) value,
+        a lone "key" gives True.
+
+        :param data: test source
+        :type data: string
+
+        :rtype: dict
+        """
+        options = {}
+        for line in data.splitlines():
+            match = DIRECTIVE_RE.match(line)
+            if match is None:
+                continue
+            for word in match.group(1).replace(',', ' ').split():
+                (key, sep, value) = word.partition('=')
+                if not sep:
+                    options[key] = True
+                    continue
+                try:
+                    options[key] = int(value)
+                except ValueError:
+                    try:
+                        options[key] = float(value)
+                    except ValueError:
+                        options[key] = value
+        return options
+
+    def _read_limits(self):
+        """
+        Read resource limits of tests. Return an empty dict
+        when there is no limits file or it is malformed.
+
+        :rtype: dict
+        """
+        path = os.path.join(self.path, LIMITS_NAME)
+        if not os.path.isfile(path):
+            return {}
+        try:
+            with open(path) as fdescr:
+                test_limits = json.load(fdescr)
+            if not isinstance(test_limits, dict):
+                raise ValueError('must be an object')
+            for limits in test_limits.values():
+                pote_limits.check(limits)
+        except (IOError, ValueError):
+            self.logger.error('bad limits file %r', path, exc_info=True)
+            return {}
+        return test_limits
+
+
+class PoteTestsWatcher(threading.Thread):
+    """
+    Thread which keeps the index of tests up to date. Changes are
+    taken from inotify, or the tests are rescanned once a POLL_PERIOD
+    when inotify is not available. While the tests directory is
+    removed, it is polled too, and inotify is used again when the
+    directory reappears.
+    """
+
+    def __init__(self, tests, inotify=True):
+        """
+        Constructor.
+
+        :param tests: interface to the tests storage
+        :type tests: pote.tests.PoteTests
+
+        :param inotify: use inotify
+        :type inotify: boolean
+        """
+        threading.Thread.__init__(self)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.daemon = True
+        self.tests = tests
+        self.inotify = inotify
+        # changes are taken from inotify at the moment
+        self.watching = False
+
+    @classmethod
+    def running(cls, *args, **kwargs):
+        """
+        Create and start a new watcher thread instance.
+        Return a link to the object created.
+        See constructor description for further details
+        about arguments.
+
+        :rtype: pote.tests.PoteTestsWatcher
+        """
+        instance = cls(*args, **kwargs)
+        instance.start()
+        return instance
+
+    def run(self):
+        """
+        Main thread activity.
+        """
+        rewatch = self.inotify
+        while True:
+            if rewatch:
+                try:
+                    self._watch()
+                except Exception as exc:
+                    self.logger.warning(
+                        'inotify failed. Falling back to polling',
+                        exc_info=True)
+                    # only a missing directory can come back
+                    rewatch = getattr(exc, 'errno', None) == errno.ENOENT
+            self._poll(rewatch)
+
+    def _poll(self, rewatch):
+        """
+        Rescan the tests once a POLL_PERIOD.
+
+        :param rewatch: return when the tests directory exists
+        :type rewatch: boolean
+        """
+        while True:
+            time.sleep(POLL_PERIOD)
+            try:
+                self.tests.rescan()
+            except Exception:
+                self.logger.error('rescan crashed', exc_info=True)
+            if rewatch and os.path.isdir(self.tests.path):
+                return
+
+    def _watch(self):
+        """
+        Update the index on inotify events until the tests
+        directory is removed.
+
+        :raise OSError: when inotify fails.
+        """
+        inotify = PoteInotify()
+        try:
+            # watch descriptor -> (test name or None, directory path)
+            dirs = {inotify.add_watch(self.tests.path, WATCH_MASK):
+                    (None, self.tests.path)}
+            for entry in os.listdir(self.tests.path):
+                name = self.tests.test_name(entry)
+                if name is not None:
+                    self._add_tree(inotify, dirs, name,
+                                   os.path.join(self.tests.path, entry))
+            # catch changes made before the watches were added
+            self.tests.rescan()
+            self.logger.debug('watching %r directories', len(dirs))
+            self.watching = True
+            while True:
+                for wd, mask, _cookie, entry in inotify.read():
+                    self._handle(inotify, dirs, wd, mask, entry)
+        finally:
+            self.watching = False
+            inotify.close()
+
+    def _handle(self, inotify, dirs, wd, mask, entry):
+        """
+        Process an inotify event.
+
+        :param inotify: inotify instance
+        :type inotify: pote.inotify.PoteInotify
+
+        :param dirs: directories watched, by watch descriptors
+        :type dirs: dict
+
+        :param wd: watch descriptor
+        :type wd: integer
+
+        :param mask: event mask
+        :type mask: integer
+
+        :param entry: name of the file the event is about
+        :type entry: string
+
+        :raise OSError: when the tests directory is removed.
+        """
+        if mask & IN_Q_OVERFLOW:
+            self.logger.warning('inotify queue overflow')
+            self.tests.rescan()
+            return
+        if wd not in dirs:
+            return
+        (name, path) = dirs[wd]
+        if mask & IN_IGNORED:
+            del dirs[wd]
+            return
+        if name is None:
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                raise OSError(errno.ENOENT, '%r is removed' % path)
+            if entry == LIMITS_NAME:
+                self.tests.reload_limits()
+                return
+            name = self.tests.test_name(entry)
+            if name is None:
+                return
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            self._add_tree(inotify, dirs, name, os.path.join(path, entry))
+        self.tests.refresh(name)
+
+    def _add_tree(self, inotify, dirs, name, path):
+        """
+        Watch the directory of the test and all its subdirectories.
+
+        :param inotify: inotify instance
+        :type inotify: pote.inotify.PoteInotify
+
+        :param dirs: directories watched, by watch descriptors
+        :type dirs: dict
+
+        :param name: test name
+        :type name: string
+
+        :param path: path to the directory
+        :type path: string
+        """
+        for dirpath, _dirnames, _filenames in os.walk(path):
+            try:
+                dirs[inotify.add_watch(dirpath, WATCH_MASK)] = \
+                    (name, dirpath)
+            except OSError:
+                # removed in the meantime
+                pass
@@ -3,28 +3,54 @@ Thread which starts target test, waits for the test to finish
 and collects results.
 """
 
+import functools
 import logging
 import os
 import os.path
 import Queue
-import shutil
-import subprocess
 import threading
 import time
 
+from . import limits as pote_limits
+from .metrics import METRICS
+from .zygote import PoteZygote
+
+
+# test launchers:
+#  exec: start a fresh interpreter for every test;
+#  zygote: fork every test from a long-living interpreter with
+#    preloaded modules (see pote.zygote).
+LAUNCHER_EXEC = 'exec'
+LAUNCHER_ZYGOTE = 'zygote'
+
+KNOWN_LAUNCHERS = [LAUNCHER_EXEC,
+                   LAUNCHER_ZYGOTE]
+
+METRICS.histogram(
+    'pote_warden_job_seconds',
+    'Time a warden spent on a job, from preparing the working'
+    ' directory to collecting the results')
+
 
 class PoteWarden(threading.Thread):
     """
     Test Job Warden thread.
     """
 
-    def __init__(self, scheduler, tests, path, envo):
+    def __init__(self, scheduler, supervisor, cleaner, tests, path, envo,
+                 launcher=None, preload=None, cgroups=None):
         """
         Constructor.
 
         :param scheduler: interface to the Scheduler thread.
         :type scheduler: pote.PoteScheduler
 
+        :param supervisor: interface to the test process supervisor.
+        :type supervisor: pote.supervisor.PoteSupervisor
+
+        :param cleaner: interface to the background directory remover.
+        :type cleaner: pote.cleaner.PoteCleaner
+
         :param tests: interface to the Tests Storage.
         :type tests: pote.PoteTests
 
@@ -33,13 +59,37 @@ class PoteWarden(threading.Thread):
 
         :param envo: envo ID. Passed only for logging.
         :type envo: integer
+
+        :param launcher: how to start tests. Default is exec.
+        :type launcher: NoneType or string, one of KNOWN_LAUNCHERS
+
+        :param preload: names of modules to preload in the zygote.
+        :type preload: NoneType or list of strings
+
+        :param cgroups: cgroup subtree to run tests in.
+            Without it only setrlimit() limits are applied.
+        :type cgroups: NoneType or pote.limits.PoteCgroups
         """
         threading.Thread.__init__(self)
         self.logger_id = '%s#%r' % (self.__class__.__name__, envo)
         self.logger = logging.getLogger(self.logger_id)
         self.scheduler = scheduler
+        self.supervisor = supervisor
+        self.cleaner = cleaner
         self.tests = tests
         self.path = os.path.abspath(path)
+        # where the test output is written while the job runs
+        self.output_path = os.path.join(self.path, 'stdout.txt')
+        # the environment is the same for all the jobs
+        self.environ = dict(os.environ)
+        self.environ.update(
+            {'LC_ALL': 'C',
+             'HOME': self.path,
+             'PYTHONPATH': self.tests.path})
+        self.cgroups = cgroups
+        self.zygote = None
+        if (launcher or LAUNCHER_EXEC) == LAUNCHER_ZYGOTE:
+            self.zygote = PoteZygote(supervisor, self.environ, preload)
         self.queue = Queue.Queue(maxsize=1)
         self.logger.debug('started at %r', self.path)
         self.busy = threading.Lock()
@@ -84,75 +134,124 @@ class PoteWarden(threading.Thread):
         while True:
             job = self.queue.get()
             self.logger.info('got new job: %r', job)
+            output_path = None
+            started = time.time()
             try:
-                self._process(job)
+                output_path = self._process(job)
             except Exception as exc:
                 self.logger.error(
                     'job %r crashed', job['id'], exc_info=True)
                 self.scheduler.notify_job_failed(
                     job['id'], 'crashed: %r' % exc)
-                self.scheduler.notify_job_result(job['id'])
+            METRICS.observe('pote_warden_job_seconds', time.time() - started)
             self.queue.task_done()
             self.busy.release()
+            # the scheduler gives the next job on results arrival,
+            # so the warden must be ready for it at that moment
+            self.scheduler.notify_job_result(job['id'], output_path)
 
     def _process(self, job):
         """
-        Execute the test job.
+        Execute the test job. Return path to a file with
+        the test output, if any.
 
         :param job: job data object
         :type job: dict
+
+        :rtype: NoneType or string
         """
         # Prepare working directory
         if not self._clean():
             self.scheduler.notify_job_failed(
                 job['id'], 'working dir not ready')
-            self.scheduler.notify_job_result(job['id'])
-            return
-        # construct environment and spawn a process
-        environ = dict(os.environ)
-        environ.update(
-            {'LC_ALL': 'C',
-             'HOME': self.path,
-             'PYTHONPATH': self.tests.path})
-        output_path = os.path.join(self.path, 'stdout.txt')
+            return None
+        # resource limits
+        limits = self.tests.limits(job['test'], job.get('limits'))
+        cgroup = None
+        if self.cgroups is not None:
+            try:
+                cgroup = self.cgroups.create(limits)
+            except (IOError, OSError):
+                self.logger.error(
+                    'failed to create cgroup for %r', job['id'],
+                    exc_info=True)
+                self.scheduler.notify_job_failed(
+                    job['id'], 'limits not applied')
+                return None
+        try:
+            return self._run(job, limits, cgroup)
+        finally:
+            if cgroup is not None:
+                self.cgroups.remove(cgroup)
+
+    def _run(self, job, limits, cgroup):
+        """
+        Spawn the test process and wait for it to finish.
+        Return path to a file with the test output, if any.
+
+        :param job: job data object
+        :type job: dict
+
+        :param limits: resource limits
+        :type limits: dict
+
+        :param cgroup: cgroup for the test process
+        :type cgroup: NoneType or pote.limits.PoteCgroup
+
+        :rtype: NoneType or string
+        """
+        rlimits = pote_limits.rlimits(limits, cgroup is not None)
+        cgroup_procs = None if cgroup is None else cgroup.procs_path
+        output_path = self.output_path
         with open(output_path, 'wb') as fdescr:
+            spawn_time = time.time()
             try:
-                proc = subprocess.Popen(
-                    ['python', '-m', job['test']],
-                    stdout=fdescr, stderr=fdescr,
-                    env=environ, close_fds=True)
+                if self.zygote is not None:
+                    proc = self.zygote.spawn(
+                        job['test'], self.path, output_path,
+                        rlimits, cgroup_procs)
+                else:
+                    preexec_fn = None
+                    if rlimits or cgroup_procs is not None:
+                        preexec_fn = functools.partial(
+                            pote_limits.enter, rlimits, cgroup_procs)
+                    proc = self.supervisor.popen(
+                        ['python', '-m', job['test']],
+                        stdout=fdescr, stderr=fdescr, cwd=self.path,
+                        env=self.environ, close_fds=True,
+                        preexec_fn=preexec_fn)
                 self.logger.info('job %r started', job['id'])
             except OSError as exc:
                 self.logger.debug(
                     'test spawn failed for %r', job['id'], exc_info=True)
                 self.scheduler.notify_job_failed(job['id'], exc.message)
-                self.scheduler.notify_job_result(job['id'])
-                return
+                return None
+            started = time.time()
             self.scheduler.notify_job_started(job['id'])
             # wait for the process to finish
-            deadline = time.time() + job['max_duration']
-            while proc.poll() is None and time.time() < deadline:
-                time.sleep(0.5)
-            if time.time() > deadline:
-                proc.kill()
-                proc.wait()
+            (stopped, killed) = self.supervisor.watch(
+                proc, started + job['max_duration'])
+            timing = {'spawn': started - spawn_time,
+                      'run': stopped - started}
+            usage = {}
+            if proc.rusage is not None:
+                usage = pote_limits.usage(proc.rusage)
+            if cgroup is not None:
+                usage.update(cgroup.usage())
+            self.scheduler.notify_job_stopped(job['id'], timing, usage)
+            if killed:
                 self.logger.debug('test timeouted: %r', job['id'])
-                self.scheduler.notify_job_stopped(job['id'])
                 self.scheduler.notify_job_failed(job['id'], 'timeouted')
+            elif proc.returncode == 0:
+                self.logger.info('job %r done', job['id'])
+                self.scheduler.notify_job_done(job['id'])
             else:
-                proc.wait()
-                self.scheduler.notify_job_stopped(job['id'])
-                if proc.returncode == 0:
-                    self.logger.info('job %r done', job['id'])
-                    self.scheduler.notify_job_done(job['id'])
-                else:
-                    self.logger.error(
-                        'job %r failed with exitcode %r',
-                        job['id'], proc.returncode)
-                    self.scheduler.notify_job_failed(
-                        job['id'], 'exit code %r' % proc.returncode)
-        # collect test results
-        self.scheduler.notify_job_result(job['id'], output_path)
+                self.logger.error(
+                    'job %r failed with exitcode %r',
+                    job['id'], proc.returncode)
+                self.scheduler.notify_job_failed(
+                    job['id'], 'exit code %r' % proc.returncode)
+        return output_path
 
     def _clean(self):
         """
@@ -161,13 +260,19 @@ class PoteWarden(threading.Thread):
         Return True oif working directory is ready,
         and False otherwise.
 
+        A dirty directory is not removed in place but handed
+        to the cleaner, so the next job starts without waiting
+        for the removal.
+
         :rtype: boolean
         """
         try:
             if os.path.isfile(self.path):
                 os.unlink(self.path)
             if os.path.isdir(self.path):
-                shutil.rmtree(self.path)
+                if not os.listdir(self.path):
+                    return True
+                self.cleaner.discard(self.path)
             os.makedirs(self.path)
             return True
         except OSError:
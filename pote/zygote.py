@@ -0,0 +1,438 @@
+"""
+Forkserver-style test launcher.
+
+A zygote is a long-living Python process with preloaded modules,
+which forks a child for every test instead of starting a fresh
+interpreter. The daemon talks to the zygote over its stdin and
+stdout, one JSON object per line:
+
+  daemon -> zygote:
+    {"spawn": "<test>", "cwd": "<path>", "output": "<path>",
+     "rlimits": [[<resource>, <soft>, <hard>], ...],
+     "cgroup": "<path to cgroup.procs>" or null}
+    {"kill": <pid>}
+  zygote -> daemon:
+    {"pid": <pid>} or {"error": "<message>"}, reply to "spawn";
+    {"exit": <pid>, "status": <status>, "rusage": {...}},
+      when a child exits.
+
+The module is run as a script by the daemon, so the zygote side
+must use the standard library only.
+"""
+
+import errno
+import fcntl
+import json
+import logging
+import os
+import os.path
+import Queue
+import resource
+import runpy
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+
+# path of the zygote script
+ZYGOTE_PATH = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+
+# modules preloaded by the zygote by default
+DEF_PRELOAD = ['json', 'random', 'time', 'traceback', 'unittest']
+
+# how long to wait for the zygote to exit on shutdown
+EXIT_TIMEOUT = 5
+
+# fields of the resource usage reported for children,
+# the same as pote.limits.RUSAGE_FIELDS
+RUSAGE_FIELDS = ('ru_utime', 'ru_stime', 'ru_maxrss', 'ru_minflt',
+                 'ru_majflt', 'ru_inblock', 'ru_oublock', 'ru_nvcsw',
+                 'ru_nivcsw')
+
+
+class PoteZygote(object):
+    """
+    Interface to a zygote process.
+
+    The zygote is started on the first spawn() and restarted
+    on the next spawn() after it dies.
+    """
+
+    def __init__(self, supervisor, env=None, preload=None):
+        """
+        Constructor.
+
+        :param supervisor: interface to the test process supervisor.
+        :type supervisor: pote.supervisor.PoteSupervisor
+
+        :param env: environment of the zygote and its children.
+        :type env: NoneType or dict
+
+        :param preload: names of modules to import in the zygote.
+        :type preload: NoneType or list of strings
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.supervisor = supervisor
+        self.env = env
+        self.preload = DEF_PRELOAD if preload is None else preload
+        # serializes spawns
+        self.lock = threading.Lock()
+        # serializes writes to the zygote. Separate from the spawn
+        # lock as kill() is called by the supervisor while a spawn
+        # waits for the reply
+        self.write_lock = threading.Lock()
+        self.proc = None
+        self.replies = None
+
+    def spawn(self, test, cwd, output_path, rlimits=None,
+              cgroup_procs=None):
+        """
+        Fork a child running the test module. Return a process
+        object to watch with the supervisor.
+
+        :param test: test module name
+        :type test: string
+
+        :param cwd: working directory of the child
+        :type cwd: string
+
+        :param output_path: path to a file for stdout and stderr
+        :type output_path: string
+
+        :param rlimits: setrlimit() arguments for the child
+        :type rlimits: NoneType or list of tuples (resource, soft, hard)
+
+        :param cgroup_procs: path to the cgroup.procs file of a cgroup
+            to move the child to.
+        :type cgroup_procs: NoneType or string
+
+        :rtype: pote.zygote.PoteZygoteChild
+
+        :raise OSError: when the child cannot be spawned.
+        """
+        with self.lock:
+            if self.proc is None:
+                self._start()
+            try:
+                self._send({'spawn': test,
+                            'cwd': cwd,
+                            'output': output_path,
+                            'rlimits': rlimits or [],
+                            'cgroup': cgroup_procs})
+            except (IOError, AttributeError):
+                raise OSError('zygote exited')
+            reply = self.replies.get()
+        if 'error' in reply:
+            raise OSError(reply['error'])
+        return reply['child']
+
+    def kill(self, pid):
+        """
+        Kill the child of the zygote.
+
+        :param pid: child process ID
+        :type pid: integer
+        """
+        try:
+            self._send({'kill': pid})
+        except (IOError, AttributeError):
+            # the zygote is dead and its children are killed
+            pass
+
+    def _start(self):
+        """
+        Start the zygote process and its reader thread.
+        Must be called with the lock held.
+        """
+        self.proc = self.supervisor.popen(
+            ['python', ZYGOTE_PATH] + list(self.preload),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            env=self.env, close_fds=True)
+        self.replies = Queue.Queue()
+        reader = threading.Thread(
+            target=self._reader, args=(self.proc, self.replies, {}))
+        reader.daemon = True
+        reader.start()
+        self.logger.debug('zygote started with pid %r', self.proc.pid)
+
+    def _send(self, message):
+        """
+        Send the message to the zygote.
+
+        :param message: message to send
+        :type message: dict
+
+        :raise IOError: when the zygote is dead.
+        :raise AttributeError: when the zygote is dead.
+        """
+        with self.write_lock:
+            self.proc.stdin.write(json.dumps(message) + '\n')
+            self.proc.stdin.flush()
+
+    def _reader(self, proc, replies, children):
+        """
+        Read messages from the zygote until it exits.
+
+        :param proc: zygote process
+        :type proc: subprocess.Popen
+
+        :param replies: queue for replies to spawn requests
+        :type replies: Queue.Queue
+
+        :param children: running children of the zygote, by pid
+        :type children: dict
+        """
+        for line in iter(proc.stdout.readline, ''):
+            message = json.loads(line)
+            if 'exit' in message:
+                children.pop(message['exit'], None)
+                self.supervisor.exited(
+                    message['exit'], message['status'], message['rusage'])
+            elif 'pid' in message:
+                child = PoteZygoteChild(self, message['pid'])
+                children[child.pid] = child
+                replies.put({'child': child})
+            else:
+                replies.put(message)
+        self.logger.error('zygote with pid %r exited', proc.pid)
+        # unblock the spawn waiting for the reply, if any
+        replies.put({'error': 'zygote exited'})
+        with self.write_lock:
+            self.proc = None
+            proc.stdin.close()
+        for pid in children.keys():
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+            del children[pid]
+            self.supervisor.exited(pid, signal.SIGKILL)
+        self.supervisor.watch(proc, time.time() + EXIT_TIMEOUT)
+
+
+class PoteZygoteChild(object):
+    """
+    Child of a zygote, with the part of the subprocess.Popen
+    interface used by the supervisor.
+    """
+
+    def __init__(self, zygote, pid):
+        """
+        Constructor.
+
+        :param zygote: parent zygote
+        :type zygote: pote.zygote.PoteZygote
+
+        :param pid: child process ID
+        :type pid: integer
+        """
+        self.zygote = zygote
+        self.pid = pid
+        self.returncode = None
+        self.rusage = None
+
+    def kill(self):
+        """
+        Kill the child.
+        """
+        self.zygote.kill(self.pid)
+
+    def _handle_exitstatus(self, status):
+        """
+        Set the return code from the exit status,
+        the same way subprocess.Popen does.
+
+        :param status: exit status as returned by wait4()
+        :type status: integer
+        """
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+
+
+# ----------------------------------------------------------------------
+# Zygote process side
+
+
+def main():
+    """
+    Zygote process main loop.
+    """
+    # do not let tests import the daemon modules
+    del sys.path[0]
+    for name in sys.argv[1:]:
+        __import__(name)
+    proto_in = os.dup(0)
+    proto_out = os.dup(1)
+    # stray writes must not break the protocol
+    os.dup2(2, 1)
+    (wakeup_rfd, wakeup_wfd) = os.pipe()
+    for fdescr in (wakeup_rfd, wakeup_wfd):
+        flags = fcntl.fcntl(fdescr, fcntl.F_GETFL)
+        fcntl.fcntl(fdescr, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    signal.signal(signal.SIGCHLD, lambda *_args: None)
+    signal.set_wakeup_fd(wakeup_wfd)
+    children = set()
+    buf = ''
+    while True:
+        try:
+            (readable, _w, _x) = select.select(
+                [proto_in, wakeup_rfd], [], [])
+        except select.error as exc:
+            if exc.args[0] != errno.EINTR:
+                raise
+            readable = []
+        if wakeup_rfd in readable:
+            try:
+                while os.read(wakeup_rfd, 4096):
+                    pass
+            except OSError as exc:
+                if exc.errno != errno.EAGAIN:
+                    raise
+        _reap(proto_out, children)
+        if proto_in not in readable:
+            continue
+        data = os.read(proto_in, 4096)
+        if not data:
+            # the daemon is gone
+            for pid in children:
+                os.kill(pid, signal.SIGKILL)
+            return
+        buf += data
+        while '\n' in buf:
+            (line, buf) = buf.split('\n', 1)
+            request = json.loads(line)
+            if 'kill' in request:
+                # children are reaped only here, so the pid is not reused
+                if request['kill'] in children:
+                    os.kill(request['kill'], signal.SIGKILL)
+                continue
+            try:
+                pid = _fork(request, [proto_in, proto_out,
+                                      wakeup_rfd, wakeup_wfd])
+            except OSError as exc:
+                _reply(proto_out, {'error': str(exc)})
+                continue
+            children.add(pid)
+            _reply(proto_out, {'pid': pid})
+
+
+def _reap(proto_out, children):
+    """
+    Reap all exited children and report their exit statuses.
+
+    :param proto_out: file descriptor to write messages to
+    :type proto_out: integer
+
+    :param children: IDs of running children
+    :type children: set of integers
+    """
+    while children:
+        try:
+            (pid, status, rusage) = os.wait4(-1, os.WNOHANG)
+        except OSError as exc:
+            if exc.errno == errno.EINTR:
+                continue
+            if exc.errno == errno.ECHILD:
+                children.clear()
+                return
+            raise
+        if not pid:
+            return
+        children.discard(pid)
+        _reply(proto_out, {
+            'exit': pid,
+            'status': status,
+            'rusage': {name: getattr(rusage, name)
+                       for name in RUSAGE_FIELDS}})
+
+
+def _reply(proto_out, message):
+    """
+    Send the message to the daemon.
+
+    :param proto_out: file descriptor to write messages to
+    :type proto_out: integer
+
+    :param message: message to send
+    :type message: dict
+    """
+    data = json.dumps(message) + '\n'
+    while data:
+        data = data[os.write(proto_out, data):]
+
+
+def _fork(request, fds):
+    """
+    Fork a child running the test module. Return the child pid.
+
+    :param request: spawn request
+    :type request: dict
+
+    :param fds: zygote file descriptors to close in the child
+    :type fds: list of integers
+
+    :rtype: integer
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        return pid
+    code = 1
+    try:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for fdescr in fds:
+            os.close(fdescr)
+        # Python 2 does not reseed the preloaded random module
+        # after fork(), so all the children would share its state
+        if 'random' in sys.modules:
+            sys.modules['random'].seed()
+        if request.get('cgroup'):
+            with open(request['cgroup'], 'w') as fdescr:
+                fdescr.write('%d\n' % os.getpid())
+        output = os.open(
+            request['output'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.chdir(request['cwd'])
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(output, 1)
+        os.dup2(output, 2)
+        os.close(devnull)
+        os.close(output)
+        # the same as 'python -m <test>' does
+        sys.path.insert(0, '')
+        # JSON strings are unicode, but runpy needs str
+        test = str(request['spawn'])
+        sys.argv = [test]
+        for res, soft, hard in request.get('rlimits', []):
+            resource.setrlimit(res, (soft, hard))
+        code = 0
+        runpy.run_module(test, run_name='__main__', alter_sys=True)
+    except SystemExit as exc:
+        if exc.code is None:
+            code = 0
+        elif isinstance(exc.code, int):
+            code = exc.code
+        else:
+            sys.stderr.write('%s\n' % exc.code)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,547 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the scheduler/warden pipeline and the archive.
+
+The pipeline benchmark starts pote.start_server() in a child process
+with temporary paths, submits a mix of synthetic jobs (fast and slow,
+passing and failing) and measures the end-to-end throughput, the
+latency from job arrival to the test start and the latency of REST
+requests made by concurrent pollers meanwhile. It is repeated for
+each envo count given.
+
+The archive benchmark fills the index of a temporary archive with
+synthetic jobs and measures listing and scanning of it.
+
+Results are written as a JSON document, to compare them across
+versions.
+"""
+
+import argparse
+import httplib
+import json
+import logging
+import os
+import os.path
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pote
+import pote.archive
+
+
+# synthetic tests: name -> source. Slow tests sleep
+# for --slow-duration seconds
+TESTS = {
+    'bench_fast_good':
+        "import sys\n"
+        "sys.stdout.write(__name__ + ' done\\n')\n",
+    'bench_fast_bad':
+        "import sys\n"
+        "sys.stderr.write(__name__ + ' failed\\n')\n"
+        "sys.exit(1)\n",
+    'bench_slow_good':
+        "import sys\n"
+        "import time\n"
+        "time.sleep(%(slow)r)\n"
+        "sys.stdout.write(__name__ + ' done\\n')\n",
+    'bench_slow_bad':
+        "import sys\n"
+        "import time\n"
+        "time.sleep(%(slow)r)\n"
+        "sys.stderr.write(__name__ + ' failed\\n')\n"
+        "sys.exit(1)\n"}
+
+# how many users submit jobs
+USERS = 4
+
+# the daemon started in the child process. Its keyword arguments
+# come JSON encoded as the first command line argument
+SERVER_CODE = (
+    'import json, logging, sys\n'
+    'import pote\n'
+    'logging.basicConfig(level=logging.WARNING)\n'
+    'pote.start_server(**json.loads(sys.argv[1]))\n')
+
+# how long to wait for the daemon to start, in seconds
+START_TIMEOUT = 30
+
+# how often to check if all the jobs are archived, in seconds
+CHECK_PERIOD = 0.2
+
+# URLs requested by the pollers in turn
+POLL_URLS = ('/job', '/archive?limit=50', '/usage')
+
+# how many jobs to insert into the archive index per transaction
+FILL_CHUNK = 10000
+
+# percentiles reported for latencies
+PERCENTILES = (50, 90, 99)
+
+
+def main():
+    """
+    Main entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the Pote scheduler/warden pipeline'
+        ' and the archive.')
+    parser.add_argument(
+        '--envos', default='1,4,16', metavar='N[,N...]',
+        help='Envo counts to run the pipeline benchmark with.'
+        ' Default is %(default)s.')
+    parser.add_argument(
+        '--jobs', type=int, default=2000, metavar='N',
+        help='Jobs to submit per envo count. Default is %(default)s.')
+    parser.add_argument(
+        '--slow-ratio', type=float, default=0.1, metavar='RATIO',
+        help='Fraction of slow jobs. Default is %(default)s.')
+    parser.add_argument(
+        '--slow-duration', type=float, default=0.5, metavar='SECONDS',
+        help='How long a slow job runs. Default is %(default)s.')
+    parser.add_argument(
+        '--fail-ratio', type=float, default=0.1, metavar='RATIO',
+        help='Fraction of failing jobs. Default is %(default)s.')
+    parser.add_argument(
+        '--batch', type=int, default=100, metavar='N',
+        help='Jobs submitted per POST /jobs request.'
+        ' Default is %(default)s.')
+    parser.add_argument(
+        '--pollers', type=int, default=4, metavar='N',
+        help='Clients polling the REST API while jobs run.'
+        ' Default is %(default)s.')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed of the job mix. Default is %(default)s.')
+    parser.add_argument(
+        '--timeout', type=float, default=1800, metavar='SECONDS',
+        help='Max time to wait for the jobs of an envo count.'
+        ' Default is %(default)s.')
+    parser.add_argument(
+        '--http-workers', type=int, metavar='N',
+        help='Passed to the daemon, see poted --help.')
+    parser.add_argument(
+        '--warden-processes', type=int, metavar='N',
+        help='Passed to the daemon, see poted --help.')
+    parser.add_argument(
+        '--launcher',
+        help='Passed to the daemon, see poted --help.')
+    parser.add_argument(
+        '--dispatch-policy',
+        help='Passed to the daemon, see poted --help.')
+    parser.add_argument(
+        '--archive-sizes', default='10000,100000,1000000',
+        metavar='N[,N...]',
+        help='Archive sizes to run the archive benchmark with.'
+        ' Empty to skip. Default is %(default)s.')
+    parser.add_argument(
+        '--output', metavar='PATH',
+        help='Write results to the file instead of stdout.')
+    parser.add_argument(
+        '--keep', action='store_true',
+        help='Do not remove the temporary directories.')
+    args = parser.parse_args()
+    logging.basicConfig(
+        format='%(asctime)s %(message)s', level=logging.INFO)
+    results = {'pote': version(),
+               'commit': commit(),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpus': os.sysconf('SC_NPROCESSORS_ONLN'),
+               'time': time.time(),
+               'config': vars(args),
+               'pipeline': [],
+               'archive': []}
+    for envos in parse_counts(args.envos):
+        logging.info('pipeline: %r jobs, %r envos', args.jobs, envos)
+        results['pipeline'].append(bench_pipeline(args, envos))
+    for size in parse_counts(args.archive_sizes):
+        logging.info('archive: %r jobs', size)
+        results['archive'].append(bench_archive(args, size))
+    encoded = json.dumps(results, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as fdescr:
+            fdescr.write(encoded)
+    else:
+        sys.stdout.write(encoded)
+
+
+def bench_pipeline(args, envos):
+    """
+    Run the jobs through a fresh daemon. Return the results.
+
+    :param args: command line arguments
+    :type args: argparse.Namespace
+
+    :param envos: how many envos the daemon has
+    :type envos: integer
+
+    :rtype: dict
+    """
+    path = tempfile.mkdtemp(prefix='pote-bench-')
+    tests_path = os.path.join(path, 'tests')
+    os.makedirs(tests_path)
+    for name, source in TESTS.items():
+        with open(os.path.join(tests_path, name + '.py'), 'w') as fdescr:
+            fdescr.write(source % {'slow': args.slow_duration})
+    port = free_port()
+    server = {'bindaddr': '127.0.0.1',
+              'bindport': port,
+              'envos_count': envos,
+              'envos_path': os.path.join(path, 'envos'),
+              'tests_path': tests_path,
+              'queue_path': os.path.join(path, 'queue'),
+              'archive_path': os.path.join(path, 'archive'),
+              'http_workers': args.http_workers,
+              'warden_processes': args.warden_processes,
+              'launcher': args.launcher,
+              'dispatch_policy': args.dispatch_policy}
+    environ = dict(os.environ)
+    environ['PYTHONPATH'] = os.path.dirname(
+        os.path.dirname(os.path.abspath(pote.__file__)))
+    with open(os.path.join(path, 'poted.log'), 'w') as log:
+        proc = subprocess.Popen(
+            [sys.executable or 'python', '-c', SERVER_CODE,
+             json.dumps(server)],
+            stdout=log, stderr=log, env=environ, close_fds=True,
+            preexec_fn=os.setsid)
+    try:
+        wait_started(port, proc)
+        result = run_jobs(args, port, make_jobs(args))
+    finally:
+        # the tests and the zygotes are in the same session
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    jobs = pote.archive.PoteArchive(server['archive_path']).dump()
+    statuses = {}
+    for job in jobs:
+        statuses[job['status']] = statuses.get(job['status'], 0) + 1
+    result.update(
+        {'envos': envos,
+         'archived': len(jobs),
+         'statuses': statuses,
+         'start_latency': summary(
+             [job['started'] - job['time'] for job in jobs
+              if 'started' in job]),
+         'spawn_time': summary(
+             [job['timing']['spawn'] for job in jobs
+              if job.get('timing')])})
+    if not args.keep:
+        shutil.rmtree(path)
+    return result
+
+
+def make_jobs(args):
+    """
+    Return the synthetic job mix.
+
+    :param args: command line arguments
+    :type args: argparse.Namespace
+
+    :rtype: list of dicts
+    """
+    rand = random.Random(args.seed)
+    jobs = []
+    for index in range(args.jobs):
+        speed = 'slow' if rand.random() < args.slow_ratio else 'fast'
+        result = 'bad' if rand.random() < args.fail_ratio else 'good'
+        jobs.append({'user': 'user%d' % (index % USERS),
+                     'envo': 'any',
+                     'test': 'bench_%s_%s' % (speed, result)})
+    return jobs
+
+
+def run_jobs(args, port, jobs):
+    """
+    Submit the jobs and wait until all of them are archived while
+    the pollers request the REST API. Return the results.
+
+    :param args: command line arguments
+    :type args: argparse.Namespace
+
+    :param port: TCP port number of the daemon
+    :type port: integer
+
+    :param jobs: jobs to submit
+    :type jobs: list of dicts
+
+    :rtype: dict
+    """
+    stop = threading.Event()
+    latencies = dict((url, []) for url in POLL_URLS)
+    pollers = [threading.Thread(target=poll,
+                                args=(port, stop, latencies, index))
+               for index in range(args.pollers)]
+    for poller in pollers:
+        poller.daemon = True
+        poller.start()
+    started = time.time()
+    for index in range(0, len(jobs), args.batch):
+        request(port, 'POST', '/jobs', jobs[index:index + args.batch])
+    submitted = time.time()
+    while archived(port) < len(jobs):
+        if time.time() - started > args.timeout:
+            raise RuntimeError('%r jobs not finished in %r seconds' %
+                               (len(jobs) - archived(port), args.timeout))
+        time.sleep(CHECK_PERIOD)
+    finished = time.time()
+    stop.set()
+    for poller in pollers:
+        poller.join()
+    return {'jobs': len(jobs),
+            'submit_seconds': submitted - started,
+            'seconds': finished - started,
+            'throughput': len(jobs) / (finished - started),
+            'rest_latency': dict((url, summary(values))
+                                 for url, values in latencies.items())}
+
+
+def poll(port, stop, latencies, index):
+    """
+    Request the REST API in a loop until stopped,
+    recording latencies of the requests.
+
+    :param port: TCP port number of the daemon
+    :type port: integer
+
+    :param stop: set when polling must stop
+    :type stop: threading.Event
+
+    :param latencies: latencies of requests by URLs, in seconds
+    :type latencies: dict of lists
+
+    :param index: poller index, to start with different URLs
+    :type index: integer
+    """
+    while not stop.is_set():
+        url = POLL_URLS[index % len(POLL_URLS)]
+        started = time.time()
+        request(port, 'GET', url)
+        latencies[url].append(time.time() - started)
+        index += 1
+
+
+def archived(port):
+    """
+    Return how many jobs the daemon has archived,
+    according to its metrics.
+
+    :param port: TCP port number of the daemon
+    :type port: integer
+
+    :rtype: integer
+    """
+    count = 0
+    for line in request(port, 'GET', '/metrics', raw=True).splitlines():
+        if line.startswith('pote_jobs_archived_total'):
+            count += int(line.split()[-1])
+    return count
+
+
+def wait_started(port, proc):
+    """
+    Wait until the daemon replies to pings.
+
+    :param port: TCP port number of the daemon
+    :type port: integer
+
+    :param proc: the daemon process
+    :type proc: subprocess.Popen
+    """
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('the daemon exited with %r' % proc.returncode)
+        try:
+            request(port, 'GET', '/ping')
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise RuntimeError('the daemon not started in %r seconds' %
+                       START_TIMEOUT)
+
+
+def request(port, method, url, body=None, raw=False):
+    """
+    Make HTTP request to the daemon. Return the response entity,
+    decoded from JSON unless raw.
+
+    :param port: TCP port number of the daemon
+    :type port: integer
+
+    :param method: HTTP method to use
+    :type method: 'GET' or 'POST'
+
+    :param url: URL
+    :type url: string
+
+    :param body: request entity (will be encoded as JSON)
+    :type body: any or NoneType
+
+    :param raw: return the entity as is
+    :type raw: boolean
+
+    :rtype: any
+    """
+    headers = {}
+    if body is not None:
+        body = json.dumps(body)
+        headers = {'content-type': 'application/json'}
+    connection = httplib.HTTPConnection('127.0.0.1', port)
+    try:
+        connection.request(method, url, body, headers)
+        reply = connection.getresponse()
+        data = reply.read()
+    finally:
+        connection.close()
+    if reply.status >= 300:
+        raise RuntimeError('%s %s: %r %r' % (method, url, reply.status, data))
+    if raw:
+        return data
+    return json.loads(data) if data else None
+
+
+def bench_archive(args, size):
+    """
+    Fill a fresh archive index with synthetic jobs and measure
+    listing and scanning of it. Return the results.
+
+    :param args: command line arguments
+    :type args: argparse.Namespace
+
+    :param size: how many jobs to put in the archive
+    :type size: integer
+
+    :rtype: dict
+    """
+    path = tempfile.mkdtemp(prefix='pote-bench-')
+    archive = pote.archive.PoteArchive(os.path.join(path, 'archive'))
+    rand = random.Random(args.seed)
+    tests = sorted(TESTS)
+    started = time.time()
+    now = time.time()
+    with archive.lock:
+        # the job directories are not needed to list the archive,
+        # so only the index is filled
+        db = archive._open_index()
+        for index in range(size):
+            run = rand.random()
+            job = {'id': '%032x' % index,
+                   'time': now - size + index,
+                   'started': now - size + index + 0.01,
+                   'stopped': now - size + index + 0.01 + run,
+                   'user': 'user%d' % (index % USERS),
+                   'envo': index % 16,
+                   'test': rand.choice(tests),
+                   'status': 'done' if rand.random() > 0.1 else 'failed',
+                   'max_duration': 90,
+                   'timing': {'spawn': 0.01, 'run': run}}
+            archive._index_job(db, job)
+            if index % FILL_CHUNK == FILL_CHUNK - 1:
+                db.commit()
+        db.commit()
+    result = {'entries': size, 'fill_seconds': time.time() - started}
+    last_id = '%032x' % (size - 1)
+    for name, func in (
+            ('newest_page', lambda: archive.dump(limit=50)),
+            ('filtered_page',
+             lambda: archive.dump(limit=50, user='user1', status='failed')),
+            ('next_page', lambda: archive.dump(limit=50, before=last_id)),
+            ('durations',
+             lambda: archive.durations(tests[0], 100, 'done')),
+            ('full_scan', archive.dump)):
+        started = time.time()
+        func()
+        result[name + '_seconds'] = time.time() - started
+    if not args.keep:
+        shutil.rmtree(path)
+    return result
+
+
+def summary(values):
+    """
+    Return the count, the mean, percentiles and the max of values.
+
+    :param values: samples
+    :type values: list of numbers
+
+    :rtype: dict
+    """
+    result = {'count': len(values)}
+    if not values:
+        return result
+    values = sorted(values)
+    result['mean'] = sum(values) / len(values)
+    result['max'] = values[-1]
+    for percentile in PERCENTILES:
+        # nearest-rank method
+        rank = max(int(-(-percentile * len(values) // 100)), 1)
+        result['p%d' % percentile] = values[rank - 1]
+    return result
+
+
+def parse_counts(spec):
+    """
+    Parse comma separated list of integers.
+
+    :param spec: list specification like '1,4,16'
+    :type spec: string
+
+    :rtype: list of integers
+    """
+    return [int(item) for item in spec.split(',') if item.strip()]
+
+
+def free_port():
+    """
+    Return a TCP port number nobody listens to.
+
+    :rtype: integer
+    """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def version():
+    """
+    Return the version of Pote, from the Debian changelog.
+
+    :rtype: NoneType or string
+    """
+    path = os.path.join(
+        os.path.dirname(os.path.abspath(pote.__file__)), os.pardir,
+        'debian', 'changelog')
+    if not os.path.isfile(path):
+        return None
+    with open(path) as fdescr:
+        return fdescr.readline().split()[1].strip('()')
+
+
+def commit():
+    """
+    Return the Git commit Pote is run from, if known.
+
+    :rtype: NoneType or string
+    """
+    with open(os.devnull, 'w') as devnull:
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(pote.__file__))).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+
+if __name__ == '__main__':
+    main()
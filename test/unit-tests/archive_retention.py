@@ -0,0 +1,161 @@
+"""
+Unit test for the Archive retention policies and packing.
+"""
+
+import logging
+import os
+import os.path
+import shutil
+import unittest
+
+import pote
+import pote.archive
+import pote.retention
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+DAY = pote.retention.DAY
+
+
+class PoteRetentionTest(unittest.TestCase):
+    """
+    Unit test for the Archive retention policies and packing.
+    """
+
+    path = 'archive-retention.tmp'
+
+    def setUp(self):
+        """
+        Test prepare recipes.
+        """
+        self.archive = pote.PoteArchive(self.path, compress_threshold=20)
+        # four days of jobs, a job per six hours
+        self.jobs = []
+        for i in range(16):
+            job = {'id': 'job%02d' % i,
+                   'time': 10 * DAY + i * DAY / 4,
+                   'user': 'u%d' % (i % 2),
+                   'test': 't%d' % (i % 4),
+                   'status': 'failed' if i in (1, 2) else 'done'}
+            output_path = self.path + '-stdout.txt'
+            with open(output_path, 'w') as fdescr:
+                fdescr.write('output of %s\n' % job['id'] * (i % 3))
+            self.archive.archive(job, output_path)
+            self.jobs.append(job)
+        self.archive.flush()
+        self.now = 14 * DAY
+
+    def tearDown(self):
+        """
+        Test destroy recipes.
+        """
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+    def test_select(self):
+        """
+        Retention policies.
+        """
+        entries = self.archive.entries()
+        self.assertSelected({'max_age': 3 * DAY}, entries, range(4))
+        self.assertSelected(
+            {'max_age': 3 * DAY, 'keep_failures': 1}, entries, [0, 1, 3])
+        self.assertSelected({'max_per_user': 6}, entries, range(4))
+        self.assertSelected({'max_per_test': 3}, entries, range(4))
+        total = sum(entry['size'] for entry in entries)
+        self.assertSelected(
+            {'max_bytes': total - 1}, entries, [0])
+        self.assertSelected(
+            {'max_bytes': total - 1, 'keep_failures': 5}, entries, [0])
+        self.assertSelected(
+            {'max_bytes': total - entries[0]['size'] - 1,
+             'keep_failures': 5}, entries, [0, 3])
+        self.assertSelected({}, entries, [])
+
+    def test_cached(self):
+        """
+        Jobs whose output is read by cached jobs are kept.
+        """
+        job = {'id': 'job16', 'time': 13.9 * DAY, 'user': 'u0',
+               'test': 't0', 'status': 'done', 'cached': 'job04'}
+        self.archive.archive(job)
+        self.jobs.append(job)
+        entries = self.archive.entries()
+        self.assertEqual(entries[-1]['cached'], 'job04')
+        self.assertSelected(
+            {'max_age': 2.5 * DAY}, entries, [0, 1, 2, 3, 5])
+        self.assertSelected(
+            {'max_per_user': 1}, entries, range(4) + range(5, 15))
+        # the origin goes along with the last cached job
+        self.assertSelected({'max_age': 0}, entries, range(17))
+        retention = pote.retention.PoteRetention(
+            self.archive, max_age=2.5 * DAY, io_rate=0)
+        retention.apply(self.now)
+        (fdescr, _size) = self.archive.open_log('job16')
+        with fdescr:
+            self.assertEqual(fdescr.read(), 'output of job04\n')
+
+    def test_pack(self):
+        """
+        Packed jobs stay readable.
+        """
+        retention = pote.retention.PoteRetention(
+            self.archive, max_age=3.5 * DAY, pack_after=2 * DAY, io_rate=0)
+        retention.apply(self.now)
+        self.assertEqual(
+            [job['id'] for job in self.archive.dump()],
+            [job['id'] for job in self.jobs[2:]])
+        segments = sorted(os.listdir(
+            os.path.join(self.path, pote.archive.SEGMENTS_DIR)))
+        self.assertEqual(segments, ['1970-01-11.tar', '1970-01-12.tar'])
+        self.assertLogs(self.jobs[2:])
+        # the index is rebuilt from job directories and segments
+        os.unlink(os.path.join(self.path, pote.archive.INDEX_NAME))
+        self.archive = pote.PoteArchive(self.path)
+        self.assertEqual(
+            [job['id'] for job in self.archive.dump()],
+            [job['id'] for job in self.jobs[2:]])
+        self.assertLogs(self.jobs[2:])
+        # the segment is removed along with its last job
+        retention.archive = self.archive
+        retention.max_age = 3 * DAY
+        retention.apply(self.now)
+        segments = sorted(os.listdir(
+            os.path.join(self.path, pote.archive.SEGMENTS_DIR)))
+        self.assertEqual(segments, ['1970-01-12.tar'])
+        self.assertLogs(self.jobs[4:])
+
+    def assertSelected(self, policies, entries, indices):
+        """
+        Make assertion for jobs selected for removal.
+
+        :param policies: retention policies
+        :type policies: dict
+
+        :param entries: brief details of archived jobs
+        :type entries: list of dicts
+
+        :param indices: indices of jobs expected to be removed
+        :type indices: list of integers
+        """
+        retention = pote.retention.PoteRetention(self.archive, **policies)
+        self.assertEqual(
+            retention.select(entries, self.now),
+            [self.jobs[i]['id'] for i in indices])
+
+    def assertLogs(self, jobs):
+        """
+        Make assertion for outputs of archived jobs.
+
+        :param jobs: archived jobs
+        :type jobs: list of dicts
+        """
+        for i, job in enumerate(jobs):
+            expected = 'output of %s\n' % job['id'] * (int(job['id'][3:]) % 3)
+            (fdescr, size) = self.archive.open_log(job['id'])
+            with fdescr:
+                self.assertEqual((fdescr.read(), size),
+                                 (expected, len(expected)))
+                fdescr.seek(5)
+                self.assertEqual(fdescr.read(), expected[5:])
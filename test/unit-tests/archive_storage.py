@@ -10,6 +10,7 @@ import time
 import unittest
 
 import pote
+import pote.archive
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -61,6 +62,118 @@ class PoteArchiveTest(unittest.TestCase):
         s.archive(c)
         self.assertJobs(s, [b, a, c])
 
+    def test_durations(self):
+        """
+        Durations of the last jobs of a test.
+        """
+        s = pote.PoteArchive(self.path)
+        self.assertEqual(s.durations('t', 10, 'done'), [])
+        for i in range(5):
+            s.archive({'id': 'job%d' % i,
+                       'time': 100 + i,
+                       'test': 't',
+                       'status': 'failed' if i == 3 else 'done',
+                       'timing': {'spawn': 0.1, 'run': i}})
+        s.archive({'id': 'other', 'time': 200, 'test': 'u',
+                   'status': 'done', 'timing': {'run': 10}})
+        s.archive({'id': 'killed', 'time': 300, 'test': 't',
+                   'status': 'done'})
+        self.assertEqual(s.durations('t', 10, 'done'), [4, 2, 1, 0])
+        self.assertEqual(s.durations('t', 2, 'done'), [4, 2])
+        # the durations are restored when the index is rebuilt
+        s.reindex()
+        self.assertEqual(s.durations('t', 10, 'done'), [4, 2, 1, 0])
+
+    def test_cached(self):
+        """
+        Results to reuse and logs of jobs reusing them.
+        """
+        s = pote.PoteArchive(self.path)
+        self.assertEqual(s.cached(0, 10), [])
+        os.makedirs(self.path)
+        log_path = os.path.join(self.path, 'log.tmp')
+        for i in range(3):
+            with open(log_path, 'w') as fdescr:
+                fdescr.write('log%d' % i)
+            s.archive({'id': 'job%d' % i,
+                       'time': 100 + i,
+                       'envo': 0,
+                       'status': 'failed' if i == 1 else 'done',
+                       'cache_key': 'k'}, log_path)
+        s.archive({'id': 'copy', 'time': 200, 'envo': 0, 'status': 'done',
+                   'cache_key': 'k', 'cached': 'job2'})
+        self.assertEqual(s.cached(0, 10), [('k', 0, 'job2', 102),
+                                           ('k', 0, 'job0', 100)])
+        self.assertEqual(s.cached(101, 10), [('k', 0, 'job2', 102)])
+        (fdescr, size) = s.open_log('copy')
+        with fdescr:
+            self.assertEqual((fdescr.read(), size), ('log2', 4))
+
+    def test_pages(self):
+        """
+        Keyset pagination and filters.
+        """
+        jobs = [{'id': 'job%02d' % i,
+                 'time': 100 + i,
+                 'user': 'u%d' % (i % 2),
+                 'envo': i % 3,
+                 'status': 'done'} for i in range(10)]
+        s = pote.PoteArchive(self.path)
+        for job in reversed(jobs):
+            s.archive(job)
+        self.assertJobs(s, jobs)
+        self.assertEqual(s.dump(limit=3), jobs[7:])
+        self.assertEqual(s.dump(limit=3, before='job07'), jobs[4:7])
+        self.assertEqual(s.dump(limit=3, after='job02'), jobs[3:6])
+        self.assertEqual(s.dump(after='job02', before='job06'), jobs[3:6])
+        self.assertEqual(s.dump(user='u1'), jobs[1::2])
+        self.assertEqual(s.dump(envo=0, limit=2), [jobs[6], jobs[9]])
+        self.assertEqual(s.dump(status='failed'), [])
+        self.assertRaises(KeyError, s.dump, before='nope')
+        # the index is rebuilt from job directories
+        os.unlink(os.path.join(self.path, pote.archive.INDEX_NAME))
+        s = pote.PoteArchive(self.path)
+        self.assertJobs(s, jobs)
+
+    def test_log(self):
+        """
+        Test output is moved to the archive.
+        """
+        output_path = self.path + '-stdout.txt'
+        with open(output_path, 'w') as fdescr:
+            fdescr.write('output')
+        s = pote.PoteArchive(self.path)
+        s.archive({'id': 'aaaaaaa', 'time': 100}, output_path)
+        self.assertFalse(os.path.exists(output_path))
+        (fdescr, size) = s.open_log('aaaaaaa')
+        with fdescr:
+            self.assertEqual((fdescr.read(), size), ('output', 6))
+        self.assertEqual(s.open_log('bbbbbbb'), (None, None))
+
+    def test_compressed_log(self):
+        """
+        Big test output is compressed.
+        """
+        output_path = self.path + '-stdout.txt'
+        s = pote.PoteArchive(self.path, compress_threshold=10)
+        for job_id, output in (('aaaaaaa', 'small'), ('bbbbbbb', 'big' * 10)):
+            with open(output_path, 'w') as fdescr:
+                fdescr.write(output)
+            s.archive({'id': job_id, 'time': 100}, output_path)
+            (fdescr, size) = s.open_log(job_id)
+            with fdescr:
+                self.assertEqual((fdescr.read(), size), (output, len(output)))
+        # big outputs are compressed in the background
+        s.flush()
+        self.assertEqual(
+            [job['log'] for job in s.dump()],
+            [pote.archive.LOG_NAME, pote.archive.LOG_NAME + '.gz'])
+        self.assertEqual(sorted(os.listdir(os.path.join(s.path, 'bbbbbbb'))),
+                         ['meta', pote.archive.LOG_NAME + '.gz'])
+        (fdescr, size) = s.open_log('bbbbbbb')
+        with fdescr:
+            self.assertEqual((fdescr.read(), size), ('big' * 10, 30))
+
     def assertJobs(self, storage, jobs):
         """
         Make assertion for current test list.
@@ -0,0 +1,93 @@
+"""
+Unit test for cgroups of test processes.
+"""
+
+import logging
+import os
+import os.path
+import subprocess
+import unittest
+
+import pote.limits
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+# a cgroup v2 directory the test can create subgroups in
+CGROUP_PATH = os.environ.get(
+    'POTE_TEST_CGROUP', '/sys/fs/cgroup/unified/pote-test')
+
+
+class PoteCgroupsTest(unittest.TestCase):
+    """
+    Unit test for cgroups of test processes.
+    """
+
+    def setUp(self):
+        """
+        Test prepare recipes.
+        """
+        try:
+            self.cgroups = pote.limits.PoteCgroups(CGROUP_PATH)
+        except (IOError, OSError):
+            self.skipTest('no cgroup v2 at %r' % CGROUP_PATH)
+
+    def tearDown(self):
+        """
+        Test destroy recipes.
+        """
+        if os.path.isdir(CGROUP_PATH):
+            os.rmdir(CGROUP_PATH)
+
+    def test_remove(self):
+        """
+        Processes left in the cgroup are killed before it is removed.
+        """
+        cgroup = self.cgroups.create({})
+        # the test process exits and leaves a grandchild behind
+        subprocess.check_call(
+            ['sh', '-c', 'sleep 60 > /dev/null &'],
+            preexec_fn=lambda: self._enter(cgroup))
+        self.assertTrue(cgroup._is_populated())
+        self.cgroups.remove(cgroup)
+        self.assertFalse(os.path.exists(cgroup.path))
+        self.assertEqual(self.cgroups.leaked, [])
+
+    def test_leaked(self):
+        """
+        Removal of a busy cgroup is retried later.
+        """
+        cgroup = self.cgroups.create({})
+        # a child cgroup keeps the cgroup busy
+        os.mkdir(os.path.join(cgroup.path, 'child'))
+        self.cgroups.remove(cgroup)
+        self.assertEqual(self.cgroups.leaked, [cgroup])
+        os.rmdir(os.path.join(cgroup.path, 'child'))
+        self.cgroups.remove(self.cgroups.create({}))
+        self.assertFalse(os.path.exists(cgroup.path))
+        self.assertEqual(self.cgroups.leaked, [])
+
+    def test_clear(self):
+        """
+        Cgroups left by a dead process are killed and removed.
+        """
+        cgroups = [self.cgroups.create({}) for _index in range(2)]
+        for cgroup in cgroups:
+            subprocess.check_call(
+                ['sh', '-c', 'sleep 60 > /dev/null &'],
+                preexec_fn=lambda: self._enter(cgroup))
+        # a new instance knows nothing about the cgroups
+        pote.limits.PoteCgroups(CGROUP_PATH).clear()
+        for cgroup in cgroups:
+            self.assertFalse(os.path.exists(cgroup.path))
+
+    @staticmethod
+    def _enter(cgroup):
+        """
+        Move the calling process to the cgroup.
+
+        :param cgroup: cgroup of a test process
+        :type cgroup: pote.limits.PoteCgroup
+        """
+        with open(cgroup.procs_path, 'w') as fdescr:
+            fdescr.write(str(os.getpid()))
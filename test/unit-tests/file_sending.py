@@ -0,0 +1,79 @@
+"""
+Unit test for the sendfile(2) binding.
+"""
+
+import os
+import socket
+import threading
+import time
+import unittest
+
+import pote.sendfile
+
+
+class PoteSendfileTest(unittest.TestCase):
+    """
+    Unit test for the sendfile(2) binding.
+    """
+
+    path = 'file-sending.tmp'
+
+    def setUp(self):
+        """
+        Test prepare recipes.
+        """
+        # bigger than socket buffers, so the sender has to wait
+        self.data = os.urandom(4 * 1024 * 1024)
+        with open(self.path, 'wb') as fdescr:
+            fdescr.write(self.data)
+        (self.sender, self.receiver) = socket.socketpair()
+        self.sender.settimeout(5)
+        self.received = []
+
+    def tearDown(self):
+        """
+        Test destroy recipes.
+        """
+        self.sender.close()
+        self.receiver.close()
+        os.unlink(self.path)
+
+    def test_sendfile(self):
+        """
+        A part of the file is sent to a slow reader.
+        """
+        reader = threading.Thread(target=self._read)
+        reader.start()
+        with open(self.path, 'rb') as fdescr:
+            self.assertEqual(
+                pote.sendfile.sendfile(self.sender, fdescr, 1000, 2 ** 21),
+                2 ** 21)
+        self.sender.shutdown(socket.SHUT_WR)
+        reader.join()
+        self.assertEqual(''.join(self.received),
+                         self.data[1000:1000 + 2 ** 21])
+
+    def test_short_file(self):
+        """
+        No more than the rest of the file is sent.
+        """
+        reader = threading.Thread(target=self._read)
+        reader.start()
+        with open(self.path, 'rb') as fdescr:
+            self.assertEqual(
+                pote.sendfile.sendfile(
+                    self.sender, fdescr, len(self.data) - 10, 100), 10)
+        self.sender.shutdown(socket.SHUT_WR)
+        reader.join()
+        self.assertEqual(''.join(self.received), self.data[-10:])
+
+    def _read(self):
+        """
+        Read from the receiving socket until EOF, slowly.
+        """
+        while True:
+            chunk = self.receiver.recv(64 * 1024)
+            if not chunk:
+                return
+            self.received.append(chunk)
+            time.sleep(0.001)
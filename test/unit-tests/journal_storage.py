@@ -0,0 +1,78 @@
+"""
+Unit test for the Job Queue Journal.
+"""
+
+import logging
+import os
+import os.path
+import shutil
+import unittest
+
+import pote.journal
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class PoteJournalTest(unittest.TestCase):
+    """
+    Unit test for the Job Queue Journal.
+    """
+
+    path = 'journal-storage.tmp'
+
+    def tearDown(self):
+        """
+        Test destroy recipes.
+        """
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+    def test_unexistent(self):
+        """
+        Test journal without target directory.
+        """
+        s = pote.journal.PoteJournal(self.path)
+        self.assertFalse(s.exists())
+        self.assertEqual(s.load(), {})
+
+    def test_main(self):
+        """
+        Main journal test.
+        """
+        a = {'id': 'aaaaaaa',
+             'time': 200}
+        b = {'id': 'bbbbbbb',
+             'time': 100}
+        s = pote.journal.PoteJournal(self.path)
+        s.save(a)
+        s.save(b)
+        s.sync()
+        self.assertJobs([a, b])
+        b['status'] = 'running'
+        s.save(b)
+        s.remove(a['id'])
+        s.sync()
+        self.assertJobs([b])
+        # not compacted: the journal is too small
+        self.assertFalse(s.compact([b]))
+        self.assertTrue(s.compact([b], force=True))
+        self.assertEqual(s.records, 1)
+        s.save(a)
+        s.sync()
+        self.assertJobs([a, b])
+        # torn record at the end
+        with open(s.journal_path, 'a') as fdescr:
+            fdescr.write('{"job": {"id"')
+        self.assertJobs([a, b])
+
+    def assertJobs(self, jobs):
+        """
+        Make assertion for jobs replayed from the journal.
+
+        :param jobs: list of Job objects
+        :type jobs: list of dicts
+        """
+        self.assertEqual(
+            pote.journal.PoteJournal(self.path).load(),
+            {job['id']: job for job in jobs})
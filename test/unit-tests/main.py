@@ -2,10 +2,14 @@
 Main unit test.
 """
 
+import gzip
 import httplib
 import json
+import os
 import os.path
 import shutil
+import signal
+import StringIO
 import subprocess
 import time
 import unittest
@@ -26,26 +30,36 @@ class PoteMainTest(unittest.TestCase):
         self.log = open('poted.log', 'w')
         if os.path.isdir('poted'):
             shutil.rmtree('poted')
+        self._start()
+
+    def tearDown(self):
+        """
+        Test destroy recipes.
+        """
+        self.proc.kill()
+        self.proc.wait()
+        self.log.close()
+
+    def _start(self, *args):
+        """
+        Start the server.
+
+        :param args: extra command line arguments
+        :type args: list of strings
+        """
         self.proc = subprocess.Popen(
             ['../../bin/poted', '--verbose',
              '--envos', '3',
              '--envos-path', 'poted/envos',
              '--tests-path', '../../tests',
              '--queue-path', 'poted/tests',
-             '--archive-path', 'poted/archive'],
+             '--archive-path', 'poted/archive',
+             '--compress-logs', '30'] + list(args),
             stdout=self.log, stderr=self.log,
             env={'PYTHONPATH': '../../'}, close_fds=True)
         # wait until server starts
         time.sleep(2)
 
-    def tearDown(self):
-        """
-        Test destroy recipes.
-        """
-        self.proc.kill()
-        self.proc.wait()
-        self.log.close()
-
     def test_fast_tests(self):
         """
         Lightning fast tests.
@@ -137,6 +151,306 @@ class PoteMainTest(unittest.TestCase):
         self.assertIn('/archive', j2_id, STATUS_DONE)
         self.assertIn('/archive', j3_id, STATUS_DONE)
 
+    def test_any_envo(self):
+        """
+        Jobs enqueued to the 'any' group are spread across
+        all free environments.
+        """
+        self.assertEmpty('/job')
+        self.assertEmpty('/archive')
+        job_ids = [self._req('POST', '/job', {'user': 'u',
+                                              'envo': 'any',
+                                              'test': 'normal_good'})
+                   for _ in range(4)]
+        time.sleep(1)
+        jobs = self._req('GET', '/job')
+        self.assertEqual(
+            sorted(job['envo'] for job in jobs
+                   if job['status'] == STATUS_RUNNING), [0, 1, 2])
+        time.sleep(5)
+        self.assertIn('/job', job_ids[3], STATUS_RUNNING)
+        time.sleep(6)
+        self.assertEmpty('/job')
+        for job_id in job_ids:
+            self.assertIn('/archive', job_id, STATUS_DONE)
+
+    def test_batch(self):
+        """
+        Jobs submitted with one request.
+        """
+        self.assertIsNone(self._req('POST', '/jobs', [
+            {'user': 'u', 'envo': 0, 'test': 'fast_good'},
+            {'user': 'u', 'envo': 0, 'test': 'no_such_test'}]))
+        self.assertEmpty('/job')
+        job_ids = self._req('POST', '/jobs', [
+            {'user': 'u', 'envo': 0, 'test': 'fast_good'},
+            {'user': 'u', 'envo': 1, 'test': 'fast_bad',
+             'max_duration': 5},
+            {'user': 'u', 'envo': 0, 'test': 'fast_good'}])
+        self.assertEqual(len(job_ids), 3)
+        time.sleep(2)
+        self.assertEmpty('/job')
+        self.assertIn('/archive', job_ids[0], STATUS_DONE)
+        self.assertIn('/archive', job_ids[1], STATUS_FAILED)
+        self.assertIn('/archive', job_ids[2], STATUS_DONE)
+        # the batch order is kept
+        jobs = {job['id']: job for job in self._req('GET', '/archive')}
+        self.assertEqual(
+            sorted(job_ids, key=lambda job_id: jobs[job_id]['time']),
+            job_ids)
+
+    def test_conditional(self):
+        """
+        Unchanged job lists are not sent again, big ones are gzipped.
+        """
+        for url in ('/job', '/archive', '/test'):
+            (status, headers, _data) = self._get(url)
+            self.assertEqual(status, 200)
+            (status, _headers, data) = self._get(
+                url, {'If-None-Match': headers['etag']})
+            self.assertEqual((status, data), (304, ''))
+        (_status, headers, _data) = self._get('/job')
+        job_ids = self._req('POST', '/jobs', [
+            {'user': 'u', 'envo': 2, 'test': 'normal_good'}] * 10)
+        (status, headers, data) = self._get(
+            '/job', {'If-None-Match': headers['etag'],
+                     'Accept-Encoding': 'gzip'})
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        data = gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
+        self.assertEqual(
+            sorted(job['id'] for job in json.loads(data)), sorted(job_ids))
+
+    def test_shortest_first(self):
+        """
+        Jobs of the shortest tests are run first.
+        """
+        self.proc.kill()
+        self.proc.wait()
+        self._start('--dispatch-policy', 'sjf')
+        # learn durations of the tests
+        self._req('POST', '/job', {'user': 'u',
+                                   'envo': 0,
+                                   'test': 'fast_good'})
+        time.sleep(1)
+        self._req('POST', '/job', {'user': 'u',
+                                   'envo': 0,
+                                   'test': 'normal_good'})
+        time.sleep(6)
+        self.assertEmpty('/job')
+        (j1_id, j2_id, j3_id) = self._req('POST', '/jobs', [
+            {'user': 'u', 'envo': 0, 'test': 'normal_good'},
+            {'user': 'u', 'envo': 0, 'test': 'normal_good'},
+            {'user': 'u', 'envo': 0, 'test': 'fast_good'}])
+        time.sleep(6.5)
+        self.assertIn('/archive', j1_id, STATUS_DONE)
+        self.assertIn('/archive', j3_id, STATUS_DONE)
+        self.assertIn('/job', j2_id, STATUS_RUNNING)
+
+    def test_fair_share(self):
+        """
+        Jobs of higher priority, then jobs of less loaded users
+        are run first.
+        """
+        self.proc.kill()
+        self.proc.wait()
+        self._start('--fair-share')
+        self.assertIsNone(self._req('POST', '/job', {'user': 'u',
+                                                     'envo': 0,
+                                                     'test': 'fast_good',
+                                                     'priority': 100}))
+        self._req('POST', '/job', {'user': 'bulk',
+                                   'envo': 0,
+                                   'test': 'normal_good'})
+        time.sleep(1)
+        (j1_id, j2_id, j3_id) = self._req('POST', '/jobs', [
+            {'user': 'bulk', 'envo': 0, 'test': 'normal_good'},
+            {'user': 'alice', 'envo': 0, 'test': 'fast_good'},
+            {'user': 'bulk', 'envo': 0, 'test': 'normal_good',
+             'priority': 1}])
+        time.sleep(10.5)
+        self.assertIn('/archive', j3_id, STATUS_DONE)
+        self.assertIn('/archive', j2_id, STATUS_DONE)
+        self.assertIn('/job', j1_id, STATUS_RUNNING)
+        usage = self._req('GET', '/usage')
+        self.assertGreater(usage['bulk'], usage['alice'])
+
+    def test_cache(self):
+        """
+        Results of successful jobs are reused.
+        """
+        self.proc.kill()
+        self.proc.wait()
+        self._start('--cache-ttl', '60')
+        j1_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 0,
+                                           'test': 'fast_good'})
+        time.sleep(1)
+        self.assertIn('/archive', j1_id, STATUS_DONE)
+        j2_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 0,
+                                           'test': 'fast_good'})
+        self.assertIn('/archive', j2_id, STATUS_DONE)
+        jobs = self._req('GET', '/archive')
+        self.assertEqual([job.get('cached') for job in jobs],
+                         [None, j1_id])
+        self.assertEqual(self._log(j2_id)[1], self._log(j1_id)[1])
+        # another envo, opted out and nondeterministic tests run
+        j3_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 1,
+                                           'test': 'fast_good'})
+        j4_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 0,
+                                           'test': 'fast_good',
+                                           'cache': False})
+        for _ in range(2):
+            self._req('POST', '/job', {'user': 'u',
+                                       'envo': 2,
+                                       'test': 'fast_random'})
+            time.sleep(1)
+        jobs = self._req('GET', '/archive')
+        self.assertEqual([job.get('cached') for job in jobs],
+                         [None, j1_id, None, None, None, None])
+
+    def test_warden_processes(self):
+        """
+        Wardens run in processes, which are restarted when they die.
+        """
+        self.proc.kill()
+        self.proc.wait()
+        self._start('--warden-processes', '2')
+        j1_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 0,
+                                           'test': 'normal_good'})
+        j2_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 2,
+                                           'test': 'fast_good'})
+        time.sleep(1)
+        self.assertIn('/archive', j2_id, STATUS_DONE)
+        self.assertEqual(self._log(j1_id)[1], '__main__: warning\n')
+        (test_pid, ) = self._pids('python', '-m', 'normal_good')
+        # kill the process with the warden of envo #0
+        for pid in self._pids('python', '-m', 'pote.agent'):
+            with open('/proc/%d/cmdline' % pid) as fdescr:
+                if 'worker#0' in fdescr.read():
+                    os.kill(pid, signal.SIGKILL)
+        killed = time.time()
+        time.sleep(1)
+        # the test of the killed process is killed too
+        self.assertFalse(
+            test_pid in self._pids('python', '-m', 'normal_good'))
+        time.sleep(7)
+        (job, ) = [job for job in self._req('GET', '/archive')
+                   if job['id'] == j1_id]
+        self.assertEqual(job['status'], STATUS_DONE)
+        self.assertGreater(job['started'], killed)
+
+    def test_events(self):
+        """
+        Job state changes are pushed to long-poll clients.
+        """
+        reply = self._req('GET', '/events')
+        self.assertTrue(reply['reset'])
+        cursor = reply['cursor']
+        j1_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 0,
+                                           'test': 'fast_good'})
+        changes = []
+        while not changes or changes[-1] != ('archive', STATUS_DONE):
+            reply = self._req('GET', '/events?timeout=5&cursor=' + cursor)
+            self.assertFalse(reply['reset'])
+            self.assertTrue(reply['events'])
+            cursor = reply['cursor']
+            for event in reply['events']:
+                self.assertEqual(event['job']['id'], j1_id)
+                changes.append((event['type'], event['job']['status']))
+        self.assertEqual(changes[0], ('job', STATUS_ENQUEUED))
+        self.assertTrue(('job', STATUS_RUNNING) in changes)
+        # nothing happens: the request is held until the timeout
+        started = time.time()
+        reply = self._req('GET', '/events?timeout=1&cursor=' + cursor)
+        self.assertEqual(reply['events'], [])
+        self.assertGreaterEqual(time.time() - started, 1)
+
+    def test_metrics(self):
+        """
+        Metrics of the daemon in the text exposition format.
+        """
+        j1_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 1,
+                                           'test': 'fast_good'})
+        time.sleep(1)
+        self.assertIn('/archive', j1_id, STATUS_DONE)
+        (status, headers, metrics) = self._get('/metrics')
+        self.assertEqual(status, 200)
+        self.assertTrue(headers['content-type'].startswith('text/plain'))
+        lines = metrics.splitlines()
+        for line in ['# TYPE pote_job_run_seconds histogram',
+                     'pote_job_run_seconds_count 1',
+                     'pote_jobs_archived_total{status="done"} 1',
+                     'pote_warden_job_seconds_count 1',
+                     'pote_archive_write_seconds_count 1',
+                     'pote_http_request_seconds_count'
+                     '{method="POST",route="job"} 1',
+                     'pote_envo_busy{envo="1"} 0',
+                     'pote_envo_pending_jobs{envo="2"} 0',
+                     'pote_envo_utilization 0.0']:
+            self.assertTrue(line in lines, line)
+        j2_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 2,
+                                           'test': 'normal_good'})
+        time.sleep(0.5)
+        lines = self._get('/metrics')[2].splitlines()
+        self.assertTrue('pote_envo_busy{envo="2"} 1' in lines)
+        self.assertTrue('pote_http_request_seconds_count'
+                        '{method="GET",route="metrics"} 1' in lines)
+        self.assertIn('/job', j2_id, STATUS_RUNNING)
+
+    def test_log(self):
+        """
+        Output of running and finished jobs.
+        """
+        j1_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 0,
+                                           'test': 'normal_good'})
+        time.sleep(1)
+        (headers, log) = self._log(j1_id)
+        self.assertEqual(headers['x-pote-complete'], '0')
+        # stdout of the test is block-buffered, stderr is not
+        self.assertEqual(log, '__main__: warning\n')
+        offset = headers['x-pote-offset']
+        (headers, log) = self._log(j1_id, 'follow=1&offset=' + offset)
+        self.assertEqual(log, '__main__ started\n__main__ done\n')
+        time.sleep(1)
+        (headers, log) = self._log(j1_id, 'offset=' + offset)
+        self.assertEqual(headers['x-pote-complete'], '1')
+        self.assertEqual(log, '__main__ started\n__main__ done\n')
+        # the archived output is big enough to be compressed
+        (headers, log) = self._log(
+            j1_id, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(
+            gzip.GzipFile(fileobj=StringIO.StringIO(log)).read(),
+            '__main__: warning\n__main__ started\n__main__ done\n')
+
+    def test_limits(self):
+        """
+        Resource limits and usage.
+        """
+        self.assertIsNone(self._req('POST', '/job', {'user': 'u',
+                                                     'envo': 0,
+                                                     'test': 'fast_good',
+                                                     'limits': {'x': 1}}))
+        j1_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 0,
+                                           'test': 'fast_good',
+                                           'limits': {'cpu': 5}})
+        time.sleep(1)
+        self.assertIn('/archive', j1_id, STATUS_DONE)
+        (job, ) = self._req('GET', '/archive?limit=1')
+        self.assertEqual(job['limits'], {'cpu': 5})
+        self.assertTrue('maxrss' in job['usage'])
+
     def assertEmpty(self, url):
         """
         Assert job list is empty.
@@ -187,6 +501,74 @@ class PoteMainTest(unittest.TestCase):
                 break
         self.assertFalse(found)
 
+    def _pids(self, *args):
+        """
+        Return IDs of live processes with the command line
+        starting with the arguments.
+
+        :param args: command line arguments
+        :type args: list of strings
+
+        :rtype: list of integers
+        """
+        result = []
+        for pid in os.listdir('/proc'):
+            try:
+                with open('/proc/%s/cmdline' % pid) as fdescr:
+                    cmdline = fdescr.read().split('\0')
+                with open('/proc/%s/stat' % pid) as fdescr:
+                    state = fdescr.read().rpartition(')')[2].split()[0]
+            except IOError:
+                continue
+            if state != 'Z' and tuple(cmdline[:len(args)]) == args:
+                result.append(int(pid))
+        return result
+
+    def _log(self, job_id, query='', headers=None):
+        """
+        Fetch output of the job. Return response headers
+        and the output itself.
+
+        :param job_id: job unique identifier
+        :type job_id: string
+
+        :param query: URL query string
+        :type query: string
+
+        :param headers: extra request headers
+        :type headers: NoneType or dict
+
+        :rtype: tuple of (dict, string)
+        """
+        connection = httplib.HTTPConnection('127.1', 8901)
+        connection.request('GET', '/job/%s/log?%s' % (job_id, query),
+                           headers=headers or {})
+        reply = connection.getresponse()
+        self.assertEqual(reply.status, 200)
+        result = (dict(reply.getheaders()), reply.read())
+        connection.close()
+        return result
+
+    def _get(self, url, headers=None):
+        """
+        Make HTTP GET request to the RESTful Pote server.
+        Return response status, headers and entity.
+
+        :param url: URL
+        :type url: string
+
+        :param headers: extra request headers
+        :type headers: NoneType or dict
+
+        :rtype: tuple of (integer, dict, string)
+        """
+        connection = httplib.HTTPConnection('127.1', 8901)
+        connection.request('GET', url, headers=headers or {})
+        reply = connection.getresponse()
+        result = (reply.status, dict(reply.getheaders()), reply.read())
+        connection.close()
+        return result
+
     def _req(self, method, url, body=None):
         """
         Make HTTP request to the RESTful Pote server.
@@ -0,0 +1,66 @@
+"""
+Unit test for the registry of metrics.
+"""
+
+import unittest
+
+import pote.metrics
+
+
+class PoteMetricsTest(unittest.TestCase):
+    """
+    Unit test for the registry of metrics.
+    """
+
+    def test_counter(self):
+        """
+        Counters are rendered by label sets.
+        """
+        m = pote.metrics.PoteMetrics()
+        m.counter('x_total', 'Some "x"\nthings')
+        self.assertEqual(
+            m.render(),
+            '# HELP x_total Some "x"\\nthings\n'
+            '# TYPE x_total counter\n')
+        m.inc('x_total', kind='a')
+        m.inc('x_total', 2, kind='b"')
+        m.inc('x_total', kind='a')
+        self.assertEqual(
+            m.render().splitlines()[2:],
+            ['x_total{kind="a"} 2',
+             'x_total{kind="b\\""} 2'])
+
+    def test_histogram(self):
+        """
+        Histogram buckets are cumulative.
+        """
+        m = pote.metrics.PoteMetrics()
+        m.histogram('y_seconds', 'Y', (0.5, 1))
+        for value in (0.1, 0.5, 0.7, 3):
+            m.observe('y_seconds', value)
+        self.assertEqual(
+            m.render().splitlines()[2:],
+            ['y_seconds_bucket{le="0.5"} 2',
+             'y_seconds_bucket{le="1"} 3',
+             'y_seconds_bucket{le="+Inf"} 4',
+             'y_seconds_sum 4.3',
+             'y_seconds_count 4'])
+
+    def test_gauges(self):
+        """
+        Gauges are rendered after the registered metrics.
+        """
+        m = pote.metrics.PoteMetrics()
+        m.counter('x_total', 'X')
+        m.inc('x_total')
+        self.assertEqual(
+            m.render([('z', 'Z', [({'envo': '0'}, 1),
+                                  ({'envo': '1'}, 0.5)])]),
+            '# HELP x_total X\n'
+            '# TYPE x_total counter\n'
+            'x_total 1\n'
+            '# HELP z Z\n'
+            '# TYPE z gauge\n'
+            'z{envo="0"} 1\n'
+            'z{envo="1"} 0.5\n')
+
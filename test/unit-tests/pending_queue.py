@@ -0,0 +1,61 @@
+"""
+Unit test for the queue of jobs waiting for an envo.
+"""
+
+import unittest
+
+import pote.pending
+
+
+class PotePendingQueueTest(unittest.TestCase):
+    """
+    Unit test for the queue of jobs waiting for an envo.
+    """
+
+    def test_order(self):
+        """
+        Jobs are kept in the arrival order.
+        """
+        q = pote.pending.PotePendingQueue()
+        for job_id in ('a', 'b', 'c'):
+            q.append(job_id, None, (0, job_id))
+        q.append('z', None, (0, 'z'), left=True)
+        q.remove('b')
+        self.assertEqual(len(q), 3)
+        self.assertEqual(list(q), ['z', 'a', 'c'])
+        self.assertEqual(list(reversed(q)), ['c', 'a', 'z'])
+        self.assertEqual(q.first(), 'z')
+        self.assertEqual(q.prioritized, 0)
+        for job_id in ('z', 'a', 'c'):
+            q.remove(job_id)
+        self.assertIsNone(q.first())
+
+    def test_heads(self):
+        """
+        The best job of every user is found by its actual key.
+        """
+        keys = {'a': (0, 3), 'b': (-1, 5), 'c': (0, 1), 'd': (0, 2)}
+        q = pote.pending.PotePendingQueue()
+        for job_id in sorted(keys):
+            q.append(job_id, 'u1' if job_id < 'c' else 'u2', keys[job_id])
+        self.assertEqual(q.prioritized, 1)
+        self.assertEqual(sorted(q.heads(keys.get)),
+                         [('u1', (-1, 5), 'b'), ('u2', (0, 1), 'c')])
+        q.remove('b')
+        # the key of a job changed since it was enqueued
+        keys['c'] = (0, 4)
+        self.assertEqual(sorted(q.heads(keys.get)),
+                         [('u1', (0, 3), 'a'), ('u2', (0, 2), 'd')])
+        self.assertEqual(q.prioritized, 0)
+
+    def test_compact(self):
+        """
+        Stale entries of removed jobs are dropped.
+        """
+        q = pote.pending.PotePendingQueue()
+        for index in range(1000):
+            q.append(index, None, (0, index))
+            q.remove(index)
+        self.assertLess(len(q.order), 2 * pote.pending.STALE_SLACK)
+        self.assertLess(q.entries, 2 * pote.pending.STALE_SLACK)
+        self.assertEqual(q.heads(lambda job_id: (0, job_id)), [])
@@ -0,0 +1,48 @@
+"""
+Unit test for the test process supervisor.
+"""
+
+import logging
+import time
+import unittest
+
+import pote.supervisor
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+# the supervisor reaps all child processes, so there must be
+# only one instance per process
+SUPERVISOR = pote.supervisor.PoteSupervisor()
+SUPERVISOR.start()
+
+
+class PoteSupervisorTest(unittest.TestCase):
+    """
+    Unit test for the test process supervisor.
+    """
+
+    supervisor = SUPERVISOR
+
+    def test_exit(self):
+        """
+        Process exit is detected without polling delays.
+        """
+        proc = self.supervisor.popen(['sleep', '0.1'])
+        started = time.time()
+        (stopped, killed) = self.supervisor.watch(proc, started + 10)
+        self.assertFalse(killed)
+        self.assertEqual(proc.returncode, 0)
+        self.assertLess(stopped - started, 0.3)
+        self.assertIn('ru_maxrss', proc.rusage)
+
+    def test_deadline(self):
+        """
+        Process is killed when its deadline passes.
+        """
+        proc = self.supervisor.popen(['sleep', '10'])
+        started = time.time()
+        (stopped, killed) = self.supervisor.watch(proc, started + 0.2)
+        self.assertTrue(killed)
+        self.assertIsNotNone(proc.returncode)
+        self.assertLess(stopped - started, 1)
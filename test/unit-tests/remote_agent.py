@@ -0,0 +1,253 @@
+"""
+Unit test for remote warden agents.
+"""
+
+import httplib
+import json
+import os.path
+import shutil
+import socket
+import subprocess
+import threading
+import time
+import unittest
+
+import pote.agent
+
+
+STATUS_ENQUEUED = 'enqueued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+
+
+class PoteRemoteAgentTest(unittest.TestCase):
+    """
+    Unit test for remote warden agents.
+    """
+
+    def setUp(self):
+        """
+        Test prepare recipes.
+        """
+        self.log = open('poted.log', 'w')
+        with open('agent.token', 'w') as fdescr:
+            fdescr.write('secret\n')
+        for path in ('poted', 'agent'):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+        self.proc = subprocess.Popen(
+            ['../../bin/poted', '--verbose',
+             '--envos', '1',
+             '--envos-path', 'poted/envos',
+             '--tests-path', '../../tests',
+             '--queue-path', 'poted/tests',
+             '--archive-path', 'poted/archive',
+             '--agent-port', '8902',
+             '--agent-token-file', 'agent.token'],
+            stdout=self.log, stderr=self.log,
+            env={'PYTHONPATH': '../../'}, close_fds=True)
+        # wait until server starts
+        time.sleep(2)
+        self.agent = None
+        self._start_agent()
+
+    def tearDown(self):
+        """
+        Test destroy recipes.
+        """
+        for proc in (self.agent, self.proc):
+            proc.kill()
+            proc.wait()
+        self.log.close()
+        os.unlink('agent.token')
+
+    def test_remote_jobs(self):
+        """
+        Jobs are run by the agent.
+        """
+        self.assertEqual(self._req('GET', '/envo'), 3)
+        j1_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 1,
+                                           'test': 'fast_good'})
+        j2_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 2,
+                                           'test': 'fast_bad'})
+        time.sleep(1)
+        jobs = dict((job['id'], job) for job in self._req('GET', '/archive'))
+        self.assertEqual(jobs[j1_id]['status'], STATUS_DONE)
+        self.assertNotIn('reason', jobs[j1_id])
+        self.assertEqual(jobs[j2_id]['reason'], 'exit code 1')
+        connection = httplib.HTTPConnection('127.1', 8901)
+        connection.request('GET', '/job/%s/log' % j1_id)
+        reply = connection.getresponse()
+        self.assertEqual(reply.status, 200)
+        self.assertEqual(
+            reply.read(),
+            '__main__: warning\n__main__ started\n__main__ done\n')
+
+    def test_live_log(self):
+        """
+        Output of a job running on an agent is not read
+        from the daemon side.
+        """
+        os.makedirs('poted/envos/1')
+        with open('poted/envos/1/stdout.txt', 'w') as fdescr:
+            fdescr.write('stale output')
+        j1_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 1,
+                                           'test': 'normal_good'})
+        time.sleep(1)
+        (job, ) = self._req('GET', '/job')
+        self.assertEqual(job['status'], STATUS_RUNNING)
+        connection = httplib.HTTPConnection('127.1', 8901)
+        connection.request('GET', '/job/%s/log' % j1_id)
+        reply = connection.getresponse()
+        reply.read()
+        self.assertEqual(reply.status, 404)
+
+    def test_agent_lost(self):
+        """
+        Jobs of a lost agent are re-queued and run when
+        the agent comes back.
+        """
+        j1_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 2,
+                                           'test': 'normal_good'})
+        time.sleep(1)
+        self.agent.kill()
+        self.agent.wait()
+        time.sleep(1)
+        (job, ) = self._req('GET', '/job')
+        self.assertEqual((job['id'], job['status']),
+                         (j1_id, STATUS_ENQUEUED))
+        # jobs to groups go to envos alive
+        j2_id = self._req('POST', '/job', {'user': 'u',
+                                           'envo': 'any',
+                                           'test': 'fast_good'})
+        time.sleep(1)
+        self.assertEqual([job['id'] for job in self._req('GET', '/archive')],
+                         [j2_id])
+        self._start_agent()
+        self.assertEqual(self._req('GET', '/envo'), 3)
+        time.sleep(6)
+        (job, ) = [job for job in self._req('GET', '/archive')
+                   if job['id'] == j1_id]
+        self.assertEqual((job['envo'], job['status']), (2, STATUS_DONE))
+
+    def _start_agent(self):
+        """
+        Start the agent with two envos and wait until it joins.
+        """
+        self.agent = subprocess.Popen(
+            ['../../bin/pote-agent', '--verbose',
+             '127.1:8902',
+             '--name', 'a1',
+             '--envos', '2',
+             '--envos-path', 'agent/envos',
+             '--tests-path', '../../tests',
+             '--token-file', 'agent.token'],
+            stdout=self.log, stderr=self.log,
+            env={'PYTHONPATH': '../../'}, close_fds=True)
+        time.sleep(1)
+
+    def _req(self, method, url, body=None):
+        """
+        Make HTTP request to the RESTful Pote server.
+        Return response entity, decoded from JSON.
+
+        :param method: HTTP method to use
+        :type method: 'GET' or 'POST'
+
+        :param url: URL
+        :type url: string
+
+        :param body: request entity (will be encoded as JSON)
+        :type body: any or NoneType
+
+        :rtype: any
+        """
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers = {'content-type': 'application/json'}
+        connection = httplib.HTTPConnection('127.1', 8901)
+        connection.request(method, url, body, headers)
+        reply = connection.getresponse()
+        self.assertLess(reply.status, 300)
+        data = reply.read()
+        connection.close()
+        if reply.status == 204:
+            return None
+        return json.loads(data)
+
+
+class PoteAgentLinkTest(unittest.TestCase):
+    """
+    Unit test for the daemon side of an agent connection.
+    """
+
+    def test_token(self):
+        """
+        An agent with a wrong token is rejected.
+        """
+        joined = []
+
+        class Scheduler(object):
+
+            def notify_agent_joined(self, name, envos_count, link):
+                joined.append(name)
+
+            def notify_agent_lost(self, link):
+                pass
+
+        for token, expected in (('bad', []), ('secret', ['a1'])):
+            (sock, peer) = socket.socketpair()
+            pote.agent.PoteAgentLink.running(
+                Scheduler(), sock, 'test', token='secret')
+            peer.settimeout(1)
+            peer.sendall(json.dumps(
+                {'hello': 'a1', 'envos': 1, 'token': token}) + '\n')
+            try:
+                # the connection is closed at once for a bad token
+                self.assertEqual(peer.recv(1), '')
+            except socket.timeout:
+                pass
+            self.assertEqual(joined, expected)
+            peer.close()
+
+    def test_hung_agent(self):
+        """
+        An agent which does not read does not hold the scheduler
+        and is reported lost.
+        """
+        joined = threading.Event()
+        lost = threading.Event()
+
+        class Scheduler(object):
+
+            def notify_agent_joined(self, name, envos_count, link):
+                link.registered([0])
+                joined.set()
+
+            def notify_agent_lost(self, link):
+                lost.set()
+
+        (sock, peer) = socket.socketpair()
+        link = pote.agent.PoteAgentLink.running(Scheduler(), sock, 'test')
+        try:
+            peer.sendall(json.dumps({'hello': 'a1', 'envos': 1}) + '\n')
+            joined.wait(5)
+            self.assertTrue(joined.is_set())
+            started = time.time()
+            # much more than the socket buffers can take
+            for index in range(64):
+                self.assertTrue(link.execute(
+                    {'id': str(index), 'envo': 0, 'data': 'x' * 2 ** 16},
+                    'stdout.txt'))
+            self.assertLess(time.time() - started, 1)
+            # the send times out long before the heartbeat timeout
+            lost.wait(pote.agent.HEARTBEAT_TIMEOUT - 1)
+            self.assertTrue(lost.is_set())
+            self.assertFalse(link.execute({'id': 'z', 'envo': 0}, None))
+        finally:
+            peer.close()
@@ -0,0 +1,281 @@
+"""
+Unit test for the HTTP/1.1 RESTful server with a pool of workers.
+"""
+
+import httplib
+import json
+import os.path
+import shutil
+import socket
+import SocketServer
+import subprocess
+import threading
+import time
+import unittest
+
+import pote.pool
+import pote.rest
+
+
+class PotePooledServerTest(unittest.TestCase):
+    """
+    Unit test for the HTTP/1.1 RESTful server with a pool of workers.
+    """
+
+    def setUp(self):
+        """
+        Test prepare recipes.
+        """
+        self.log = open('poted.log', 'w')
+        if os.path.isdir('poted'):
+            shutil.rmtree('poted')
+        self.proc = subprocess.Popen(
+            ['../../bin/poted', '--verbose',
+             '--envos', '2',
+             '--envos-path', 'poted/envos',
+             '--tests-path', '../../tests',
+             '--queue-path', 'poted/tests',
+             '--archive-path', 'poted/archive',
+             '--http-workers', '2'],
+            stdout=self.log, stderr=self.log,
+            env={'PYTHONPATH': '../../'}, close_fds=True)
+        # wait until server starts
+        time.sleep(2)
+
+    def tearDown(self):
+        """
+        Test destroy recipes.
+        """
+        self.proc.kill()
+        self.proc.wait()
+        self.log.close()
+
+    def test_keep_alive(self):
+        """
+        Requests are served over the same connection.
+        """
+        connection = httplib.HTTPConnection('127.1', 8901)
+        self.assertEqual(self._req(connection, 'GET', '/ping'), None)
+        sock = connection.sock
+        self.assertIsNotNone(sock)
+        self.assertEqual(self._req(connection, 'GET', '/envo'), 2)
+        self.assertIn('fast_good', self._req(connection, 'GET', '/test'))
+        job_id = self._req(connection, 'POST', '/job',
+                           {'user': 'u', 'envo': 0, 'test': 'normal_good'})
+        jobs = self._req(connection, 'GET', '/job')
+        self.assertEqual([job['id'] for job in jobs], [job_id])
+        self.assertIs(connection.sock, sock)
+        connection.close()
+
+    def test_chunked_request(self):
+        """
+        Request entity is sent with chunked transfer encoding.
+        """
+        body = json.dumps({'user': 'u', 'envo': 1, 'test': 'fast_good'})
+        sock = socket.create_connection(('127.1', 8901))
+        sock.sendall(
+            'POST /job HTTP/1.1\r\n'
+            'Host: localhost\r\n'
+            'Content-Type: application/json\r\n'
+            'Transfer-Encoding: chunked\r\n\r\n'
+            '%x\r\n%s\r\n%x\r\n%s\r\n0\r\n\r\n' %
+            (5, body[:5], len(body) - 5, body[5:]))
+        reply = httplib.HTTPResponse(sock)
+        reply.begin()
+        self.assertEqual(reply.status, 201)
+        job_id = json.loads(reply.read())
+        sock.close()
+        connection = httplib.HTTPConnection('127.1', 8901)
+        jobs = self._req(connection, 'GET', '/job') + \
+            self._req(connection, 'GET', '/archive')
+        self.assertIn(job_id, [job['id'] for job in jobs])
+
+    def test_streams(self):
+        """
+        Streams and idle connections do not hold workers.
+        """
+        streams = []
+        for _ in range(3):
+            connection = httplib.HTTPConnection('127.1', 8901)
+            connection.request('GET', '/events',
+                               headers={'Accept': 'text/event-stream'})
+            reply = connection.getresponse()
+            self.assertEqual(reply.getheader('Transfer-Encoding'),
+                             'chunked')
+            streams.append((connection, reply))
+        idle = []
+        for _ in range(3):
+            connection = httplib.HTTPConnection('127.1', 8901)
+            self.assertEqual(self._req(connection, 'GET', '/envo'), 2)
+            idle.append(connection)
+        connection = httplib.HTTPConnection('127.1', 8901)
+        job_id = self._req(connection, 'POST', '/job',
+                           {'user': 'u', 'envo': 0, 'test': 'fast_good'})
+        for connection, reply in streams:
+            connection.sock.settimeout(5)
+            chunk_size = int(reply.fp.readline(), 16)
+            self.assertIn(job_id, reply.fp.read(chunk_size))
+        for connection in idle:
+            self.assertEqual(self._req(connection, 'GET', '/envo'), 2)
+
+    def _req(self, connection, method, url, body=None):
+        """
+        Make HTTP request over the connection.
+        Return response entity, decoded from JSON.
+
+        :param connection: connection to the RESTful Pote server
+        :type connection: httplib.HTTPConnection
+
+        :param method: HTTP method to use
+        :type method: 'GET' or 'POST'
+
+        :param url: URL
+        :type url: string
+
+        :param body: request entity (will be encoded as JSON)
+        :type body: any or NoneType
+
+        :rtype: any
+        """
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers = {'content-type': 'application/json'}
+        connection.request(method, url, body, headers)
+        reply = connection.getresponse()
+        self.assertLess(reply.status, 300)
+        data = reply.read()
+        if reply.status == 204:
+            return None
+        return json.loads(data)
+
+
+class PotePoolTest(unittest.TestCase):
+    """
+    Unit test for the pool of workers.
+    """
+
+    def test_max_detached(self):
+        """
+        Requests past the limit of detached ones are refused.
+        """
+        release = threading.Event()
+
+        class Handler(SocketServer.StreamRequestHandler):
+
+            def handle(self):
+                detached = self.server.detach()
+                self.wfile.write('%d\n' % detached)
+                self.wfile.flush()
+                if detached:
+                    release.wait(5)
+
+        class Server(pote.pool.PotePoolMixIn, SocketServer.TCPServer):
+            allow_reuse_address = True
+            workers = 1
+            max_detached = 2
+
+            def __init__(self, *args):
+                SocketServer.TCPServer.__init__(self, *args)
+
+        server = Server(('127.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            self.assertEqual([self._detach(server) for _ in range(3)],
+                             ['1', '1', '0'])
+            release.set()
+            # detached workers exit when their requests are done
+            for _ in range(50):
+                if not server._detached:
+                    break
+                time.sleep(0.1)
+            self.assertEqual(self._detach(server), '1')
+        finally:
+            release.set()
+            server.shutdown()
+            thread.join(5)
+            server.server_close()
+
+    def _detach(self, server):
+        """
+        Make a request to the server. Return its reply.
+
+        :param server: the server
+        :type server: pote.pool.PotePoolMixIn
+
+        :rtype: string
+        """
+        sock = socket.create_connection(server.server_address)
+        sock.settimeout(5)
+        try:
+            return sock.makefile().readline().strip()
+        finally:
+            sock.close()
+
+
+class PoteLiveLogTest(unittest.TestCase):
+    """
+    Unit test for reading output of running jobs.
+    """
+
+    path = 'rest-pool-stdout.tmp'
+
+    def tearDown(self):
+        """
+        Test destroy recipes.
+        """
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def test_next_job(self):
+        """
+        Output of the next job of the envo is not taken for output
+        of the archived one.
+        """
+        test = self
+        calls = []
+
+        class Scheduler(object):
+
+            def live_log(self, job_id):
+                calls.append(job_id)
+                if len(calls) == 2:
+                    # the job is archived and the envo starts another
+                    os.unlink(test.path)
+                    test._write('next job')
+                return test.path
+
+        class Archive(object):
+
+            def open_log(self, job_id):
+                return 'archived', 8
+
+        class Server(object):
+            scheduler = Scheduler()
+            archive = Archive()
+
+        class Handler(pote.rest.PoteApiServerHandler):
+
+            def __init__(self, server):
+                self.server = server
+
+        handler = Handler(Server())
+        self._write('job')
+        self.assertEqual(handler._open_log('j1'), ('archived', 8, True))
+        # the file is not replaced any more
+        (fdescr, size, complete) = handler._open_log('j1')
+        with fdescr:
+            self.assertEqual((fdescr.read(), size, complete),
+                             ('next job', 8, False))
+
+    def _write(self, data):
+        """
+        Write the output file.
+
+        :param data: file contents
+        :type data: string
+        """
+        with open(self.path, 'w') as fdescr:
+            fdescr.write(data)
@@ -2,6 +2,7 @@
 Unit test for the Test Storage interface.
 """
 
+import json
 import logging
 import os
 import os.path
@@ -12,6 +13,7 @@ import unittest
 import pote
 import pote.tests
 pote.tests.REFRESH_PERIOD = 1  # decrease period to one second
+pote.tests.POLL_PERIOD = 0.5
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -56,6 +58,104 @@ class PoteTestStorageTest(unittest.TestCase):
         self._populate(['z/__init__.py', 'a/b.py'])
         self.assertMods(s, ['z'])
 
+    def test_limits(self):
+        """
+        Resource limits of tests.
+        """
+        s = pote.PoteTests(self.path)
+        self.assertEqual(s.limits('a'), {})
+        self._populate(['a.py', 'b.py'])
+        with open(os.path.join(self.path, 'limits.json'), 'w') as fdescr:
+            json.dump({'*': {'cpu': 10, 'memory': 100},
+                       'b': {'memory': 200}}, fdescr)
+        s = pote.PoteTests(self.path)
+        self.assertEqual(s.limits('a'), {'cpu': 10, 'memory': 100})
+        self.assertEqual(s.limits('b'), {'cpu': 10, 'memory': 200})
+        # a job can only tighten the limits
+        self.assertEqual(s.limits('b', {'cpu': 5, 'memory': 300}),
+                         {'cpu': 5, 'memory': 200})
+        self.assertEqual(s.limits('b', {'nofile': 20}),
+                         {'cpu': 10, 'memory': 200, 'nofile': 20})
+
+    def test_watch(self):
+        """
+        Changes are noticed by the watcher.
+        """
+        self.assertWatched(pote.PoteTests(self.path), True)
+
+    def test_poll(self):
+        """
+        Changes are noticed by the watcher without inotify.
+        """
+        self.assertWatched(pote.PoteTests(self.path), False)
+
+    def test_rewatch(self):
+        """
+        The watcher uses inotify again when the removed
+        tests directory reappears.
+        """
+        storage = pote.PoteTests(self.path)
+        storage.watch()
+        self._wait(lambda: storage.watcher.watching)
+        shutil.rmtree(self.path)
+        self._wait(lambda: not storage.watcher.watching)
+        os.makedirs(self.path)
+        self._wait(lambda: storage.watcher.watching)
+        self._write('a.py', '# pote: timeout=30\n')
+        self._wait(lambda: 'a' in storage and
+                   storage.get('a')['timeout'] == 30)
+
+    def test_stats(self):
+        """
+        Statistics of test durations.
+        """
+        self._write('a.py', '')
+        s = pote.PoteTests(self.path)
+        snapshot = s.snapshot()
+        self.assertEqual(s.get('a')['duration'], None)
+        s.record_duration('a', 1, 2, 3, 4)
+        self.assertEqual(s.get('a')['duration'], 2.5)
+        self.assertEqual(snapshot['a']['duration'], None)
+        self.assertEqual(s.get('a')['learned_timeout'], None)
+        s.record_duration('a', 30)
+        self.assertEqual(s.get('a')['learned_timeout'], 60)
+        s.record_duration('a', *([1] * pote.tests.STATS_WINDOW))
+        self.assertEqual(s.get('a')['duration'], 1)
+        self.assertEqual(s.get('a')['learned_timeout'],
+                         pote.tests.TIMEOUT_MIN)
+
+    def assertWatched(self, storage, inotify):
+        """
+        Make assertions for the tests index kept by the watcher.
+
+        :param storage: interface to the tests storage.
+        :type storage: pote.PoteTests
+
+        :param inotify: use inotify
+        :type inotify: boolean
+        """
+        storage.watch(inotify)
+        self.assertMods(storage, [])
+        self._write('a.py', '# pote: timeout=30, nondeterministic\n')
+        self._wait(lambda: 'a' in storage)
+        meta = storage.get('a')
+        self.assertEqual(meta['timeout'], 30)
+        self.assertEqual(meta['options'],
+                         {'timeout': 30, 'nondeterministic': True})
+        self.assertIsNone(meta['duration'])
+        self._write('z/__init__.py', '')
+        self._wait(lambda: 'z' in storage)
+        digest = storage.get('z')['hash']
+        self._write('z/sub/mod.py', 'x = 1\n')
+        self._wait(lambda: storage.get('z')['hash'] != digest)
+        self.assertIsNone(storage.get('z')['timeout'])
+        os.unlink(os.path.join(self.path, 'a.py'))
+        self._wait(lambda: 'a' not in storage)
+        self.assertMods(storage, ['z'])
+        storage.record_duration('z', 2)
+        storage.record_duration('z', 4)
+        self.assertEqual(storage.get('z')['duration'], 3)
+
     def assertMods(self, storage, modules):
         """
         Make assertion for current test list.
@@ -68,6 +168,34 @@ class PoteTestStorageTest(unittest.TestCase):
         """
         self.assertEqual(sorted(storage.available()), sorted(modules))
 
+    def _wait(self, condition):
+        """
+        Wait until the condition is met.
+
+        :param condition: function returning True when the condition is met
+        :type condition: callable
+        """
+        deadline = time.time() + 5
+        while not condition():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.1)
+
+    def _write(self, path, data):
+        """
+        Write a file in the tests directory.
+
+        :param path: path relative to tests dir
+        :type path: string
+
+        :param data: file contents
+        :type data: string
+        """
+        abs_name = os.path.join(self.path, path)
+        if not os.path.isdir(os.path.dirname(abs_name)):
+            os.makedirs(os.path.dirname(abs_name))
+        with open(abs_name, 'w') as fdescr:
+            fdescr.write(data)
+
     def _populate(self, paths):
         """
         Populate tests directory with files and subdirs.
@@ -0,0 +1,135 @@
+"""
+Unit test for the forkserver-style test launcher.
+"""
+
+import logging
+import os
+import os.path
+import shutil
+import sys
+import time
+import unittest
+
+import pote.limits
+import pote.zygote
+
+# the supervisor must be the only one per process
+from process_supervisor import SUPERVISOR
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class PoteZygoteTest(unittest.TestCase):
+    """
+    Unit test for the forkserver-style test launcher.
+    """
+
+    path = 'zygote-launcher.tmp'
+
+    def setUp(self):
+        """
+        Test prepare recipes.
+        """
+        os.makedirs(self.path)
+        self.output_path = os.path.join(self.path, 'stdout.txt')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.abspath('../../tests')
+        # the zygote is started with the same interpreter
+        env['PATH'] = os.path.dirname(sys.executable) + ':' + env['PATH']
+        self.zygote = pote.zygote.PoteZygote(SUPERVISOR, env)
+
+    def tearDown(self):
+        """
+        Test destroy recipes.
+        """
+        if self.zygote.proc is not None:
+            try:
+                self.zygote.proc.kill()
+            except OSError:
+                pass
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+    def test_results(self):
+        """
+        Exit codes and outputs of tests.
+        """
+        self.assertResult('fast_good', 0,
+                          '__main__ started\n__main__: warning\n'
+                          '__main__ done\n')
+        self.assertResult('fast_bad', 1, '__main__ started\n')
+        with open(self.output_path) as fdescr:
+            self.assertIn('Exception', fdescr.read())
+
+    def test_random(self):
+        """
+        Children do not share the state of the preloaded random module.
+        """
+        with open(os.path.join(self.path, 'print_random.py'), 'w') as fdescr:
+            fdescr.write('import random\nprint random.random()\n')
+        outputs = set()
+        for _ in range(3):
+            self.assertResult('print_random', 0)
+            with open(self.output_path) as fdescr:
+                outputs.add(fdescr.read())
+        self.assertEqual(len(outputs), 3)
+
+    def test_limits(self):
+        """
+        Resource limits are applied.
+        """
+        rlimits = pote.limits.rlimits({'fsize': 10})
+        child = self.zygote.spawn(
+            'fast_good', self.path, self.output_path, rlimits)
+        (_stopped, killed) = SUPERVISOR.watch(child, time.time() + 10)
+        self.assertFalse(killed)
+        self.assertEqual(os.path.getsize(self.output_path), 10)
+
+    def test_deadline(self):
+        """
+        Test is killed when its deadline passes.
+        """
+        child = self.zygote.spawn('long_good', self.path, self.output_path)
+        started = time.time()
+        (stopped, killed) = SUPERVISOR.watch(child, started + 0.5)
+        self.assertTrue(killed)
+        self.assertEqual(child.returncode, -9)
+        self.assertLess(stopped - started, 1.5)
+
+    def test_respawn(self):
+        """
+        Dead zygote is restarted.
+        """
+        self.assertResult('fast_good', 0)
+        proc = self.zygote.proc
+        proc.kill()
+        # the reader thread notices the exit and reaps the zygote
+        for _ in range(50):
+            if self.zygote.proc is None:
+                break
+            time.sleep(0.1)
+        self.assertResult('fast_good', 0)
+        self.assertIsNot(self.zygote.proc, proc)
+
+    def assertResult(self, test, returncode, output=None):
+        """
+        Run the test and make assertion for its results.
+
+        :param test: test module name
+        :type test: string
+
+        :param returncode: expected return code
+        :type returncode: integer
+
+        :param output: expected test output
+        :type output: NoneType or string
+        """
+        child = self.zygote.spawn(test, self.path, self.output_path)
+        (_stopped, killed) = SUPERVISOR.watch(child, time.time() + 10)
+        self.assertFalse(killed)
+        self.assertEqual(child.returncode, returncode)
+        self.assertIsNotNone(child.rusage)
+        if output is not None:
+            with open(self.output_path) as fdescr:
+                self.assertTrue(fdescr.read().startswith(output))
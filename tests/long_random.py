@@ -1,3 +1,4 @@
+# pote: nondeterministic
 import random
 import sys
 import time
@@ -3,14 +3,19 @@
 
 var base_url = '/pote';
 var rest_url = base_url + '/rest/';
-var refresh_period = 1; // in seconds
+var refresh_period = 10; // server status check period, in seconds
+var archive_page_size = 100; // how many finished jobs to show
+var events_timeout = 25; // max time to wait for job changes, in seconds
 
 // ----------------------------------------------------------------------
 // Internal variables. Do not touch.
 
 var encoded_tests = "[]";
-var encoded_jobs = "[]";
-var encoded_finished_jobs = "[]";
+var encoded_groups = "{}";
+var jobs = {}; // queued jobs by ID
+var finished_jobs = []; // the latest archived jobs
+var events_cursor = null; // where to resume job changes reading from
+var events_running = false;
 
 // ----------------------------------------------------------------------
 // Functions
@@ -42,7 +47,7 @@ function addJob(){
     // generate a request object
     var obj =
 	{user: edUser.value,
-	 envo: edEnvo.selectedIndex - 1,
+	 envo: edEnvo.options[edEnvo.selectedIndex].envo,
 	 test: edTest.value};
     var encoded = JSON.stringify(obj);
     // send the request
@@ -81,8 +86,11 @@ function updateControls(){
 	    // server is online. update rest of controls
 	    updateEnvos();
 	    updateTestSets();
-	    updateJobList();
-	    updateFinishedJobList();
+	    if(!events_running){
+		events_running = true;
+		events_cursor = null;
+		pollEvents();
+	    }
 	}
 	// schedule next update
 	setTimeout('updateControls()', refresh_period * 1000);
@@ -102,14 +110,30 @@ function updateEnvos(){
     if(req.status != 200) return;
     var edEnvo = document.getElementById("edEnvo");
     var envos_count = JSON.parse(req.responseText)
-    if(envos_count != edEnvo.length - 1){
-	// envos count has been changed.
+    req = createReqObject();
+    req.open("GET", rest_url + "group", false);
+    req.send();
+    if(req.status != 200) return;
+    if(envos_count != edEnvo.envos_count ||
+       encoded_groups != req.responseText){
+	// envos or groups have been changed.
+	edEnvo.envos_count = envos_count;
+	encoded_groups = req.responseText;
+	var groups = Object.keys(JSON.parse(encoded_groups)).sort();
 	while(edEnvo.length) edEnvo.remove(0);
 	edEnvo.add(document.createElement("option"));
+	for(var i = 0; i < groups.length; i++){
+	    var option = document.createElement("option");
+	    option.text = "Group: " + groups[i];
+	    option.value = "group:" + groups[i];
+	    option.envo = groups[i];
+	    edEnvo.add(option)
+	}
 	for(var i = 0; i < envos_count; i++){
 	    var option = document.createElement("option");
 	    option.text = "Envo#" + String(i);
 	    option.value = i;
+	    option.envo = i;
 	    edEnvo.add(option)
 	}
     }
@@ -142,69 +166,125 @@ function updateTestSets(){
 }
 
 /**
- * Update the table with running jobs.
- * Called from updateControls().
+ * Long-poll the server for job changes and apply them to the tables.
+ * Started from updateControls(), reschedules itself until the
+ * server goes offline.
  */
-function updateJobList(){
+function pollEvents(){
+    var url = rest_url + "events?timeout=" + events_timeout;
+    if(events_cursor) url += "&cursor=" + encodeURIComponent(events_cursor);
+    var req = createReqObject();
+    req.onreadystatechange = function(event){
+	if(req.readyState != 4) return;
+	if(req.status != 200){
+	    // updateControls() will restart polling
+	    events_running = false;
+	    return;
+	}
+	var reply = JSON.parse(req.responseText);
+	events_cursor = reply.cursor;
+	if(reply.reset) reloadJobLists();
+	for(var i = 0; i < reply.events.length; i++){
+	    var job = reply.events[i].job;
+	    if(reply.events[i].type == "archive"){
+		delete jobs[job.id];
+		finished_jobs.push(job);
+	    }else{
+		jobs[job.id] = job;
+	    }
+	}
+	finished_jobs.sort(function(a, b){return a.time - b.time;});
+	if(finished_jobs.length > archive_page_size)
+	    finished_jobs.splice(0, finished_jobs.length - archive_page_size);
+	updateJobList();
+	updateFinishedJobList();
+	pollEvents();
+    };
+    req.open("GET", url, true);
+    req.send();
+}
+
+/**
+ * Fetch full lists of queued and finished jobs.
+ * Called from pollEvents() when job changes cannot be resumed.
+ */
+function reloadJobLists(){
     var req = createReqObject();
     req.open("GET", rest_url + "job", false);
     req.send();
-    if(req.status != 200) return;
-    if(encoded_jobs != req.responseText){
-	// job list has been changed
-	encoded_jobs = req.responseText;
-	jobs = JSON.parse(req.responseText);
-	var tbJobs = document.getElementById("tbJobs");
-	// TODO: make incremental table update
-	while(tbJobs.rows.length) tbJobs.deleteRow(0);
-	for(var i = 0; i < jobs.length; i++){
-	    var row = tbJobs.insertRow(tbJobs.rows.length);
-	    row.insertCell(0).innerHTML = unixTimeToString(jobs[i].time);
-	    row.insertCell(1).innerHTML = jobs[i].user;
-	    row.insertCell(2).innerHTML = jobs[i].envo;
-	    row.insertCell(3).innerHTML = jobs[i].test;
-	    row.insertCell(4).innerHTML = formatStartStopTime(jobs[i].started);
-	    row.insertCell(5).innerHTML = formatStatus(jobs[i]);
+    if(req.status == 200){
+	jobs = {};
+	var list = JSON.parse(req.responseText);
+	for(var i = 0; i < list.length; i++) jobs[list[i].id] = list[i];
+    }
+    req = createReqObject();
+    req.open("GET", rest_url + "archive?limit=" + archive_page_size, false);
+    req.send();
+    if(req.status == 200) finished_jobs = JSON.parse(req.responseText);
+}
+
+/**
+ * Update the table with running jobs.
+ * Called from pollEvents().
+ */
+function updateJobList(){
+    var list = [];
+    for(var job_id in jobs) list.push(jobs[job_id]);
+    list.sort(function(a, b){return a.time - b.time;});
+    var tbJobs = document.getElementById("tbJobs");
+    // TODO: make incremental table update
+    while(tbJobs.rows.length) tbJobs.deleteRow(0);
+    for(var i = 0; i < list.length; i++){
+	var row = tbJobs.insertRow(tbJobs.rows.length);
+	row.insertCell(0).innerHTML = unixTimeToString(list[i].time);
+	row.insertCell(1).innerHTML = list[i].user;
+	row.insertCell(2).innerHTML = formatEnvo(list[i]);
+	row.insertCell(3).innerHTML = list[i].test;
+	row.insertCell(4).innerHTML = formatStartStopTime(list[i].started);
+	row.insertCell(5).innerHTML = formatStatus(list[i]);
+	if(list[i].started){
+	    var url = rest_url + "job/" + list[i].id + "/log";
+	    row.insertCell(6).innerHTML =
+		"<a target='_blank' href='" + url + "'>" +
+		"<img src='" + base_url + "/utilities-terminal.png'>" +
+		"</a>";
+	}else{
+	    row.insertCell(6).innerHTML = "&nbsp;";
 	}
     }
 }
 
 /**
  * Update the table with finished jobs.
- * Called from updateControls().
+ * Called from pollEvents().
  */
 function updateFinishedJobList(){
-    var req = createReqObject();
-    req.open("GET", rest_url + "archive", false);
-    req.send();
-    if(req.status != 200) return;
-    if(encoded_finished_jobs != req.responseText){
-	// job list has been changed
-	encoded_finished_jobs = req.responseText;
-	jobs = JSON.parse(req.responseText);
-	var tbArchive = document.getElementById("tbArchive");
-	// TODO: make incremental table update
-	while(tbArchive.rows.length) tbArchive.deleteRow(0);
-	for(var i = 0; i < jobs.length; i++){
-	    var row = tbArchive.insertRow(tbArchive.rows.length);
-	    row.className = (jobs[i].status == "done")?"succeeded":"failed";
-	    row.insertCell(0).innerHTML = unixTimeToString(jobs[i].time);
-	    row.insertCell(1).innerHTML = jobs[i].user;
-	    row.insertCell(2).innerHTML = jobs[i].envo;
-	    row.insertCell(3).innerHTML = jobs[i].test;
-	    row.insertCell(4).innerHTML = formatStartStopTime(jobs[i].started);
-	    row.insertCell(5).innerHTML = formatStartStopTime(jobs[i].stopped);
-	    row.insertCell(6).innerHTML = formatDuration(jobs[i]);
-	    row.insertCell(7).innerHTML = formatStatus(jobs[i]);
-	    if(jobs[i].log){
-		var url = base_url + "/log/" + jobs[i].id + "/" + jobs[i].log;
-		row.insertCell(8).innerHTML =
-		    "<a target='_blank' href='" + url + "'>" +
-		    "<img src='" + base_url + "/utilities-terminal.png'>" +
-		    "</a>";
-	    }else{
-		row.insertCell(8).innerHTML = "&nbsp;";
-	    }
+    var list = finished_jobs;
+    var tbArchive = document.getElementById("tbArchive");
+    // TODO: make incremental table update
+    while(tbArchive.rows.length) tbArchive.deleteRow(0);
+    for(var i = 0; i < list.length; i++){
+	var row = tbArchive.insertRow(tbArchive.rows.length);
+	row.className = (list[i].status == "done")?"succeeded":"failed";
+	row.insertCell(0).innerHTML = unixTimeToString(list[i].time);
+	row.insertCell(1).innerHTML = list[i].user;
+	row.insertCell(2).innerHTML = formatEnvo(list[i]);
+	row.insertCell(3).innerHTML = list[i].test;
+	row.insertCell(4).innerHTML = formatStartStopTime(list[i].started);
+	row.insertCell(5).innerHTML = formatStartStopTime(list[i].stopped);
+	row.insertCell(6).innerHTML = formatDuration(list[i]);
+	row.insertCell(7).innerHTML = formatStatus(list[i]);
+	if(list[i].log || list[i].cached){
+	    // archived outputs can be compressed or packed later
+	    // and reused results have none of their own, so the
+	    // output is not linked as a plain file
+	    var url = rest_url + "job/" + list[i].id + "/log";
+	    row.insertCell(8).innerHTML =
+		"<a target='_blank' href='" + url + "'>" +
+		"<img src='" + base_url + "/utilities-terminal.png'>" +
+		"</a>";
+	}else{
+	    row.insertCell(8).innerHTML = "&nbsp;";
 	}
     }
 }
@@ -221,6 +301,15 @@ function formatStatus(job){
     return job.status.toUpperCase()
 }
 
+/**
+ * Format Job environment.
+ */
+function formatEnvo(job){
+    if(job.group)
+	return String(job.envo) + " (" + job.group + ")";
+    return String(job.envo);
+}
+
 /**
  * Format Job start/stop time.
  */